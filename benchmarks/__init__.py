@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Benchmarks for djangoaudit
+
+Each benchmark module can be run on its own from the root of the checkout,
+e.g.::
+
+    $ python -m benchmarks.snapshot_queries
+
+They use the models in ``tests.fixtures.sampledjango`` with an in-memory SQLite
+database and need a MongoDB server as configured in its settings, unless
+``--mongomock`` is passed to use :mod:`mongomock` instead, or ``--in-memory``
+to use the in-memory storage backend (see :mod:`djangoaudit.memory`).
+
+:mod:`benchmarks.suite` runs them all and records their results as JSON.
+
+"""
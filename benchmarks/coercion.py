@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Measure the cost of making the values of a save BSON compatible as the number
+of installed models grows
+
+The scan over all installed models which was used before the converters were
+looked up by type is measured alongside for comparison.
+
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+
+from benchmarks.utils import make_option_parser, setup_environment, make_pilot
+
+
+def _legacy_coerce_to_bson_compatible(value):
+    """The coercion as it was done before :func:`register_bson_coercion`"""
+    from django.apps import apps
+
+    if isinstance(value, Decimal):
+        return float(value)
+    elif isinstance(value, date) and not isinstance(value, datetime):
+        return datetime.fromordinal(value.toordinal())
+
+    if type(value) in apps.get_models():
+        value = str(value)
+
+    return value
+
+
+def _install_models(count, offset):
+    """Declare ``count`` more models in the sample app"""
+    from django.db import models
+
+    for number in range(offset, offset + count):
+        name = "Filler%d" % number
+        attrs = dict(__module__="tests.fixtures.sampledjango.bsg.models",
+                     name=models.CharField(max_length=30))
+        type(name, (models.Model,), attrs)
+
+
+def _time_per_save(coerce, values, saves):
+    """Return the seconds it takes ``coerce`` to handle ``values`` per save"""
+    from timeit import default_timer
+
+    start = default_timer()
+    for _ in xrange(saves):
+        for value in values:
+            coerce(value)
+    return (default_timer() - start) / saves
+
+
+def run(model_counts=(0, 100, 500, 1000), saves=2000):
+    """
+    Time the coercion of the values of a save with increasing numbers of
+    installed models
+
+    :return: The seconds per save for the current and legacy coercion keyed
+        by the number of additional models
+    :rtype: :class:`dict`
+
+    """
+    from django.apps import apps
+
+    from djangoaudit.models import _coerce_to_bson_compatible
+    from tests.fixtures.sampledjango.bsg.models import Vessel
+
+    pilot = make_pilot(1)
+    pilot.save()
+    vessel = Vessel(name="Raptor 1", pilot=pilot)
+
+    values = [getattr(pilot, field) for field in pilot.log_fields]
+    values.extend([pilot, vessel, date(2000, 1, 1), "operator", None])
+
+    results = {}
+    installed = 0
+    for model_count in model_counts:
+        _install_models(model_count - installed, installed)
+        installed = model_count
+
+        results[model_count] = dict(
+            installed_models=len(apps.get_models()),
+            seconds_per_save=_time_per_save(_coerce_to_bson_compatible,
+                                            values, saves),
+            legacy_seconds_per_save=_time_per_save(
+                _legacy_coerce_to_bson_compatible, values, saves),
+            )
+
+    return results
+
+
+def main():
+    parser = make_option_parser()
+    parser.add_option("--saves", type="int", default=2000,
+                      help="The number of saves to time for each model count")
+    options, args = parser.parse_args()
+
+    setup_environment(options.mongomock, options.in_memory)
+
+    results = run(saves=options.saves)
+
+    print "%-16s %16s %16s" % ("installed models", "us/save", "legacy us/save")
+    for model_count, result in sorted(results.items()):
+        print "%-16d %16.2f %16.2f" % (
+            result['installed_models'],
+            result['seconds_per_save'] * 1e6,
+            result['legacy_seconds_per_save'] * 1e6,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Measure the throughput of decoding audit histories as they grow longer
+
+The decoding of the documents alone is measured alongside the per-value field
+lookups which were used before the decoders were built with the model class.
+
+"""
+
+from datetime import datetime, timedelta
+
+from benchmarks.utils import (make_option_parser, setup_environment,
+                              make_pilot, timed)
+
+
+def _legacy_coerce_data_to_model_types(model, data):
+    """The decoding of a document as it was done before decoding plans"""
+    from django.db.models.fields import DecimalField
+
+    coerced_data = {}
+    for field, value in data.items():
+        if field in model.log_fields:
+            field_inst = model._meta.get_field_by_name(field)[0]
+            if isinstance(field_inst, DecimalField):
+                formatter = "%%%d.%df" % (field_inst.max_digits,
+                                          field_inst.decimal_places)
+                value = formatter % value
+            value = field_inst.to_python(value)
+        coerced_data[field] = value
+    return coerced_data
+
+
+def _make_history(pilot, length):
+    """
+    Record ``length`` changes to every log field of ``pilot`` and return the
+    documents
+
+    """
+    from djangoaudit.models import (AUDITING_COLLECTION, _get_params_from_model,
+                                    _coerce_to_bson_compatible)
+    from djangoaudit.storage import get_storage_backend
+
+    start = datetime(2000, 1, 1)
+    documents = []
+    for number in xrange(length):
+        document = _get_params_from_model(pilot)
+        document['audit_date_stamp'] = start + timedelta(minutes=number)
+        for field in pilot.log_fields:
+            document[field] = _coerce_to_bson_compatible(getattr(pilot, field))
+        document['age'] = number
+        documents.append(document)
+
+    get_storage_backend().insert_many(AUDITING_COLLECTION,
+                                      [dict(document) for document in
+                                       documents])
+    return documents
+
+
+def run(lengths=(10, 100, 1000, 5000)):
+    """
+    Read back histories of each of ``lengths`` changes
+
+    :return: The documents per second read by
+        :meth:`~djangoaudit.models.AuditedModel.get_audit_log` and decoded
+        with and without the decoding plans, keyed by history length
+    :rtype: :class:`dict`
+
+    """
+    from djangoaudit.models import _coerce_data_to_model_types
+
+    results = {}
+    for number, length in enumerate(lengths):
+        pilot = make_pilot(number)
+        pilot.save()
+        documents = _make_history(pilot, length)
+
+        _, read_seconds = timed(list, pilot.get_audit_log())
+        _, decode_seconds = timed(
+            lambda: [_coerce_data_to_model_types(pilot, document) for
+                     document in documents])
+        _, legacy_decode_seconds = timed(
+            lambda: [_legacy_coerce_data_to_model_types(pilot, document) for
+                     document in documents])
+
+        results[length] = dict(
+            audit_log_docs_per_second=length / read_seconds,
+            decode_docs_per_second=length / decode_seconds,
+            legacy_decode_docs_per_second=length / legacy_decode_seconds,
+            )
+
+    return results
+
+
+def main():
+    parser = make_option_parser()
+    options, args = parser.parse_args()
+
+    setup_environment(options.mongomock, options.in_memory)
+
+    results = run()
+
+    print "%-8s %18s %18s %18s" % ("length", "get_audit_log/s", "decode/s",
+                                   "legacy decode/s")
+    for length, result in sorted(results.items()):
+        print "%-8d %18.0f %18.0f %18.0f" % (
+            length,
+            result['audit_log_docs_per_second'],
+            result['decode_docs_per_second'],
+            result['legacy_decode_docs_per_second'],
+            )
+
+
+if __name__ == "__main__":
+    main()
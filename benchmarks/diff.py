@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Measure the cost of working out the audit document of a change, including
+making its values BSON compatible
+
+Nothing is written to MongoDB.
+
+"""
+
+from benchmarks.utils import make_option_parser, setup_environment, make_pilot
+
+
+def _time_per_call(function, args, calls):
+    from timeit import default_timer
+
+    start = default_timer()
+    for _ in xrange(calls):
+        function(*args)
+    return (default_timer() - start) / calls
+
+
+def run(calls=5000):
+    """
+    Build the audit documents of a creation, of a change to one field and of
+    a save without changes ``calls`` times each
+
+    :return: The seconds per document and per coerced value, keyed by case
+    :rtype: :class:`dict`
+
+    """
+    from djangoaudit.models import (_coerce_to_bson_compatible,
+                                    _make_audit_document)
+
+    pilot = make_pilot(1)
+    pilot.pk = 1
+    values = pilot._get_log_values()
+    changed_values = dict(values, age=values['age'] + 1)
+
+    cases = dict(
+        creation=(dict.fromkeys(values), values),
+        one_field=(values, changed_values),
+        no_change=(values, values),
+        )
+
+    results = {}
+    for case, (initial_values, final_values) in cases.iteritems():
+        results[case] = dict(seconds_per_document=_time_per_call(
+            _make_audit_document, (pilot, initial_values, final_values),
+            calls))
+
+    coercion_seconds = _time_per_call(
+        lambda: [_coerce_to_bson_compatible(value) for value in
+                 values.itervalues()], (), calls)
+    results['coercion'] = dict(seconds_per_value=coercion_seconds /
+                               len(values))
+
+    return results
+
+
+def main():
+    parser = make_option_parser()
+    parser.add_option("--calls", type="int", default=5000,
+                      help="The number of documents to build per case")
+    options, args = parser.parse_args()
+
+    setup_environment(options.mongomock, options.in_memory)
+
+    results = run(options.calls)
+
+    for case in ('creation', 'one_field', 'no_change'):
+        print "%-24s %10.2f us" % (
+            case, results[case]['seconds_per_document'] * 1e6)
+    print "%-24s %10.2f us" % ("coercion per value",
+                               results['coercion']['seconds_per_value'] * 1e6)
+
+
+if __name__ == "__main__":
+    main()
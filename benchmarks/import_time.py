@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Measure what importing djangoaudit adds to the startup of Django
+
+Each measurement is made in a fresh interpreter, with and without djangoaudit
+in ``INSTALLED_APPS``. The cost of creating the MongoDB client, which used to
+be paid when :mod:`djangoaudit.connection` was imported, is measured too.
+
+No MongoDB server is needed: the client connects in the background.
+
+"""
+
+import json
+import subprocess
+import sys
+
+from benchmarks.utils import make_option_parser
+
+_STARTUP_SCRIPT = """
+import json
+from timeit import default_timer
+
+from django.conf import settings
+settings.configure(
+    INSTALLED_APPS=%(installed_apps)r,
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3',
+                           'NAME': ':memory:'}},
+    MONGO_HOST='localhost',
+    MONGO_PORT=27017,
+    MONGO_DATABASE_NAME='django-audit-benchmarks',
+    )
+
+import django
+
+start = default_timer()
+django.setup()
+setup_seconds = default_timer() - start
+
+result = dict(setup_seconds=setup_seconds)
+
+if 'djangoaudit' in settings.INSTALLED_APPS:
+    import djangoaudit.models
+    from djangoaudit.connection import MONGO_CONNECTION
+
+    result['client_created_at_import'] = \\
+        MONGO_CONNECTION._connection is not None
+
+    start = default_timer()
+    MONGO_CONNECTION.connection
+    result['client_seconds'] = default_timer() - start
+    MONGO_CONNECTION.close()
+
+print json.dumps(result)
+"""
+
+_BASE_APPS = ['django.contrib.contenttypes', 'django.contrib.auth']
+
+
+def _measure_startup(installed_apps):
+    """Return the timings of the startup script in a fresh interpreter"""
+
+    script = _STARTUP_SCRIPT % dict(installed_apps=installed_apps)
+    output = subprocess.check_output([sys.executable, "-c", script])
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def run(runs=10):
+    """
+    Start Django ``runs`` times with and without djangoaudit
+
+    :return: The median seconds taken by ``django.setup()`` without and with
+        djangoaudit, the median seconds taken to create the client and whether
+        it was created by the import
+    :rtype: :class:`dict`
+
+    """
+
+    # Alternate between the two so that they are equally affected by caches
+    # warming up:
+    baseline = []
+    audited = []
+    for _ in xrange(runs):
+        baseline.append(_measure_startup(_BASE_APPS))
+        audited.append(_measure_startup(_BASE_APPS + ['djangoaudit']))
+
+    return dict(
+        baseline_setup_seconds=_median([result['setup_seconds'] for result in
+                                        baseline]),
+        setup_seconds=_median([result['setup_seconds'] for result in
+                               audited]),
+        client_seconds=_median([result['client_seconds'] for result in
+                                audited]),
+        client_created_at_import=any(result['client_created_at_import'] for
+                                     result in audited),
+        )
+
+
+def main():
+    parser = make_option_parser()
+    parser.add_option("--runs", type="int", default=10,
+                      help="The number of interpreters to start for each "
+                           "measurement")
+    options, args = parser.parse_args()
+
+    results = run(options.runs)
+
+    print "django.setup() without djangoaudit: %8.1f ms" % (
+        results['baseline_setup_seconds'] * 1e3)
+    print "django.setup() with djangoaudit:    %8.1f ms" % (
+        results['setup_seconds'] * 1e3)
+    print "Added by djangoaudit:               %8.1f ms" % (
+        (results['setup_seconds'] - results['baseline_setup_seconds']) * 1e3)
+    print "Creating the MongoDB client:        %8.1f ms (%s)" % (
+        results['client_seconds'] * 1e3,
+        "at import" if results['client_created_at_import'] else "on first use")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Measure what auditing adds to the creation, update and deletion of an instance
+
+Each operation is timed through :class:`~djangoaudit.models.AuditedModel` and
+through the plain :class:`django.db.models.Model` methods on the same table,
+which record nothing.
+
+"""
+
+from benchmarks.utils import (make_option_parser, setup_environment,
+                              make_pilot, timed)
+
+
+def _time_per_object(operation, objects):
+    _, elapsed = timed(lambda: [operation(obj) for obj in objects])
+    return elapsed / len(objects)
+
+
+def run(objects=200):
+    """
+    Create, update and delete ``objects`` pilots with and without auditing
+
+    :return: The seconds per object with and without auditing, keyed by
+        operation
+    :rtype: :class:`dict`
+
+    """
+    from django.db.models import Model
+
+    def change(save):
+        def update(pilot):
+            pilot.age += 1
+            save(pilot)
+        return update
+
+    audited = [make_pilot(number) for number in xrange(objects)]
+    plain = [make_pilot(number) for number in xrange(objects)]
+
+    results = {}
+    for operation, audited_operation, plain_operation in (
+        ('create', lambda pilot: pilot.save(), Model.save),
+        ('save', change(lambda pilot: pilot.save()), change(Model.save)),
+        ('delete', lambda pilot: pilot.delete(), Model.delete),
+        ):
+        seconds = _time_per_object(audited_operation, audited)
+        plain_seconds = _time_per_object(plain_operation, plain)
+
+        results[operation] = dict(
+            seconds_per_object=seconds,
+            plain_seconds_per_object=plain_seconds,
+            overhead_seconds_per_object=seconds - plain_seconds,
+            )
+
+    return results
+
+
+def main():
+    parser = make_option_parser()
+    parser.add_option("--objects", type="int", default=200,
+                      help="The number of objects per operation")
+    options, args = parser.parse_args()
+
+    setup_environment(options.mongomock, options.in_memory)
+
+    results = run(options.objects)
+
+    print "%-8s %16s %16s %16s" % ("", "ms/object", "plain ms/object",
+                                   "overhead ms")
+    for operation in ('create', 'save', 'delete'):
+        result = results[operation]
+        print "%-8s %16.3f %16.3f %16.3f" % (
+            operation,
+            result['seconds_per_object'] * 1e3,
+            result['plain_seconds_per_object'] * 1e3,
+            result['overhead_seconds_per_object'] * 1e3,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Measure the SQL queries and time per update of an audited model for each of the
+snapshot strategies
+
+"""
+
+from benchmarks.utils import (make_option_parser, setup_environment,
+                              make_pilot, timed)
+
+
+def run(saves=200):
+    """
+    Update ``saves`` pilots under each snapshot strategy
+
+    :return: The queries and seconds per save keyed by strategy
+    :rtype: :class:`dict`
+
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from djangoaudit.models import SNAPSHOT_STRATEGIES
+    from tests.fixtures.sampledjango.bsg.models import Pilot
+
+    for number in range(saves):
+        make_pilot(number).save()
+
+    results = {}
+    original_strategy = Pilot.audit_snapshot
+    try:
+        for strategy in SNAPSHOT_STRATEGIES:
+            Pilot.audit_snapshot = strategy
+            pilots = list(Pilot.objects.all()[:saves])
+
+            def update_all():
+                for pilot in pilots:
+                    pilot.age += 1
+                    pilot.save()
+
+            with CaptureQueriesContext(connection) as queries:
+                _, elapsed = timed(update_all)
+
+            results[strategy] = dict(
+                queries_per_save=float(len(queries)) / len(pilots),
+                seconds_per_save=elapsed / len(pilots),
+                )
+    finally:
+        Pilot.audit_snapshot = original_strategy
+
+    return results
+
+
+def main():
+    parser = make_option_parser()
+    parser.add_option("--saves", type="int", default=200,
+                      help="The number of saves per strategy")
+    options, args = parser.parse_args()
+
+    setup_environment(options.mongomock, options.in_memory)
+
+    results = run(options.saves)
+
+    print "%-12s %16s %16s" % ("strategy", "queries/save", "ms/save")
+    for strategy, result in sorted(results.items()):
+        print "%-12s %16.2f %16.3f" % (strategy, result['queries_per_save'],
+                                       result['seconds_per_save'] * 1000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Measure the cost of reconstructing the state of an instance as its history
+grows, with and without checkpoints
+
+"""
+
+from benchmarks.utils import (make_option_parser, setup_environment,
+                              make_pilot, timed)
+
+
+def _make_history(number, length, checkpoint_interval):
+    """
+    Save a new pilot and change it ``length`` times with checkpoints every
+    ``checkpoint_interval`` changes
+
+    """
+    from tests.fixtures.sampledjango.bsg.models import Pilot
+
+    Pilot.audit_checkpoint_interval = checkpoint_interval
+    try:
+        pilot = make_pilot(number)
+        pilot.save()
+        for change in xrange(length):
+            pilot.age = change
+            pilot.save()
+    finally:
+        del Pilot.audit_checkpoint_interval
+
+    return pilot
+
+
+def run(lengths=(10, 100, 1000), checkpoint_interval=50, repeats=20):
+    """
+    Time :meth:`~djangoaudit.models.AuditedModel.get_state_at` for histories
+    of each of ``lengths`` changes
+
+    :return: The seconds per call without and with checkpoints every
+        ``checkpoint_interval`` changes, keyed by history length
+    :rtype: :class:`dict`
+
+    """
+
+    def get_states(pilot):
+        for _ in xrange(repeats):
+            pilot.get_state_at()
+
+    results = {}
+    for number, length in enumerate(lengths):
+        without = _make_history(number * 2, length, None)
+        with_checkpoints = _make_history(number * 2 + 1, length,
+                                         checkpoint_interval)
+
+        _, seconds = timed(get_states, without)
+        _, checkpoint_seconds = timed(get_states, with_checkpoints)
+
+        results[length] = dict(
+            seconds_per_call=seconds / repeats,
+            checkpoint_seconds_per_call=checkpoint_seconds / repeats,
+            )
+
+    return results
+
+
+def main():
+    parser = make_option_parser()
+    parser.add_option("--interval", type="int", default=50,
+                      help="The number of changes between checkpoints")
+    options, args = parser.parse_args()
+
+    setup_environment(options.mongomock, options.in_memory)
+
+    results = run(checkpoint_interval=options.interval)
+
+    print "%-8s %16s %20s" % ("length", "ms/call", "with checkpoints")
+    for length, result in sorted(results.items()):
+        print "%-8d %16.2f %20.2f" % (
+            length,
+            result['seconds_per_call'] * 1e3,
+            result['checkpoint_seconds_per_call'] * 1e3,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Run the benchmarks together and record their results as JSON, optionally
+comparing them with the results of an earlier run
+
+The results of each benchmark are flattened into metrics named after the
+benchmark and the keys of its results, e.g. ``decode.1000.decode_docs_per_second``::
+
+    $ python -m benchmarks.suite --mongomock --output results.json
+    $ python -m benchmarks.suite --mongomock --compare results.json
+
+The metrics named ``*_per_second`` are better when higher, all others when
+lower. The comparison exits with status 1 if any metric got worse by more
+than the tolerance.
+
+"""
+
+from datetime import datetime
+import json
+import platform
+import sys
+
+from benchmarks.utils import (make_option_parser, setup_environment,
+                              clear_audit_documents)
+
+BENCHMARKS = (
+    # Name, keyword arguments to run() for a full run and for a quick one:
+    ('import_time', dict(), dict(runs=3)),
+    ('diff', dict(), dict(calls=1000)),
+    ('overhead', dict(), dict(objects=50)),
+    ('snapshot_queries', dict(), dict(saves=50)),
+    ('decode', dict(), dict(lengths=(10, 100, 500))),
+    ('state_at', dict(), dict(lengths=(10, 100), repeats=5)),
+    # Last, as it installs more models:
+    ('coercion', dict(), dict(model_counts=(0, 100), saves=500)),
+    )
+"""The benchmarks of the suite in the order they are run"""
+
+
+def _flatten(results, prefix):
+    """Generate the numeric values in ``results`` along with their name"""
+
+    for key, value in sorted(results.items()):
+        name = "%s.%s" % (prefix, key)
+        if isinstance(value, dict):
+            for metric in _flatten(value, name):
+                yield metric
+        elif isinstance(value, (int, long, float)) and \
+             not isinstance(value, bool):
+            yield name, value
+
+
+def _get_environment(use_mongomock, use_memory):
+    import django
+    import pymongo
+
+    return dict(
+        python=platform.python_version(),
+        django=django.get_version(),
+        pymongo=pymongo.version,
+        mongodb=("memory" if use_memory else
+                 "mongomock" if use_mongomock else "server"),
+        platform=platform.platform(),
+        started_at=datetime.utcnow().isoformat(),
+        )
+
+
+def run(names=None, quick=False, use_mongomock=False, use_memory=False):
+    """
+    Run the benchmarks in ``names`` (all of them by default)
+
+    :param quick: Whether to run the benchmarks with smaller workloads
+    :type quick: :class:`bool`
+    :return: The environment of the run and the metrics of the benchmarks
+    :rtype: :class:`dict`
+
+    """
+    setup_environment(use_mongomock, use_memory)
+
+    metrics = {}
+    for name, arguments, quick_arguments in BENCHMARKS:
+        if names and name not in names:
+            continue
+
+        clear_audit_documents()
+        module = __import__("benchmarks.%s" % name, fromlist=["run"])
+        results = module.run(**(quick_arguments if quick else arguments))
+        metrics.update(_flatten(results, name))
+
+    return dict(environment=_get_environment(use_mongomock, use_memory),
+                metrics=metrics)
+
+
+def compare(baseline, current, tolerance=0.2):
+    """
+    Compare the metrics of ``current`` with those of ``baseline``
+
+    :param tolerance: The relative change in a metric beyond which it is
+        reported as a regression or an improvement
+    :type tolerance: :class:`float`
+    :return: The name, baseline value, current value, relative change and
+        verdict (``"regression"``, ``"improvement"`` or ``"ok"``) of each
+        metric in both runs
+    :rtype: :class:`list`
+
+    """
+    comparisons = []
+    for name, value in sorted(current['metrics'].items()):
+        baseline_value = baseline['metrics'].get(name)
+        if baseline_value is None:
+            continue
+
+        if baseline_value:
+            change = float(value - baseline_value) / abs(baseline_value)
+        else:
+            change = 0.0 if value == baseline_value else float('inf')
+
+        worse = -change if name.endswith("_per_second") else change
+        if worse > tolerance:
+            verdict = "regression"
+        elif worse < -tolerance:
+            verdict = "improvement"
+        else:
+            verdict = "ok"
+
+        comparisons.append((name, baseline_value, value, change, verdict))
+
+    return comparisons
+
+
+def main():
+    parser = make_option_parser()
+    parser.add_option("--benchmark", action="append", dest="names",
+                      help="Only run this benchmark; can be given more than "
+                           "once (one of: %s)" %
+                           ", ".join(name for name, _, _ in BENCHMARKS))
+    parser.add_option("--quick", action="store_true", default=False,
+                      help="Run the benchmarks with smaller workloads")
+    parser.add_option("--output", default=None,
+                      help="The file to write the results to (defaults to "
+                           "the standard output)")
+    parser.add_option("--compare", default=None,
+                      help="A file with the results of an earlier run to "
+                           "compare these with")
+    parser.add_option("--tolerance", type="float", default=0.2,
+                      help="The relative change in a metric beyond which it "
+                           "is reported")
+    options, args = parser.parse_args()
+
+    results = run(options.names, options.quick, options.mongomock,
+                  options.in_memory)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, "w") as output_file:
+            output_file.write(output + "\n")
+    elif not options.compare:
+        print output
+
+    if not options.compare:
+        return
+
+    with open(options.compare) as baseline_file:
+        baseline = json.load(baseline_file)
+
+    comparisons = compare(baseline, results, options.tolerance)
+    print "%-56s %12s %12s %8s" % ("metric", "baseline", "current", "change")
+    for name, baseline_value, value, change, verdict in comparisons:
+        print "%-56s %12.6g %12.6g %+7.1f%% %s" % (
+            name, baseline_value, value, change * 100,
+            "" if verdict == "ok" else verdict.upper())
+
+    if any(verdict == "regression" for _, _, _, _, verdict in comparisons):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Helpers shared by the benchmarks"""
+
+from datetime import datetime
+from decimal import Decimal
+from optparse import OptionParser
+import os
+import time
+
+__all__ = ["make_option_parser", "setup_environment", "clear_audit_documents",
+           "make_pilot", "timed"]
+
+
+def make_option_parser(usage=None):
+    """
+    Return an option parser with the options common to all benchmarks
+
+    :rtype: :class:`optparse.OptionParser`
+
+    """
+    parser = OptionParser(usage=usage)
+    parser.add_option(
+        "--mongomock",
+        action="store_true",
+        default=False,
+        help="Use mongomock (from the benchmarks extra) instead of the "
+             "MongoDB server in the settings",
+        )
+    parser.add_option(
+        "--in-memory",
+        action="store_true",
+        default=False,
+        dest="in_memory",
+        help="Keep the audit documents in memory instead of the MongoDB "
+             "server in the settings (see djangoaudit.memory)",
+        )
+    return parser
+
+
+def setup_environment(use_mongomock=False, use_memory=False):
+    """
+    Configure Django, create the tables for the sample models and empty the
+    auditing collections.
+
+    :param use_mongomock: Whether to use :mod:`mongomock` instead of a MongoDB
+        server
+    :type use_mongomock: :class:`bool`
+    :param use_memory: Whether to use the in-memory storage backend instead of
+        a MongoDB server
+    :type use_memory: :class:`bool`
+
+    """
+    os.environ['DJANGO_SETTINGS_MODULE'] = "benchmarks.settings"
+
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    django.setup()
+    call_command('migrate', interactive=False, verbosity=0)
+
+    from djangoaudit.connection import MONGO_CONNECTION
+    from djangoaudit.storage import MEMORY_STORAGE
+
+    if use_memory:
+        settings.AUDIT_STORAGE_BACKEND = MEMORY_STORAGE
+    elif use_mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+        MONGO_CONNECTION._database = client[settings.MONGO_DATABASE_NAME]
+
+    clear_audit_documents()
+
+
+def clear_audit_documents():
+    """Drop the collections of the audit documents of the sample models"""
+    from djangoaudit.connection import MONGO_CONNECTION
+    from djangoaudit.memory import MemoryStorage
+    from djangoaudit.models import get_audit_collection_names
+    from djangoaudit.storage import get_storage_backend
+
+    storage = get_storage_backend()
+    if isinstance(storage, MemoryStorage):
+        storage.clear()
+        return
+
+    for collection_name in get_audit_collection_names(include_partitions=True):
+        MONGO_CONNECTION.database.drop_collection(collection_name)
+
+
+def make_pilot(number, **overrides):
+    """
+    Return an unsaved :class:`Pilot` whose values are derived from ``number``
+
+    """
+    from tests.fixtures.sampledjango.bsg.models import Pilot
+
+    params = dict(first_name="First %d" % number,
+                  last_name="Last %d" % number,
+                  call_sign="Pilot %d" % number,
+                  age=20 + number % 40,
+                  last_flight=datetime(2000, 1, 1, 12, 0),
+                  craft=number % 2,
+                  is_cylon=False,
+                  fastest_landing=Decimal("50.00"))
+    params.update(overrides)
+    return Pilot(**params)
+
+
+def timed(function, *args, **kwargs):
+    """
+    Call ``function`` and return its result along with how long it took in
+    seconds
+
+    """
+    start = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start
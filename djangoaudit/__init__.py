@@ -1,3 +1,3 @@
-import connection
-import forms
-import models
+from djangoaudit.instrumentation import reset_stats, stats
+
+default_app_config = "djangoaudit.apps.AuditConfig"
\ No newline at end of file
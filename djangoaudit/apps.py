@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+The Django application configuration for django-audit
+
+"""
+
+from logging import getLogger
+
+from django.apps import AppConfig
+from django.conf import settings
+from pymongo.errors import PyMongoError
+
+__all__ = ['AuditConfig']
+
+_LOGGER = getLogger(__name__)
+
+class AuditConfig(AppConfig):
+    """
+    If the ``AUDIT_ENSURE_INDEXES`` setting is ``True``, create any missing
+    indexes on the auditing collections and their partitions (and the audit
+    stream mirror collection, if enabled) when Django starts up.
+
+    """
+
+    name = 'djangoaudit'
+    verbose_name = "Audit"
+
+    def ready(self):
+        if not getattr(settings, 'AUDIT_ENSURE_INDEXES', False):
+            return
+
+        from djangoaudit.connection import (MONGO_CONNECTION,
+                                            MongoConnectionError)
+        from djangoaudit.indexes import ensure_indexes
+        from djangoaudit.models import get_audit_collection_names
+        from djangoaudit.storage import require_mongo_storage
+        from djangoaudit.stream import ensure_mirror_collection
+
+        try:
+            require_mongo_storage("Ensuring the indexes")
+            for name in get_audit_collection_names(include_partitions=True):
+                collection = MONGO_CONNECTION.get_collection(name)
+                ensure_indexes(collection)
+            ensure_mirror_collection(collection.database)
+        except (MongoConnectionError, PyMongoError,
+                NotImplementedError), exc:
+            _LOGGER.critical("Could not ensure the indexes on the auditing "
+                             "collections: %s", exc)
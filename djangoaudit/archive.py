@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Archival of the audit documents which have outlived the retention period of
+their model to compressed files, and their restoration.
+
+The documents of each model are written in date order to gzipped files of
+JSON lines (in the MongoDB extended JSON format) or of BSON documents. Each
+file is listed in the manifest of the archive directory once it is complete,
+and only then are its documents deleted from MongoDB.
+
+"""
+
+from datetime import datetime, timedelta
+import gzip
+from logging import getLogger
+import os
+import time
+
+from bson import BSON, decode_file_iter, json_util
+from django.apps import apps
+from django.conf import settings
+
+from djangoaudit.models import (AuditedModel, RETENTION_ARCHIVE,
+                                _find_in_collection,
+                                _get_collection_handler, _get_partition,
+                                _get_partitions, _get_schema_queries)
+from djangoaudit.schema import get_stored_key
+from djangoaudit.spool import _insert_skipping_duplicates
+from djangoaudit.storage import require_mongo_storage
+
+__all__ = ["ARCHIVE_JSON", "ARCHIVE_BSON", "AuditArchive", "get_audit_archive",
+           "read_archive_file"]
+
+_LOGGER = getLogger(__name__)
+
+ARCHIVE_JSON = 'jsonl'
+"""Archive the documents as lines of MongoDB extended JSON"""
+
+ARCHIVE_BSON = 'bson'
+"""Archive the documents as BSON, as ``mongodump`` does"""
+
+_ARCHIVE_FORMATS = (ARCHIVE_JSON, ARCHIVE_BSON)
+
+_MANIFEST_NAME = "manifest.json"
+
+_JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.RELAXED,
+                                      tz_aware=False)
+
+
+def read_archive_file(path, archive_format):
+    """
+    Generate the documents in the archive file at ``path``, in the order they
+    were archived and in the schema they were recorded in
+
+    :param path: The path to the file
+    :type path: :class:`basestring`
+    :param archive_format: :data:`ARCHIVE_JSON` or :data:`ARCHIVE_BSON`
+
+    """
+
+    archive_file = gzip.open(path, 'rb')
+    try:
+        if archive_format == ARCHIVE_BSON:
+            for document in decode_file_iter(archive_file):
+                yield document
+        else:
+            for line in archive_file:
+                yield json_util.loads(line, json_options=_JSON_OPTIONS)
+    finally:
+        archive_file.close()
+
+
+def _get_model_label(model):
+    return "%s.%s" % (model._meta.app_label, model._meta.object_name)
+
+
+class _ArchiveFile(object):
+    """A file of the archive being written"""
+
+    def __init__(self, directory, name, archive_format):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.archive_format = archive_format
+
+        self.size = 0
+        self.documents = 0
+        self.first_date_stamp = None
+        self.last_date_stamp = None
+
+        self._raw_file = open(self.path + ".tmp", 'wb')
+        self._file = gzip.GzipFile(fileobj=self._raw_file, mode='wb')
+
+    def write(self, document):
+        if self.archive_format == ARCHIVE_BSON:
+            data = BSON.encode(document)
+        else:
+            data = json_util.dumps(document, json_options=_JSON_OPTIONS) + "\n"
+
+        self._file.write(data)
+        self.size += len(data)
+        self.documents += 1
+
+        date_stamp = document[get_stored_key(document, 'audit_date_stamp')]
+        if self.first_date_stamp is None:
+            self.first_date_stamp = date_stamp
+        self.last_date_stamp = date_stamp
+
+    def seal(self):
+        """Flush the file to disk and give it its final name"""
+
+        self._file.close()
+        self._raw_file.flush()
+        os.fsync(self._raw_file.fileno())
+        self._raw_file.close()
+        os.rename(self.path + ".tmp", self.path)
+
+
+class AuditArchive(object):
+    """
+    Archive the expired audit documents of models to, and restore them from,
+    the files in ``directory``.
+
+    """
+
+    def __init__(self, directory, archive_format=ARCHIVE_JSON,
+                 file_size=64 * 1024 * 1024, batch_size=1000, pause=0):
+        """
+
+        :param directory: The directory holding the archive
+        :type directory: :class:`basestring`
+        :param archive_format: :data:`ARCHIVE_JSON` or :data:`ARCHIVE_BSON`
+        :param file_size: The size (in bytes, before compression) at which a
+            file is completed and a new one started
+        :type file_size: :class:`int`
+        :param batch_size: The maximum number of documents per delete or
+            insert
+        :type batch_size: :class:`int`
+        :param pause: The seconds to wait between deletes, to leave room for
+            the rest of the load on MongoDB
+        :type pause: :class:`float`
+        :raises ValueError: If ``archive_format`` is unknown
+
+        """
+
+        if archive_format not in _ARCHIVE_FORMATS:
+            raise ValueError("Unknown archive format %r; expected one of %r" %
+                             (archive_format, _ARCHIVE_FORMATS))
+
+        self.directory = directory
+        self.archive_format = archive_format
+        self.file_size = file_size
+        self.batch_size = batch_size
+        self.pause = pause
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def read_manifest(self):
+        """
+        Return the entries of the manifest, one for each file in the archive
+        in the order they were written
+
+        :rtype: :class:`list` of :class:`dict`
+
+        """
+
+        path = os.path.join(self.directory, _MANIFEST_NAME)
+        if not os.path.exists(path):
+            return []
+
+        manifest_file = open(path)
+        try:
+            return json_util.loads(manifest_file.read(),
+                                   json_options=_JSON_OPTIONS)
+        finally:
+            manifest_file.close()
+
+    def _add_to_manifest(self, entry):
+        entries = self.read_manifest()
+        entries.append(entry)
+
+        # Replace the manifest in one go, so that it's never left half written:
+        path = os.path.join(self.directory, _MANIFEST_NAME)
+        manifest_file = open(path + ".tmp", 'w')
+        try:
+            manifest_file.write(json_util.dumps(entries, indent=2,
+                                                json_options=_JSON_OPTIONS))
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        finally:
+            manifest_file.close()
+        os.rename(path + ".tmp", path)
+
+    def archive(self, models=None, now=None):
+        """
+        Archive the expired audit documents of ``models``
+
+        Only the models with an
+        :attr:`~djangoaudit.models.AuditedModel.audit_retention_days` and the
+        :data:`~djangoaudit.models.RETENTION_ARCHIVE` policy are archived.
+
+        :param models: The models to archive; defaults to all the installed
+            audited models
+        :param now: The time to work out which documents have expired from
+        :type now: :class:`datetime.datetime`
+        :return: The number of documents archived by model label
+        :rtype: :class:`dict`
+        :raises djangoaudit.connection.MongoConnectionError: If MongoDB is
+            unavailable
+        :raises NotImplementedError: If the MongoDB storage backend isn't
+            selected
+
+        """
+
+        require_mongo_storage("The archival of audit documents")
+
+        if models is None:
+            models = [model for model in apps.get_models() if
+                      issubclass(model, AuditedModel)]
+        now = now or datetime.utcnow()
+
+        archived = {}
+        for model in models:
+            if model.audit_retention_days and \
+               model.audit_retention_policy == RETENTION_ARCHIVE:
+                expiry = now - timedelta(days=model.audit_retention_days)
+                archived[_get_model_label(model)] = self._archive_model(model,
+                                                                        expiry)
+        return archived
+
+    def _archive_model(self, model, expiry):
+        """
+        Archive the audit documents of ``model`` recorded before ``expiry``
+
+        The documents restored from the archive are deleted once they have
+        been restored for as long as the retention period, without being
+        archived again.
+
+        """
+
+        collection = model._audit_collection
+        query = dict(object_app=model._meta.app_label,
+                     object_model=model._meta.object_name,
+                     audit_date_stamp={'$lt': expiry})
+        query['$or'] = [{'audit_restored_at': {'$exists': False}},
+                        {'audit_restored_at': {'$lt': expiry}}]
+
+        schema_queries = _get_schema_queries(model, query)
+
+        archive_file = None
+        archived_ids = []
+        archived = 0
+
+        for partition in _get_partitions(collection, until=expiry):
+            # The documents are archived in the schema they were recorded in:
+            documents = _find_in_collection(partition, schema_queries,
+                                            batch_size=self.batch_size,
+                                            decode=False)
+            for document in documents:
+                archived_ids.append((partition, document['_id']))
+
+                if get_stored_key(document, 'audit_restored_at') not in \
+                   document:
+                    if archive_file is None:
+                        archive_file = self._open_file(model, document)
+                    archive_file.write(document)
+                    archived += 1
+
+                if archive_file is None:
+                    # Only restored documents so far:
+                    if len(archived_ids) >= self.batch_size:
+                        self._delete(archived_ids)
+                        archived_ids = []
+                elif archive_file.size >= self.file_size:
+                    self._complete_file(model, archive_file, archived_ids)
+                    archive_file = None
+                    archived_ids = []
+
+        if archive_file is not None:
+            self._complete_file(model, archive_file, archived_ids)
+        elif archived_ids:
+            self._delete(archived_ids)
+
+        return archived
+
+    def _open_file(self, model, first_document):
+        date_stamp = first_document[get_stored_key(first_document,
+                                                   'audit_date_stamp')]
+        name = "%s-%s-%s-%s.%s.gz" % (
+            model._audit_collection.collection_name,
+            _get_model_label(model),
+            date_stamp.strftime("%Y%m%dT%H%M%S"),
+            first_document['_id'],
+            self.archive_format,
+            )
+        return _ArchiveFile(self.directory, name, self.archive_format)
+
+    def _complete_file(self, model, archive_file, archived_ids):
+        """
+        Add ``archive_file`` to the manifest once it's on disk, and only then
+        delete its documents from MongoDB
+
+        """
+
+        archive_file.seal()
+        self._add_to_manifest(dict(
+            file=archive_file.name,
+            format=archive_file.archive_format,
+            collection=model._audit_collection.collection_name,
+            model=_get_model_label(model),
+            documents=archive_file.documents,
+            first_date_stamp=archive_file.first_date_stamp,
+            last_date_stamp=archive_file.last_date_stamp,
+            ))
+        _LOGGER.info("Archived %d documents to %s", archive_file.documents,
+                     archive_file.name)
+
+        self._delete(archived_ids)
+
+    def _delete(self, archived_ids):
+        """Delete the documents identified in ``archived_ids`` in batches"""
+
+        for start in xrange(0, len(archived_ids), self.batch_size):
+            batch = archived_ids[start:start + self.batch_size]
+
+            ids_by_partition = {}
+            for partition, object_id in batch:
+                ids_by_partition.setdefault(partition, []).append(object_id)
+
+            for partition, object_ids in ids_by_partition.iteritems():
+                partition().delete_many({'_id': {'$in': object_ids}})
+
+            if self.pause:
+                time.sleep(self.pause)
+
+    def restore(self, since=None, until=None, model_labels=None):
+        """
+        Write the archived documents recorded between ``since`` and ``until``
+        back to MongoDB
+
+        The documents still in MongoDB are skipped, so a range can be restored
+        more than once. The documents restored are marked with the
+        time they were restored at in ``audit_restored_at``.
+
+        :param since: The earliest time of the documents to restore
+        :type since: :class:`datetime.datetime`
+        :param until: The time before which to restore the documents
+        :type until: :class:`datetime.datetime`
+        :param model_labels: The models (as ``app_label.ModelName``) to
+            restore the documents of; defaults to all of them
+        :return: The number of documents written to MongoDB
+        :rtype: :class:`int`
+        :raises djangoaudit.connection.MongoConnectionError: If MongoDB is
+            unavailable
+        :raises NotImplementedError: If the MongoDB storage backend isn't
+            selected
+
+        """
+
+        require_mongo_storage("The restoration of archived audit documents")
+
+        restored_at = datetime.utcnow()
+        restored = 0
+
+        for entry in self.read_manifest():
+            if model_labels and entry['model'] not in model_labels:
+                continue
+            if since and entry['last_date_stamp'] < since:
+                continue
+            if until and entry['first_date_stamp'] >= until:
+                continue
+
+            collection = _get_collection_handler(entry['collection'])
+            documents = []
+            path = os.path.join(self.directory, entry['file'])
+            for document in read_archive_file(path, entry['format']):
+                date_stamp = document[get_stored_key(document,
+                                                     'audit_date_stamp')]
+                if (since and date_stamp < since) or \
+                   (until and date_stamp >= until):
+                    continue
+
+                document[get_stored_key(document, 'audit_restored_at')] = \
+                    restored_at
+                documents.append(document)
+                if len(documents) >= self.batch_size:
+                    restored += self._insert(collection, documents)
+                    documents = []
+
+            if documents:
+                restored += self._insert(collection, documents)
+
+        return restored
+
+    def _insert(self, collection, documents):
+        documents_by_partition = {}
+        for document in documents:
+            partition = _get_partition(
+                collection,
+                document[get_stored_key(document, 'audit_date_stamp')])
+            documents_by_partition.setdefault(partition, []).append(document)
+
+        inserted = 0
+        for partition, partition_documents in \
+                documents_by_partition.iteritems():
+            inserted += _insert_skipping_duplicates(partition(),
+                                                    partition_documents)
+        return inserted
+
+
+def get_audit_archive(directory=None, archive_format=None):
+    """
+    Return an :class:`AuditArchive` for ``directory`` (defaults to the
+    ``AUDIT_ARCHIVE_DIR`` setting) configured from the settings
+
+    :return: The archive or ``None`` if no directory is given or set
+
+    """
+
+    directory = directory or getattr(settings, 'AUDIT_ARCHIVE_DIR', None)
+    if not directory:
+        return None
+
+    return AuditArchive(
+        directory,
+        archive_format or getattr(settings, 'AUDIT_ARCHIVE_FORMAT',
+                                  ARCHIVE_JSON),
+        getattr(settings, 'AUDIT_ARCHIVE_FILE_SIZE', 64 * 1024 * 1024),
+        getattr(settings, 'AUDIT_ARCHIVE_BATCH_SIZE', 1000),
+        getattr(settings, 'AUDIT_ARCHIVE_PAUSE', 0),
+        )
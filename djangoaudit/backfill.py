@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Recording of baseline audit documents for the rows of a model which existed
+before it was audited.
+
+Without a baseline the first change recorded for such a row is reported as a
+change from ``None``, and :meth:`~djangoaudit.models.AuditedModel.get_creation_log`
+returns ``None``. The baseline documents record the current values of the log
+fields as the creation of each row does.
+
+"""
+
+from collections import deque
+from logging import getLogger
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connections
+
+from djangoaudit.models import (_ModelReference, _coerce_to_bson_compatible,
+                                _find_audit_documents, _insert_audit_documents,
+                                _load_related_objects, _make_audit_document)
+
+__all__ = ["AuditBackfill", "get_audit_backfill"]
+
+_LOGGER = getLogger(__name__)
+
+
+class AuditBackfill(object):
+    """
+    Record a baseline audit document for each row of a model which doesn't
+    have any audit documents yet.
+
+    The rows are read in chunks in the order of their primary key, so an
+    interrupted backfill can be resumed from the primary key of the last
+    chunk it completed.
+
+    """
+
+    def __init__(self, model, chunk_size=1000, workers=1, operator=None,
+                 notes=None):
+        """
+
+        :param model: The audited model to backfill
+        :type model: :class:`~djangoaudit.models.AuditedModel` subclass
+        :param chunk_size: The number of rows read and recorded at a time
+        :type chunk_size: :class:`int`
+        :param workers: The number of threads recording the chunks; with more
+            than one, the next chunks are read from the database while the
+            previous ones are being recorded
+        :type workers: :class:`int`
+        :param operator: The operator to record the baseline documents with
+        :param notes: The notes to record the baseline documents with
+
+        """
+
+        self.model = model
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.operator = operator
+        self.notes = notes
+
+    def backfill(self, after=None, progress_callback=None):
+        """
+        Record the baseline audit documents of the rows with a primary key
+        greater than ``after``
+
+        :param after: The primary key to resume from, or ``None`` to start
+            from the first row
+        :param progress_callback: A callable taking the primary key of the
+            last row of the chunk, the number of documents recorded and the
+            number of rows skipped so far, called once each chunk is recorded
+            along with all those before it
+        :return: The number of documents recorded and of rows skipped
+        :rtype: :class:`tuple`
+        :raises djangoaudit.connection.MongoConnectionError: If MongoDB is
+            unavailable
+        :raises pymongo.errors.PyMongoError: If the documents can't be written
+
+        """
+
+        totals = [0, 0]
+
+        def complete(last_pk, counts):
+            totals[0] += counts[0]
+            totals[1] += counts[1]
+            if progress_callback:
+                progress_callback(last_pk, *totals)
+
+        if self.workers <= 1:
+            for last_pk, rows in self._iter_chunks(after):
+                complete(last_pk, self._backfill_chunk(rows))
+            return tuple(totals)
+
+        pool = ThreadPool(self.workers)
+        pending = deque()
+        try:
+            for last_pk, rows in self._iter_chunks(after):
+                pending.append((last_pk, pool.apply_async(
+                    self._backfill_chunk_in_worker, (rows,))))
+                # Only keep as many chunks in memory as there are workers:
+                while len(pending) > self.workers:
+                    last_pk, result = pending.popleft()
+                    complete(last_pk, result.get())
+
+            while pending:
+                last_pk, result = pending.popleft()
+                complete(last_pk, result.get())
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        return tuple(totals)
+
+    def _iter_chunks(self, after):
+        """
+        Generate the primary key of the last row of each chunk along with the
+        values of the log fields of its rows keyed by primary key
+
+        """
+        rows = self.model._base_manager.order_by('pk')\
+                   .values('pk', *self.model.log_fields)
+
+        while True:
+            chunk_rows = rows if after is None else rows.filter(pk__gt=after)
+            chunk = [(row.pop('pk'), row) for row in
+                     chunk_rows[:self.chunk_size]]
+            if not chunk:
+                return
+
+            after = chunk[-1][0]
+            yield after, chunk
+
+            if len(chunk) < self.chunk_size:
+                return
+
+    def _get_audited_pks(self, pks):
+        query = dict(object_app=self.model._meta.app_label,
+                     object_model=self.model._meta.object_name,
+                     object_pk={'$in': pks})
+        documents = _find_audit_documents(self.model._audit_collection, query,
+                                          projection=['object_pk'], sort=None,
+                                          model=self.model)
+        return set(document['object_pk'] for document in documents)
+
+    def _backfill_chunk_in_worker(self, rows):
+        """
+        Record the chunk ``rows`` as :meth:`_backfill_chunk` does from a
+        thread of the pool, then close the database connections the thread
+        opened, which Django would otherwise leave open
+
+        """
+        try:
+            return self._backfill_chunk(rows)
+        finally:
+            connections.close_all()
+
+    def _backfill_chunk(self, rows):
+        """
+        Record the baseline documents of the rows in ``rows`` which don't
+        have any audit documents, and return the number of documents recorded
+        and of rows skipped
+
+        """
+        audited_pks = self._get_audited_pks(
+            [_coerce_to_bson_compatible(pk) for pk, _ in rows])
+        unaudited_rows = [(pk, values) for pk, values in rows if
+                          _coerce_to_bson_compatible(pk) not in audited_pks]
+        skipped = len(rows) - len(unaudited_rows)
+        rows = unaudited_rows
+
+        # Related objects are recorded as by save(), with their primary key:
+        _load_related_objects(self.model, dict(rows),
+                              self.model._base_manager.db, self.chunk_size)
+
+        initial_values = dict.fromkeys(self.model.log_fields)
+        audits = []
+        for pk, values in rows:
+            audit = _make_audit_document(_ModelReference(self.model, pk),
+                                         initial_values, values,
+                                         self.operator, self.notes)
+            if audit is None:
+                skipped += 1
+            else:
+                audits.append(audit)
+
+        # The documents are written straight away, so that the progress
+        # reported can be resumed from, and failures stop the backfill. Their
+        # order doesn't matter, so they are written unordered:
+        recorded = _insert_audit_documents(audits, self.chunk_size,
+                                           self.model._audit_collection,
+                                           raise_errors=True, ordered=False)
+        return recorded, skipped
+
+
+def get_audit_backfill(model, workers=1, operator=None, notes=None):
+    """
+    Return an :class:`AuditBackfill` for ``model`` reading
+    ``AUDIT_BACKFILL_CHUNK_SIZE`` rows at a time (1000 by default)
+
+    """
+
+    return AuditBackfill(model,
+                         getattr(settings, 'AUDIT_BACKFILL_CHUNK_SIZE', 1000),
+                         workers, operator, notes)
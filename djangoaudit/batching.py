@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Collection of the audit documents produced in a unit of work (e.g. an HTTP
+request or a Celery task) so that they can be written out together
+
+"""
+
+from contextlib import contextmanager
+import threading
+
+from djangoaudit.writer import get_audit_writer, insert_documents
+
+__all__ = ["AuditBatch", "audit_batch", "begin_audit_batch",
+           "end_audit_batch", "reset_audit_batch", "get_current_batch"]
+
+_LOCAL = threading.local()
+
+
+class AuditBatch(object):
+    """The audit documents collected in the current unit of work"""
+
+    def __init__(self):
+        self.pending = []
+
+    def add(self, collection, document):
+        """
+        Hold on to ``document`` until the batch is flushed.
+
+        :param collection: The collection handler to write to
+        :param document: The audit document
+        :type document: :class:`dict`
+
+        """
+        self.pending.append((collection, document))
+
+    def flush(self):
+        """
+        Write out all the documents collected so far, in the order in which
+        they were added.
+
+        If the background writer is enabled the documents are handed over to
+        it, otherwise they are written with a single ``insert_many`` per
+        collection.
+
+        """
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+
+        writer = get_audit_writer()
+        if writer is None:
+            insert_documents(pending)
+        else:
+            for collection, document in pending:
+                writer.put(collection, document)
+
+
+def get_current_batch():
+    """
+    Return the batch for the current thread or ``None`` if audit documents
+    should be written straight away.
+
+    :rtype: :class:`AuditBatch`
+
+    """
+    return getattr(_LOCAL, 'batch', None)
+
+
+def begin_audit_batch():
+    """
+    Start collecting audit documents on the current thread.
+
+    Calls may be nested; the documents are only written out when the outermost
+    batch is ended.
+
+    """
+    if get_current_batch() is None:
+        _LOCAL.batch = AuditBatch()
+        _LOCAL.depth = 0
+
+    _LOCAL.depth += 1
+
+
+def end_audit_batch():
+    """
+    End the batch started by the matching :func:`begin_audit_batch` and write
+    out its documents if it is the outermost one.
+
+    Calling this when no batch has been started is a no-op.
+
+    """
+    batch = get_current_batch()
+    if batch is None:
+        return
+
+    _LOCAL.depth -= 1
+    if _LOCAL.depth > 0:
+        return
+
+    _LOCAL.batch = None
+    batch.flush()
+
+
+def reset_audit_batch():
+    """
+    End the batch of the current thread however deeply it is nested and write
+    out its documents.
+
+    This recovers from a batch which was never ended (e.g. by a unit of work
+    which was interrupted), so that later units of work on the thread are not
+    nested inside it. Calling this when no batch has been started is a no-op.
+
+    """
+    batch = get_current_batch()
+    _LOCAL.batch = None
+    _LOCAL.depth = 0
+
+    if batch is not None:
+        batch.flush()
+
+
+@contextmanager
+def audit_batch():
+    """
+    Collect the audit documents produced inside the ``with`` block and write
+    them together once it exits::
+
+        with audit_batch():
+            for pilot in Pilot.objects.all():
+                pilot.age += 1
+                pilot.save()
+
+    The documents are written even if the block raises an exception, as the
+    changes they record may already have been committed.
+
+    """
+    begin_audit_batch()
+    try:
+        yield get_current_batch()
+    finally:
+        end_audit_batch()
@@ -18,7 +18,11 @@
 All information relating to the connection to MongoDB
 """
 
-from logging import getLogger
+from contextlib import contextmanager
+from logging import getLogger, INFO, WARNING
+import os
+import threading
+import time
 
 from django.conf import settings
 
@@ -26,7 +30,9 @@ from django.conf import settings
 import pymongo
 from pymongo.errors import ConnectionFailure, AutoReconnect
 
-__all__ = ["MONGO_CONNECTION", "MongoConnectionError"]
+__all__ = ["MONGO_CONNECTION", "MongoConnection", "MongoConnectionError",
+           "CircuitBreaker", "BREAKER_CLOSED", "BREAKER_OPEN",
+           "BREAKER_HALF_OPEN"]
 
 _LOGGER = getLogger(__name__)
 
@@ -41,34 +47,325 @@ class MongoConnectionError(Exception):
     
     pass
 
+BREAKER_CLOSED = 'closed'
+"""Requests are made as normal"""
+
+BREAKER_OPEN = 'open'
+"""Requests fail straight away without trying MongoDB"""
+
+BREAKER_HALF_OPEN = 'half-open'
+"""A single trial request is let through to find out if MongoDB is back"""
+
+
+class CircuitBreaker(object):
+    """
+    Stop trying MongoDB for a while once it has failed repeatedly, so that an
+    outage doesn't add the connection timeouts to every audited save.
+    
+    The breaker opens after ``failure_threshold`` consecutive failures. Once
+    it has been open for ``cool_down`` seconds it becomes half-open and lets a
+    single trial request through: the breaker closes if it succeeds and opens
+    again if it fails. If a ``probe`` is given, it is called every
+    ``probe_interval`` seconds while the breaker is open and closes it as soon
+    as it succeeds.
+    
+    """
+    
+    def __init__(self, failure_threshold=5, cool_down=30.0, probe=None,
+                 probe_interval=None):
+        """
+        
+        :param failure_threshold: The number of consecutive failures which
+            open the breaker
+        :type failure_threshold: :class:`int`
+        :param cool_down: The time (in seconds) the breaker stays open before
+            a trial request is let through
+        :type cool_down: :class:`float`
+        :param probe: A callable which raises an exception if MongoDB is
+            unavailable
+        :param probe_interval: The time (in seconds) between calls to
+            ``probe`` while the breaker is open
+        :type probe_interval: :class:`float`
+        
+        """
+        self.failure_threshold = failure_threshold
+        self.cool_down = cool_down
+        self.probe = probe
+        self.probe_interval = probe_interval
+        
+        self.state = BREAKER_CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        
+        self._opened_at = None
+        self._trial_started_at = None
+        self._lock = threading.Lock()
+        self._prober = None
+    
+    @property
+    def closed(self):
+        """Whether requests are being made as normal"""
+        return self.state == BREAKER_CLOSED
+    
+    def _set_state(self, state):
+        """Change to ``state`` and log the change (the lock must be held)"""
+        
+        _LOGGER.log(WARNING if state == BREAKER_OPEN else INFO,
+                    "MongoDB circuit breaker changed from %s to %s",
+                    self.state, state)
+        self.state = state
+    
+    def allow_request(self):
+        """
+        Return whether a request to MongoDB should be made
+        
+        :rtype: :class:`bool`
+        
+        """
+        if self.state == BREAKER_CLOSED:
+            return True
+        
+        with self._lock:
+            now = time.time()
+            
+            if self.state == BREAKER_OPEN and \
+                    now - self._opened_at >= self.cool_down:
+                self._set_state(BREAKER_HALF_OPEN)
+                self._trial_started_at = None
+            
+            if self.state == BREAKER_HALF_OPEN:
+                # Let the trial through, or another one if the outcome of the
+                # last one was never reported:
+                if self._trial_started_at is None or \
+                        now - self._trial_started_at >= self.cool_down:
+                    self._trial_started_at = now
+                    return True
+            elif self.state == BREAKER_CLOSED:
+                return True
+            
+            self.rejected += 1
+            return False
+    
+    def record_success(self):
+        """Report that a request to MongoDB succeeded"""
+        
+        if self.state == BREAKER_CLOSED and not self.failures:
+            return
+        
+        with self._lock:
+            self.failures = 0
+            if self.state != BREAKER_CLOSED:
+                self._set_state(BREAKER_CLOSED)
+    
+    def record_failure(self, exc=None):
+        """
+        Report that a request to MongoDB failed
+        
+        :param exc: The error raised by the request
+        
+        """
+        with self._lock:
+            self.failures += 1
+            
+            if self.state == BREAKER_HALF_OPEN or \
+                    (self.state == BREAKER_CLOSED and
+                     self.failures >= self.failure_threshold):
+                _LOGGER.warning("Opening the MongoDB circuit breaker after %d "
+                                "consecutive failures: %s", self.failures, exc)
+                self._set_state(BREAKER_OPEN)
+                self._opened_at = time.time()
+                self.opened += 1
+                self._ensure_prober()
+    
+    @contextmanager
+    def recording(self):
+        """
+        Report the outcome of the requests to MongoDB made in the block: a
+        failure if it raises :class:`~pymongo.errors.ConnectionFailure` and a
+        success otherwise
+        
+        Reads go through :meth:`allow_request` like writes, so their outcome
+        must be reported too for a trial read to close or reopen the breaker.
+        
+        """
+        succeeded = True
+        try:
+            yield
+        except ConnectionFailure, exc:
+            succeeded = False
+            self.record_failure(exc)
+            raise
+        finally:
+            if succeeded:
+                self.record_success()
+    
+    def _ensure_prober(self):
+        """Start the probe thread if needed (the lock must be held)"""
+        
+        if not self.probe or not self.probe_interval:
+            return
+        
+        if self._prober is not None and self._prober.is_alive():
+            return
+        
+        self._prober = threading.Thread(target=self._run_prober,
+                                        name="djangoaudit-breaker-probe")
+        self._prober.daemon = True
+        self._prober.start()
+    
+    def _run_prober(self):
+        """Probe MongoDB until the breaker is closed"""
+        
+        while True:
+            time.sleep(self.probe_interval)
+            if self.state == BREAKER_CLOSED:
+                return
+            
+            try:
+                self.probe()
+            except Exception, exc:
+                _LOGGER.debug("MongoDB health probe failed: %s", exc)
+            else:
+                self.record_success()
+                return
+    
+    def stats(self):
+        """
+        Return the state of the breaker, the number of consecutive failures,
+        the number of times it has opened and the number of requests it has
+        rejected.
+        
+        :rtype: :class:`dict`
+        
+        """
+        with self._lock:
+            return dict(state=self.state,
+                        failures=self.failures,
+                        opened=self.opened,
+                        rejected=self.rejected)
+
+
+def _get_uri_options(uri):
+    """Return the names of the options given in the MongoDB URI ``uri``"""
+    if not uri or '?' not in uri:
+        return []
+    
+    query = uri.split('?', 1)[1]
+    names = [option.split('=', 1)[0].lower() for option in
+             query.replace(';', '&').split('&')]
+    return [option for option in ('connectTimeoutMS',
+                                  'serverSelectionTimeoutMS')
+            if option.lower() in names]
+
+
 class MongoConnection(object):
-    """A wrapper around PyMongo's connection to MongoDB"""
+    """
+    A wrapper around PyMongo's connection to MongoDB
+    
+    The client is only created when it is first used, so that importing
+    django-audit doesn't connect to MongoDB (e.g. in the master process of a
+    pre-forking server). As clients must not be shared across a fork, a
+    process which inherited the client of its parent creates its own.
+    
+    """
     
-    def __init__(self, host, port, **kwargs):
+    def __init__(self, host, port, uri=None, **kwargs):
         """
-        Startup a connection to MongoDB on ``host`` and ``port``
+        Set up a connection to MongoDB on ``host`` and ``port``, or to the
+        server(s) in ``uri``
+        
+        Any other keyword arguments are passed on to
+        :class:`pymongo.MongoClient` (e.g. ``maxPoolSize``, ``w`` or
+        ``compressors``).
         
         :param host: The host to connect to
         :type host: :class:`basestring`
         :param port: The port to connect on
         :type port: :class:`int`
+        :param uri: A MongoDB connection string, which takes precedence over
+            ``host`` and ``port``
+        :type uri: :class:`basestring`
         
         """
         self.host = host
         self.port = port
+        self.uri = uri
         self.connectTimeoutMS = getattr(settings, 'MONGO_CONNECT_TIMEOUT_MS', 2000)
-        self.connection = None
-        self.connect()
-        
+        # PyMongo clients only report an unavailable server once they give
+        # up selecting one, which takes 30 seconds by default:
+        self.client_options = dict(
+            connectTimeoutMS=self.connectTimeoutMS,
+            serverSelectionTimeoutMS=self.connectTimeoutMS)
+        # The options of the URI would be overridden by those of the client:
+        for option in _get_uri_options(uri):
+            self.client_options.pop(option, None)
+        self.client_options.update(kwargs)
+        self.breaker = CircuitBreaker(
+            failure_threshold=getattr(settings,
+                                      'MONGO_BREAKER_FAILURE_THRESHOLD', 5),
+            cool_down=getattr(settings, 'MONGO_BREAKER_COOL_DOWN', 30.0),
+            probe=self.ping,
+            probe_interval=getattr(settings, 'MONGO_BREAKER_PROBE_INTERVAL',
+                                   None),
+            )
+        self._connection = None
         self._database = None
+        self._pid = None
+        self._generation = 0
+    
+    def _check_pid(self):
+        """Forget the client if it was created by the parent of this process"""
+        
+        if self._pid is not None and self._pid != os.getpid():
+            _LOGGER.debug("Discarding the MongoDB client of process %d",
+                          self._pid)
+            self.reset()
+    
+    @property
+    def connection(self):
+        """
+        The client, which is created on first use in each process
+        
+        This is ``None`` if the client could not be created.
+        
+        :rtype: :class:`pymongo.MongoClient`
+        
+        """
+        self._check_pid()
+        
+        if self._connection is None:
+            self.connect()
+        
+        return self._connection
+    
+    @property
+    def generation(self):
+        """
+        A number which changes whenever the client is closed or replaced, so
+        that collections retrieved from the old client can be retrieved again
+        
+        :rtype: :class:`int`
+        
+        """
+        self._check_pid()
+        return self._generation
         
     def connect(self):
         """Make the connection to MongoDB."""
         
         try:
-            self.connection = pymongo.MongoClient(self.host, self.port, connectTimeoutMS=self.connectTimeoutMS) #Connection(host=self.host, port=self.port)
-            _LOGGER.debug('Successfully connection to MongoDB on %s:%d' %
-                          (self.host, self.port))
+            if self.uri:
+                self._connection = pymongo.MongoClient(self.uri,
+                                                       **self.client_options)
+                _LOGGER.debug('Successfully connection to MongoDB at %s' %
+                              self.uri)
+            else:
+                self._connection = pymongo.MongoClient(self.host, self.port,
+                                                       **self.client_options)
+                _LOGGER.debug('Successfully connection to MongoDB on %s:%d' %
+                              (self.host, self.port))
+            self._pid = os.getpid()
         except AutoReconnect, exc:
             _LOGGER.warning("Got a reconnect exception when trying to connect "
                             "to MongoDB: %s", exc)
@@ -76,6 +373,44 @@ class MongoConnection(object):
             _LOGGER.critical("Could not establish a connection to MongoDB: %s",
                              exc)
     
+    def close(self):
+        """
+        Close the client of this process
+        
+        A new client is created the next time the connection is used.
+        
+        """
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        
+        self.reset()
+    
+    def reset(self):
+        """
+        Forget the client and the database without closing them
+        
+        This is what happens when the connection is first used after a fork
+        (the client belongs to the parent process), but it may also be called
+        explicitly, e.g. from the post-fork hook of the server.
+        
+        """
+        self._connection = None
+        self._database = None
+        self._pid = None
+        self._generation += 1
+    
+    def ping(self):
+        """
+        Check that MongoDB is available
+        
+        :raises pymongo.errors.ConnectionFailure: If it isn't
+        
+        """
+        if not self.connection:
+            raise ConnectionFailure("No connection to MongoDB was established")
+        
+        self.connection.admin.command('ping')
+    
     @property
     def database(self):
         """
@@ -87,6 +422,8 @@ class MongoConnection(object):
         :rtype: :class:`pymongo.database.Database`
         
         """
+        self._check_pid()
+        
         if not self._database:
             if not self.connection:
                 # No connection has been established. We must have had an
@@ -97,10 +434,15 @@ class MongoConnection(object):
                     # If we're still not connected return None
                     return None
             
-            database_name = settings.MONGO_DATABASE_NAME
+            # Default to the database in the URI:
+            database_name = getattr(settings, 'MONGO_DATABASE_NAME', None)
             
             try:
-                self._database = self.connection[database_name]
+                if database_name:
+                    self._database = self.connection[database_name]
+                else:
+                    self._database = self.connection.get_default_database()
+                    database_name = self._database.name
                 _LOGGER.debug("Selected database %s for use", database_name)
             except AutoReconnect:
                 _LOGGER.warn("Got an auto-reconnect message while selecting "
@@ -119,8 +461,15 @@ class MongoConnection(object):
         :param collection_name: The name of the collection to use
         :type collection_name: :class:`basestring`
         :rtype: :class:`pymongo.collection.Collection`
+        :raises MongoConnectionError: If no connection to MongoDB is
+            available, or it has failed repeatedly and :attr:`breaker` is open
         
         """
+        if not self.breaker.allow_request():
+            raise MongoConnectionError("Could not retrieve collection: %s, as "
+                                       "the MongoDB circuit breaker is open." %
+                                       collection_name)
+        
         if self.database is None:
             # The database cannot be retrieved due to connection issues. Log
             # this and raise an appropriate exception for capture later:
@@ -128,9 +477,15 @@ class MongoConnection(object):
                        "MongoDB was available." % collection_name)
             
             _LOGGER.critical(message)
+            self.breaker.record_failure(message)
             raise MongoConnectionError(message)
         
         return self.database[collection_name]
     
-# Create the connection to MongoDB here:
-MONGO_CONNECTION = MongoConnection(settings.MONGO_HOST, settings.MONGO_PORT)
+# Set up the connection to MongoDB here (the client is created on first use):
+MONGO_CONNECTION = MongoConnection(
+    getattr(settings, 'MONGO_HOST', 'localhost'),
+    getattr(settings, 'MONGO_PORT', 27017),
+    uri=getattr(settings, 'MONGO_URI', None),
+    **getattr(settings, 'MONGO_CLIENT_OPTIONS', {})
+    )
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Export of the audit documents matching a set of filters, for extracts of the
+history of the audited models.
+
+The documents are read model by model, in date order, a batch at a time, and
+written out one by one, so an export takes the same memory however many
+documents it covers.
+
+"""
+
+import csv
+from datetime import date, datetime
+from decimal import Decimal
+import json
+from logging import getLogger
+import time
+
+from bson import BSON, json_util
+from django.apps import apps
+from django.conf import settings
+
+from djangoaudit.models import (AuditedModel, _AUDIT_META_FIELDS,
+                                _coerce_data_to_model_types,
+                                _coerce_to_bson_compatible,
+                                _find_audit_documents)
+
+__all__ = ["EXPORT_CSV", "EXPORT_JSON", "EXPORT_BSON", "AuditExport",
+           "get_audit_export"]
+
+_LOGGER = getLogger(__name__)
+
+EXPORT_CSV = 'csv'
+"""Export one row per field recorded in each audit document"""
+
+EXPORT_JSON = 'jsonl'
+"""Export each audit document as a line of JSON"""
+
+EXPORT_BSON = 'bson'
+"""Export the audit documents as BSON, as ``mongodump`` does"""
+
+EXPORT_FORMATS = (EXPORT_CSV, EXPORT_JSON, EXPORT_BSON)
+
+CSV_COLUMNS = ('audit_id', 'audit_date_stamp', 'object_app', 'object_model',
+               'object_pk', 'audit_operator', 'audit_notes', 'audit_is_delete',
+               'field', 'old_value', 'value')
+"""The columns of the CSV exports"""
+
+_JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.RELAXED,
+                                      tz_aware=False)
+
+_UNEXPORTED_KEYS = frozenset(['audit_checkpoint', 'audit_old_values',
+                              'audit_expires_at', 'audit_restored_at'])
+
+
+def _encode_json_value(value):
+    """Encode the values coerced to the types of the model fields in JSON"""
+
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return value.isoformat()
+    return json_util.default(value, _JSON_OPTIONS)
+
+
+def _format_csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    if not isinstance(value, unicode):
+        value = unicode(value)
+    return value.encode('utf-8')
+
+
+class AuditExport(object):
+    """
+    Write the audit documents matching a set of filters to a file.
+
+    In CSV and JSON the values of the log fields are converted to the types
+    of the model fields, as they are by
+    :meth:`~djangoaudit.models.AuditedModel.get_creation_log`. In BSON the
+    documents are exported as recorded (in the standard schema).
+
+    """
+
+    def __init__(self, export_format=EXPORT_JSON, batch_size=1000,
+                 progress_callback=None, progress_interval=10):
+        """
+
+        :param export_format: :data:`EXPORT_CSV`, :data:`EXPORT_JSON` or
+            :data:`EXPORT_BSON`
+        :param batch_size: The number of documents per batch retrieved from
+            MongoDB
+        :type batch_size: :class:`int`
+        :param progress_callback: A callable taking the number of documents
+            exported so far and the seconds elapsed, called every
+            ``progress_interval`` seconds and once the export is complete
+        :param progress_interval: The seconds between calls to
+            ``progress_callback``
+        :type progress_interval: :class:`float`
+        :raises ValueError: If ``export_format`` is unknown
+
+        """
+
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError("Unknown export format %r; expected one of %r" %
+                             (export_format, EXPORT_FORMATS))
+
+        self.export_format = export_format
+        self.batch_size = batch_size
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+
+    def export(self, output, models=None, pks=None, operator=None, since=None,
+               until=None):
+        """
+        Write the audit documents of ``models`` matching the filters given to
+        ``output``, model by model and in the order they were recorded
+
+        :param output: The file-like object to write to
+        :param models: The models to export the documents of; defaults to all
+            the installed audited models
+        :param pks: Only export the documents of the objects with these
+            primary keys
+        :param operator: Only export the documents recorded with this
+            operator
+        :param since: Only export the documents recorded at or after this time
+        :type since: :class:`datetime.datetime`
+        :param until: Only export the documents recorded before this time
+        :type until: :class:`datetime.datetime`
+        :return: The number of documents exported
+        :rtype: :class:`int`
+        :raises djangoaudit.connection.MongoConnectionError: If MongoDB is
+            unavailable
+
+        """
+
+        if models is None:
+            models = [model for model in apps.get_models() if
+                      issubclass(model, AuditedModel)]
+
+        if self.export_format == EXPORT_CSV:
+            write = self._get_csv_writer(output)
+        elif self.export_format == EXPORT_JSON:
+            write = self._get_json_writer(output)
+        else:
+            write = self._get_bson_writer(output)
+
+        started_at = time.time()
+        reported_at = started_at
+        exported = 0
+
+        for model in models:
+            documents = self._find_documents(model, pks, operator, since,
+                                             until)
+            for document in documents:
+                write(model, document)
+                exported += 1
+
+                if self.progress_callback and \
+                   time.time() - reported_at >= self.progress_interval:
+                    reported_at = time.time()
+                    self.progress_callback(exported, reported_at - started_at)
+
+        if self.progress_callback:
+            self.progress_callback(exported, time.time() - started_at)
+
+        return exported
+
+    def _find_documents(self, model, pks, operator, since, until):
+        query = dict(object_app=model._meta.app_label,
+                     object_model=model._meta.object_name)
+
+        if pks is not None:
+            query['object_pk'] = {'$in': [_coerce_to_bson_compatible(pk) for
+                                          pk in pks]}
+
+        if operator is not None:
+            query['audit_operator'] = _coerce_to_bson_compatible(operator)
+
+        window = {}
+        if since is not None:
+            window['$gte'] = since
+        if until is not None:
+            window['$lt'] = until
+        if window:
+            query['audit_date_stamp'] = window
+
+        return _find_audit_documents(model._audit_collection, query,
+                                     batch_size=self.batch_size, since=since,
+                                     until=until, model=model)
+
+    def _get_json_writer(self, output):
+        def write(model, document):
+            document = _coerce_data_to_model_types(model, document)
+            for key in _UNEXPORTED_KEYS:
+                document.pop(key, None)
+            output.write(json.dumps(document, default=_encode_json_value,
+                                    sort_keys=True) + "\n")
+        return write
+
+    def _get_bson_writer(self, output):
+        def write(model, document):
+            output.write(BSON.encode(document))
+        return write
+
+    def _get_csv_writer(self, output):
+        writer = csv.writer(output)
+        writer.writerow(CSV_COLUMNS)
+
+        def write(model, document):
+            old_values = document.get('audit_old_values') or {}
+            decoded_old_values = _coerce_data_to_model_types(model,
+                                                             old_values)
+            document = _coerce_data_to_model_types(model, document)
+
+            row = [document['_id']] + [document.get(key) for key in
+                                       CSV_COLUMNS[1:-3]]
+            for key, value in sorted(document.iteritems()):
+                if key in _AUDIT_META_FIELDS or key in _UNEXPORTED_KEYS:
+                    continue
+
+                writer.writerow([_format_csv_value(cell) for cell in
+                                 row + [key, decoded_old_values.get(key),
+                                        value]])
+        return write
+
+
+def get_audit_export(export_format=EXPORT_JSON, progress_callback=None):
+    """
+    Return an :class:`AuditExport` for ``export_format`` configured from the
+    ``AUDIT_EXPORT_BATCH_SIZE`` (1000 by default) and
+    ``AUDIT_EXPORT_PROGRESS_INTERVAL`` (10 seconds by default) settings
+
+    """
+
+    return AuditExport(
+        export_format,
+        getattr(settings, 'AUDIT_EXPORT_BATCH_SIZE', 1000),
+        progress_callback,
+        getattr(settings, 'AUDIT_EXPORT_PROGRESS_INTERVAL', 10),
+        )
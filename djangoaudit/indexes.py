@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+The indexes which the read methods of
+:class:`djangoaudit.models.AuditedModel` rely on
+
+"""
+
+from logging import getLogger
+
+from pymongo import ASCENDING
+
+__all__ = ["AUDIT_INDEXES", "ensure_indexes", "explain_read_queries"]
+
+_LOGGER = getLogger(__name__)
+
+AUDIT_INDEXES = (
+    dict(name='audit_object_history',
+         keys=[('object_app', ASCENDING),
+               ('object_model', ASCENDING),
+               ('object_pk', ASCENDING),
+               ('audit_date_stamp', ASCENDING),
+               ('_id', ASCENDING)],
+         ),
+    dict(name='audit_object_deletes',
+         keys=[('object_app', ASCENDING),
+               ('object_model', ASCENDING),
+               ('object_pk', ASCENDING)],
+         partialFilterExpression={'audit_is_delete': True},
+         ),
+    dict(name='audit_model_history',
+         keys=[('object_app', ASCENDING),
+               ('object_model', ASCENDING),
+               ('audit_date_stamp', ASCENDING),
+               ('_id', ASCENDING)],
+         ),
+    dict(name='audit_expiry',
+         keys=[('audit_expires_at', ASCENDING)],
+         expireAfterSeconds=0,
+         ),
+    dict(name='audit_compact_object_history',
+         keys=[('a', ASCENDING),
+               ('m', ASCENDING),
+               ('p', ASCENDING),
+               ('d', ASCENDING),
+               ('_id', ASCENDING)],
+         partialFilterExpression={'s': 2},
+         ),
+    dict(name='audit_compact_object_deletes',
+         keys=[('a', ASCENDING),
+               ('m', ASCENDING),
+               ('p', ASCENDING)],
+         partialFilterExpression={'s': 2, 'x': True},
+         ),
+    dict(name='audit_compact_model_history',
+         keys=[('a', ASCENDING),
+               ('m', ASCENDING),
+               ('d', ASCENDING),
+               ('_id', ASCENDING)],
+         partialFilterExpression={'s': 2},
+         ),
+    dict(name='audit_compact_expiry',
+         keys=[('e', ASCENDING)],
+         expireAfterSeconds=0,
+         partialFilterExpression={'s': 2},
+         ),
+    )
+"""
+The indexes on the auditing collection: one for the history of each object,
+sorted by date (and then id, to break ties), a partial one covering only the
+deletions, one for the history of each model (read by the archival) and the
+TTL index which deletes the documents of the models whose retention policy is
+:data:`~djangoaudit.models.RETENTION_EXPIRE`, followed by their equivalents
+for the documents in the compact schema (see :mod:`djangoaudit.schema`),
+which only cover those documents
+
+"""
+
+
+def ensure_indexes(collection):
+    """
+    Create any of :data:`AUDIT_INDEXES` which don't exist on ``collection``
+
+    Indexes are compared by name, so an index which has been changed by hand
+    is not recreated.
+
+    :param collection: The auditing collection
+    :type collection: :class:`pymongo.collection.Collection`
+    :return: The name of each index along with whether it was created
+    :rtype: :class:`list` of ``(name, created)`` pairs
+
+    """
+
+    existing_indexes = collection.index_information()
+
+    report = []
+    for index in AUDIT_INDEXES:
+        index = dict(index)
+        name = index['name']
+        keys = index.pop('keys')
+
+        if name in existing_indexes:
+            report.append((name, False))
+            continue
+
+        collection.create_index(keys, **index)
+        _LOGGER.info("Created index %s on %s", name, collection.name)
+        report.append((name, True))
+
+    return report
+
+
+def _get_plan_stages(plan):
+    """
+    Return the stages of the query ``plan`` from the top down, along with the
+    name of the index used by each one (if any)
+
+    """
+    stages = [(plan.get('stage'), plan.get('indexName'))]
+
+    children = list(plan.get('inputStages', []))
+    if 'inputStage' in plan:
+        children.append(plan['inputStage'])
+
+    for child in children:
+        stages.extend(_get_plan_stages(child))
+
+    return stages
+
+
+def explain_read_queries(collection, object_app='app', object_model='Model',
+                         object_pk=1):
+    """
+    Explain the queries made by the read methods of
+    :class:`djangoaudit.models.AuditedModel` on ``collection``
+
+    :param collection: The auditing collection
+    :type collection: :class:`pymongo.collection.Collection`
+    :return: The name of each read method along with the indexes used by the
+        winning plan of its query (empty if the collection is scanned)
+    :rtype: :class:`list` of ``(name, index names)`` pairs
+
+    """
+
+    object_params = dict(object_app=object_app, object_model=object_model,
+                         object_pk=object_pk)
+    delete_params = dict(object_params, audit_is_delete=True)
+    model_delete_params = dict(object_app=object_app,
+                               object_model=object_model,
+                               audit_is_delete=True)
+
+    history_sort = [('audit_date_stamp', ASCENDING), ('_id', ASCENDING)]
+
+    cursors = (
+        ('get_audit_log', collection.find(object_params).sort(history_sort)),
+        ('get_creation_log',
+         collection.find(object_params).sort('audit_date_stamp').limit(1)),
+        ('get_deleted_log', collection.find(model_delete_params)),
+        ('get_deleted_log(pk)', collection.find(delete_params)),
+        )
+
+    report = []
+    for name, cursor in cursors:
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        index_names = [index_name for stage, index_name in
+                       _get_plan_stages(plan) if index_name]
+        report.append((name, index_names))
+
+    return report
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Timings and counters of the auditing of changes, for finding out how much of
+the time taken by a request goes into auditing.
+
+Nothing is measured unless the ``AUDIT_INSTRUMENTATION`` setting is set.
+The measurements are then kept in process, where :func:`stats` reads them,
+and handed to the sinks in the ``AUDIT_STATS_SINKS`` setting.
+
+"""
+
+from collections import deque
+from datetime import datetime
+from logging import DEBUG, getLogger
+import threading
+from timeit import default_timer
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+__all__ = ["PHASE_SNAPSHOT", "PHASE_DIFF", "PHASE_COERCION",
+           "PHASE_CHECKPOINT", "PHASE_ENCODING", "PHASE_INSERT",
+           "COUNTER_DOCUMENTS_WRITTEN", "COUNTER_SAVES_SKIPPED",
+           "COUNTER_WRITE_FAILURES", "COUNTER_MONGO_UNAVAILABLE",
+           "COUNTER_SLOW_AUDITS", "MemoryStatsSink", "LoggingStatsSink",
+           "CallbackStatsSink", "TimedFunction", "is_instrumented",
+           "record_timing", "increment", "record_audit_time",
+           "get_stats_sinks", "stats", "reset_stats"]
+
+_LOGGER = getLogger(__name__)
+
+PHASE_SNAPSHOT = 'snapshot'
+"""Working out the values of the log fields before a save"""
+
+PHASE_DIFF = 'diff'
+"""Working out the changes recorded by an audit document"""
+
+PHASE_COERCION = 'coercion'
+"""Making the values of an audit document BSON compatible"""
+
+PHASE_CHECKPOINT = 'checkpoint'
+"""Working out whether an audit document carries a checkpoint, and adding it"""
+
+PHASE_ENCODING = 'encoding'
+"""Encoding an audit document in the compact schema"""
+
+PHASE_INSERT = 'insert'
+"""Writing audit documents to MongoDB"""
+
+COUNTER_DOCUMENTS_WRITTEN = 'documents_written'
+"""The audit documents written to MongoDB"""
+
+COUNTER_SAVES_SKIPPED = 'saves_skipped'
+"""The changes which weren't recorded as nothing audited had changed"""
+
+COUNTER_WRITE_FAILURES = 'write_failures'
+"""The writes to MongoDB which failed other than for it being unavailable"""
+
+COUNTER_MONGO_UNAVAILABLE = 'mongo_unavailable'
+"""The writes to MongoDB which failed as it was unavailable"""
+
+COUNTER_SLOW_AUDITS = 'slow_audits'
+"""The saves and deletions which took longer than the slow audit threshold"""
+
+
+def is_instrumented():
+    """Return whether the auditing of changes is being measured"""
+
+    return getattr(settings, 'AUDIT_INSTRUMENTATION', False)
+
+
+class MemoryStatsSink(object):
+    """Keep the timings and counters in process"""
+
+    def __init__(self, slow_audits_kept=100):
+        """
+
+        :param slow_audits_kept: The number of the latest slow audits to keep
+        :type slow_audits_kept: :class:`int`
+
+        """
+
+        self._lock = threading.Lock()
+        self._slow_audits_kept = slow_audits_kept
+        self.reset()
+
+    def timing(self, name, seconds):
+        with self._lock:
+            timing = self._timings.get(name)
+            if timing is None:
+                timing = self._timings[name] = [0, 0.0, 0.0]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def increment(self, name, count=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + count
+
+    def add_slow_audit(self, model_label, pk, operation, seconds):
+        with self._lock:
+            self._slow_audits.append(dict(model=model_label, pk=pk,
+                                          operation=operation,
+                                          seconds=seconds,
+                                          at=datetime.utcnow()))
+
+    def snapshot(self):
+        """
+        Return the timings and counters so far
+
+        :return: The counters by name, the number, total, mean and maximum
+            seconds of the timings by phase and the latest slow audits
+        :rtype: :class:`dict`
+
+        """
+
+        with self._lock:
+            timings = {}
+            for name, (count, total, maximum) in self._timings.iteritems():
+                timings[name] = dict(count=count, total_seconds=total,
+                                     mean_seconds=total / count,
+                                     max_seconds=maximum)
+
+            return dict(counters=dict(self._counters), timings=timings,
+                        slow_audits=list(self._slow_audits))
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._timings = {}
+            self._slow_audits = deque(maxlen=self._slow_audits_kept)
+
+
+class LoggingStatsSink(object):
+    """Log each timing and counter increment"""
+
+    def __init__(self, logger_name=__name__, level=DEBUG):
+        self._logger = getLogger(logger_name)
+        self._level = level
+
+    def timing(self, name, seconds):
+        self._logger.log(self._level, "%s took %.3f ms", name, seconds * 1e3)
+
+    def increment(self, name, count=1):
+        self._logger.log(self._level, "%s +%d", name, count)
+
+
+class CallbackStatsSink(object):
+    """
+    Pass the timings and counter increments to callables, such as the
+    ``timing`` and ``incr`` methods of a statsd client::
+
+        CallbackStatsSink(client.timing, client.incr)
+
+    """
+
+    def __init__(self, timing=None, increment=None, prefix="djangoaudit."):
+        """
+
+        :param timing: A callable taking the name of a phase and the
+            milliseconds it took
+        :param increment: A callable taking the name of a counter and the
+            amount to add to it
+        :param prefix: The prefix of the names passed to the callables
+
+        """
+
+        self._timing = timing
+        self._increment = increment
+        self._prefix = prefix
+
+    def timing(self, name, seconds):
+        if self._timing is not None:
+            self._timing(self._prefix + name, seconds * 1e3)
+
+    def increment(self, name, count=1):
+        if self._increment is not None:
+            self._increment(self._prefix + name, count)
+
+
+_MEMORY_SINK = MemoryStatsSink()
+
+_LOADED_SINKS = {}
+"""The sinks created from the paths in ``AUDIT_STATS_SINKS``, by path"""
+
+_LOADED_SINKS_LOCK = threading.Lock()
+
+
+def _load_sink(path):
+    sink = _LOADED_SINKS.get(path)
+    if sink is None:
+        with _LOADED_SINKS_LOCK:
+            sink = _LOADED_SINKS.get(path)
+            if sink is None:
+                sink = _LOADED_SINKS[path] = import_string(path)()
+    return sink
+
+
+def get_stats_sinks():
+    """
+    Return the sinks of the timings and counters: the in-process one read by
+    :func:`stats` and those in the ``AUDIT_STATS_SINKS`` setting, given as
+    sinks or as the paths to callables returning one
+
+    """
+
+    sinks = [_MEMORY_SINK]
+    for sink in getattr(settings, 'AUDIT_STATS_SINKS', ()):
+        if isinstance(sink, basestring):
+            sink = _load_sink(sink)
+        sinks.append(sink)
+    return sinks
+
+
+def _notify_sinks(method_name, *args):
+    for sink in get_stats_sinks():
+        try:
+            getattr(sink, method_name)(*args)
+        except Exception:
+            # The change has been audited, so don't let a sink break it:
+            _LOGGER.exception("Stats sink %r failed", sink)
+
+
+def record_timing(phase, seconds):
+    """Record that ``phase`` took ``seconds``"""
+
+    _notify_sinks('timing', phase, seconds)
+
+
+def increment(counter, count=1):
+    """Add ``count`` to ``counter``"""
+
+    _notify_sinks('increment', counter, count)
+
+
+def record_audit_time(model, operation, seconds):
+    """
+    Record the time taken to audit the ``operation`` (``"save"`` or
+    ``"delete"``) of ``model``, and report it if it is longer than the
+    ``AUDIT_SLOW_THRESHOLD`` setting (in seconds)
+
+    """
+
+    threshold = getattr(settings, 'AUDIT_SLOW_THRESHOLD', None)
+    if threshold is None or seconds < threshold:
+        return
+
+    model_label = "%s.%s" % (model._meta.app_label, model._meta.object_name)
+    _LOGGER.warning("Auditing the %s of %s #%s took %.3f seconds", operation,
+                    model_label, model.pk, seconds)
+    _MEMORY_SINK.add_slow_audit(model_label, model.pk, operation, seconds)
+    increment(COUNTER_SLOW_AUDITS)
+
+
+class TimedFunction(object):
+    """Call a function and add up the time spent in it"""
+
+    def __init__(self, function):
+        self.function = function
+        self.seconds = 0.0
+
+    def __call__(self, *args, **kwargs):
+        started_at = default_timer()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            self.seconds += default_timer() - started_at
+
+
+def stats():
+    """
+    Return the timings and counters measured in this process so far (see
+    :meth:`MemoryStatsSink.snapshot`)
+
+    """
+
+    return _MEMORY_SINK.snapshot()
+
+
+def reset_stats():
+    """Forget the timings and counters measured in this process so far"""
+
+    _MEMORY_SINK.reset()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Move the audit documents which have outlived the retention period of their
+model from MongoDB to compressed files
+
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoaudit.archive import ARCHIVE_JSON, ARCHIVE_BSON, get_audit_archive
+from djangoaudit.connection import MongoConnectionError
+
+__all__ = ['Command']
+
+class Command(BaseCommand):
+
+    help = ("Move the audit documents which have outlived the retention "
+            "period of their model from MongoDB to compressed files")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            dest='directory',
+            default=None,
+            help="The directory of the archive (defaults to the "
+                 "AUDIT_ARCHIVE_DIR setting)",
+            )
+        parser.add_argument(
+            '--format',
+            dest='archive_format',
+            choices=[ARCHIVE_JSON, ARCHIVE_BSON],
+            default=None,
+            help="The format of the files (defaults to the "
+                 "AUDIT_ARCHIVE_FORMAT setting or %s)" % ARCHIVE_JSON,
+            )
+
+    def handle(self, *args, **options):
+        archive = get_audit_archive(options['directory'],
+                                    options['archive_format'])
+        if archive is None:
+            raise CommandError("No archive directory given and the "
+                               "AUDIT_ARCHIVE_DIR setting is not set")
+
+        try:
+            archived = archive.archive()
+        except (MongoConnectionError, NotImplementedError), exc:
+            raise CommandError(str(exc))
+
+        for model_label, count in sorted(archived.items()):
+            self.stdout.write("Archived %d documents of %s" %
+                              (count, model_label))
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Record a baseline audit document for each existing row of a model which
+doesn't have any audit documents yet
+
+"""
+
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import PyMongoError
+
+from djangoaudit.backfill import get_audit_backfill
+from djangoaudit.connection import MongoConnectionError
+from djangoaudit.models import AuditedModel
+
+__all__ = ['Command']
+
+def _get_model(model_label):
+    try:
+        model = apps.get_model(model_label)
+    except (LookupError, ValueError):
+        raise CommandError("Unknown model: %s" % model_label)
+
+    if not issubclass(model, AuditedModel):
+        raise CommandError("%s is not audited" % model_label)
+    return model
+
+class Command(BaseCommand):
+
+    help = ("Record a baseline audit document for each existing row of a "
+            "model which doesn't have any audit documents yet")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'model_label',
+            help="The model to backfill (as app_label.ModelName)",
+            )
+        parser.add_argument(
+            '--after',
+            dest='after',
+            default=None,
+            help="Resume after the row with this primary key, as reported by "
+                 "an earlier run",
+            )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            dest='workers',
+            default=1,
+            help="The number of threads recording the documents",
+            )
+        parser.add_argument(
+            '--operator',
+            dest='operator',
+            default=None,
+            help="The operator to record the documents with",
+            )
+        parser.add_argument(
+            '--notes',
+            dest='notes',
+            default="Baseline recorded by audit_backfill",
+            help="The notes to record the documents with",
+            )
+
+    def handle(self, *args, **options):
+        model = _get_model(options['model_label'])
+
+        after = options['after']
+        if after is not None:
+            try:
+                after = model._meta.pk.to_python(after)
+            except ValidationError, exc:
+                raise CommandError("Invalid primary key: %s" %
+                                   "; ".join(exc.messages))
+
+        backfill = get_audit_backfill(model, options['workers'],
+                                      options['operator'], options['notes'])
+
+        self._last_pk = after
+        try:
+            recorded, skipped = backfill.backfill(after,
+                                                  self._report_progress)
+        except (MongoConnectionError, PyMongoError), exc:
+            if self._last_pk is None:
+                raise CommandError(str(exc))
+            raise CommandError("%s; resume with --after %s" %
+                               (exc, self._last_pk))
+
+        self.stdout.write("Recorded %d baseline documents of %s and skipped "
+                          "%d rows" %
+                          (recorded, model._audit_label, skipped))
+
+    def _report_progress(self, last_pk, recorded, skipped):
+        self._last_pk = last_pk
+        self.stderr.write("Recorded %d documents and skipped %d rows up to "
+                          "primary key %s" % (recorded, skipped, last_pk))
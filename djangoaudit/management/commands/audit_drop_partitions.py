@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Drop the monthly partitions of the auditing collections before a given month
+
+"""
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoaudit.connection import MongoConnectionError
+from djangoaudit.models import get_audit_collection_names
+from djangoaudit.partitions import is_partitioned, drop_partitions
+
+__all__ = ['Command']
+
+class Command(BaseCommand):
+
+    help = ("Drop the monthly partitions of the auditing collections before "
+            "a given month")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--before',
+            dest='before',
+            default=None,
+            help="The oldest month to keep, as YYYY-MM",
+            )
+        parser.add_argument(
+            '--keep-months',
+            type=int,
+            dest='keep_months',
+            default=None,
+            help="The number of months to keep, including the current one",
+            )
+
+    def handle(self, *args, **options):
+        if not is_partitioned():
+            raise CommandError("The AUDIT_PARTITION_BY_MONTH setting is not "
+                               "set")
+
+        if options['before'] is not None:
+            try:
+                before = datetime.strptime(options['before'], "%Y-%m")
+            except ValueError:
+                raise CommandError("Invalid month: %s" % options['before'])
+        elif options['keep_months']:
+            now = datetime.utcnow()
+            months = now.year * 12 + now.month - options['keep_months']
+            before = datetime(months // 12, months % 12 + 1, 1)
+        else:
+            raise CommandError("Either --before or --keep-months is required")
+
+        for collection_name in get_audit_collection_names():
+            try:
+                dropped = drop_partitions(collection_name, before)
+            except (MongoConnectionError, NotImplementedError), exc:
+                raise CommandError(str(exc))
+
+            for name in dropped:
+                self.stdout.write("Dropped %s" % name)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Create the indexes on the auditing collections (and the audit stream mirror
+collection, if enabled) and check that the read methods use them
+
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoaudit.connection import MONGO_CONNECTION, MongoConnectionError
+from djangoaudit.indexes import ensure_indexes, explain_read_queries
+from djangoaudit.models import (AUDITING_COLLECTION_NAME,
+                                get_audit_collection_names)
+from djangoaudit.storage import require_mongo_storage
+from djangoaudit.stream import ensure_mirror_collection
+
+__all__ = ['Command']
+
+class Command(BaseCommand):
+
+    help = ("Create the indexes on the auditing collections and check that "
+            "the read methods use them")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skip-explain',
+            action='store_true',
+            dest='skip_explain',
+            default=False,
+            help="Don't check the query plans of the read methods",
+            )
+
+    def handle(self, *args, **options):
+        try:
+            require_mongo_storage("Ensuring the indexes")
+            collection_names = get_audit_collection_names(
+                include_partitions=True)
+            collections = [MONGO_CONNECTION.get_collection(collection_name)
+                           for collection_name in collection_names]
+        except (MongoConnectionError, NotImplementedError), exc:
+            raise CommandError(str(exc))
+
+        for collection in collections:
+            # Only name the collection if it's not the default one:
+            if collection.name == AUDITING_COLLECTION_NAME:
+                suffix = ""
+            else:
+                suffix = " on %s" % collection.name
+
+            for name, created in ensure_indexes(collection):
+                if created:
+                    self.stdout.write("Created index %s%s" % (name, suffix))
+                else:
+                    self.stdout.write("Index %s already exists%s" %
+                                      (name, suffix))
+
+        if ensure_mirror_collection(collections[0].database):
+            self.stdout.write("Created the audit stream mirror collection")
+
+        if options['skip_explain']:
+            return
+
+        for collection_name in get_audit_collection_names():
+            collection = MONGO_CONNECTION.get_collection(collection_name)
+            for name, index_names in explain_read_queries(collection):
+                if collection_name != AUDITING_COLLECTION_NAME:
+                    name = "%s on %s" % (name, collection_name)
+
+                if index_names:
+                    self.stdout.write("%s uses %s" %
+                                      (name, ", ".join(index_names)))
+                else:
+                    self.stderr.write("%s scans the whole collection" % name)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Export the audit documents matching a set of filters as CSV, JSON lines or
+BSON
+
+"""
+
+from datetime import datetime
+import sys
+
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoaudit.connection import MongoConnectionError
+from djangoaudit.export import EXPORT_FORMATS, EXPORT_JSON, get_audit_export
+from djangoaudit.models import AuditedModel
+
+__all__ = ['Command']
+
+_DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%dT%H:%M:%S")
+
+def _parse_date(value):
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise CommandError("Invalid date: %s" % value)
+
+def _get_models(app_labels, model_labels):
+    if not app_labels and not model_labels:
+        return None
+
+    models = []
+    for app_label in app_labels or ():
+        try:
+            app_config = apps.get_app_config(app_label)
+        except LookupError:
+            raise CommandError("Unknown application: %s" % app_label)
+        models.extend(model for model in app_config.get_models() if
+                      issubclass(model, AuditedModel))
+
+    for model_label in model_labels or ():
+        try:
+            model = apps.get_model(model_label)
+        except (LookupError, ValueError):
+            raise CommandError("Unknown model: %s" % model_label)
+
+        if not issubclass(model, AuditedModel):
+            raise CommandError("%s is not audited" % model_label)
+        if model not in models:
+            models.append(model)
+    return models
+
+def _get_pks(models, pks):
+    if not pks:
+        return None
+
+    if not models or len(models) != 1:
+        raise CommandError("--pk can only be used with a single --model")
+
+    try:
+        return [models[0]._meta.pk.to_python(pk) for pk in pks]
+    except ValidationError, exc:
+        raise CommandError("Invalid primary key: %s" % "; ".join(exc.messages))
+
+class Command(BaseCommand):
+
+    help = ("Export the audit documents matching a set of filters as CSV, "
+            "JSON lines or BSON")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format',
+            dest='export_format',
+            choices=EXPORT_FORMATS,
+            default=EXPORT_JSON,
+            help="The format to export the documents in",
+            )
+        parser.add_argument(
+            '--output',
+            dest='output',
+            default=None,
+            help="The file to write to (defaults to the standard output)",
+            )
+        parser.add_argument(
+            '--app',
+            action='append',
+            dest='apps',
+            default=None,
+            help="Export the documents of the models in this application; "
+                 "can be given more than once",
+            )
+        parser.add_argument(
+            '--model',
+            action='append',
+            dest='models',
+            default=None,
+            help="Export the documents of this model (as "
+                 "app_label.ModelName); can be given more than once",
+            )
+        parser.add_argument(
+            '--pk',
+            action='append',
+            dest='pks',
+            default=None,
+            help="Only export the documents of the object with this primary "
+                 "key; can be given more than once, with a single --model",
+            )
+        parser.add_argument(
+            '--operator',
+            dest='operator',
+            default=None,
+            help="Only export the documents recorded with this operator",
+            )
+        parser.add_argument(
+            '--since',
+            dest='since',
+            default=None,
+            help="The earliest time (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS, in "
+                 "UTC) of the documents to export",
+            )
+        parser.add_argument(
+            '--until',
+            dest='until',
+            default=None,
+            help="The time (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS, in UTC) "
+                 "before which to export the documents",
+            )
+
+    def handle(self, *args, **options):
+        models = _get_models(options['apps'], options['models'])
+        pks = _get_pks(models, options['pks'])
+        since = options['since'] and _parse_date(options['since'])
+        until = options['until'] and _parse_date(options['until'])
+
+        export = get_audit_export(options['export_format'],
+                                  self._report_progress)
+
+        if options['output']:
+            output = open(options['output'], 'wb')
+        else:
+            output = options.get('stdout') or sys.stdout
+
+        try:
+            export.export(output, models, pks, options['operator'], since,
+                          until)
+        except MongoConnectionError, exc:
+            raise CommandError(str(exc))
+        finally:
+            if options['output']:
+                output.close()
+
+    def _report_progress(self, exported, elapsed):
+        rate = exported / elapsed if elapsed else exported
+        self.stderr.write("Exported %d documents in %.1f seconds (%d per "
+                          "second)" % (exported, elapsed, rate))
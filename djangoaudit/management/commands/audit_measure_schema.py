@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Report the size of a sample of the audit documents of each model in the
+standard and in the compact schema
+
+"""
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import DESCENDING
+
+from djangoaudit.connection import MongoConnectionError
+from djangoaudit.models import (AuditedModel, _AUDIT_LOG_SORT,
+                                _find_audit_documents)
+from djangoaudit.schema import (FieldDictionary, get_field_dictionary,
+                                measure_document_sizes)
+
+__all__ = ['Command']
+
+def _get_models(model_labels):
+    if not model_labels:
+        return [model for model in apps.get_models() if
+                issubclass(model, AuditedModel)]
+
+    models = []
+    for model_label in model_labels:
+        try:
+            model = apps.get_model(model_label)
+        except (LookupError, ValueError):
+            raise CommandError("Unknown model: %s" % model_label)
+
+        if not issubclass(model, AuditedModel):
+            raise CommandError("%s is not audited" % model_label)
+        models.append(model)
+    return models
+
+def _get_dictionary(model):
+    """
+    Return the field dictionary of ``model`` with all of its log fields,
+    without recording the fields it doesn't have yet
+
+    """
+    dictionary = get_field_dictionary(model._audit_label)
+    field_names = dictionary.field_names if dictionary else []
+    return FieldDictionary(model._audit_label, field_names + [
+        field_name for field_name in model.log_fields if
+        field_name not in field_names])
+
+class Command(BaseCommand):
+
+    help = ("Report the size of a sample of the audit documents of each "
+            "model in the standard and in the compact schema")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            action='append',
+            dest='models',
+            default=None,
+            help="Only measure the documents of this model (as "
+                 "app_label.ModelName); can be given more than once",
+            )
+        parser.add_argument(
+            '--sample',
+            type=int,
+            dest='sample',
+            default=1000,
+            help="The number of documents to measure per model, newest first",
+            )
+
+    def handle(self, *args, **options):
+        newest_first = [(key, DESCENDING) for key, _ in _AUDIT_LOG_SORT]
+
+        for model in _get_models(options['models']):
+            query = dict(object_app=model._meta.app_label,
+                         object_model=model._meta.object_name)
+            try:
+                documents = _find_audit_documents(
+                    model._audit_collection, query, sort=newest_first,
+                    limit=options['sample'], model=model)
+                count, standard_size, compact_size = measure_document_sizes(
+                    documents, _get_dictionary(model),
+                    model.audit_related_pk_only, model._audit_related_fields)
+            except (MongoConnectionError, NotImplementedError), exc:
+                raise CommandError(str(exc))
+
+            if not count:
+                self.stdout.write("%s: no documents" % model._audit_label)
+                continue
+
+            self.stdout.write(
+                "%s: %d documents, %d bytes per document in the standard "
+                "schema, %d in the compact schema (%d%% smaller)" % (
+                    model._audit_label,
+                    count,
+                    standard_size // count,
+                    compact_size // count,
+                    100 * (standard_size - compact_size) // standard_size,
+                    ))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Write the audit documents spooled while MongoDB was unavailable to MongoDB
+
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoaudit.spool import get_audit_spool
+
+__all__ = ['Command']
+
+class Command(BaseCommand):
+
+    help = ("Write the audit documents spooled while MongoDB was unavailable "
+            "to MongoDB")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            dest='batch_size',
+            default=500,
+            help="The maximum number of documents per insert",
+            )
+        parser.add_argument(
+            '--follow',
+            action='store_true',
+            dest='follow',
+            default=False,
+            help="Keep replaying the spool as documents are added to it",
+            )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            dest='interval',
+            default=30.0,
+            help="The seconds between replays when following the spool",
+            )
+
+    def handle(self, *args, **options):
+        spool = get_audit_spool()
+        if spool is None:
+            raise CommandError("The AUDIT_SPOOL_DIR setting is not set")
+
+        while True:
+            replayed = spool.replay(options['batch_size'])
+            remaining = len(spool.get_segments())
+
+            if replayed or remaining:
+                self.stdout.write("Replayed %d segments; %d remain" %
+                                  (replayed, remaining))
+
+            if not options['follow']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Write the archived audit documents recorded in a range of time back to MongoDB
+
+"""
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoaudit.archive import get_audit_archive
+from djangoaudit.connection import MongoConnectionError
+
+__all__ = ['Command']
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise CommandError("Invalid date: %s" % value)
+
+class Command(BaseCommand):
+
+    help = ("Write the archived audit documents recorded in a range of time "
+            "back to MongoDB")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--directory',
+            dest='directory',
+            default=None,
+            help="The directory of the archive (defaults to the "
+                 "AUDIT_ARCHIVE_DIR setting)",
+            )
+        parser.add_argument(
+            '--since',
+            dest='since',
+            default=None,
+            help="The earliest day (YYYY-MM-DD) of the documents to restore",
+            )
+        parser.add_argument(
+            '--until',
+            dest='until',
+            default=None,
+            help="The day (YYYY-MM-DD) before which to restore the documents",
+            )
+        parser.add_argument(
+            '--model',
+            action='append',
+            dest='models',
+            default=None,
+            help="Only restore the documents of this model (as "
+                 "app_label.ModelName); can be given more than once",
+            )
+
+    def handle(self, *args, **options):
+        archive = get_audit_archive(options['directory'])
+        if archive is None:
+            raise CommandError("No archive directory given and the "
+                               "AUDIT_ARCHIVE_DIR setting is not set")
+
+        since = options['since'] and _parse_date(options['since'])
+        until = options['until'] and _parse_date(options['until'])
+
+        try:
+            restored = archive.restore(since, until, options['models'])
+        except (MongoConnectionError, NotImplementedError), exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write("Restored %d documents" % restored)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Write the audit documents as they are recorded as JSON lines, each one with
+the token to resume the stream after it
+
+"""
+
+from bson import json_util
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import PyMongoError
+
+from djangoaudit.connection import MongoConnectionError
+from djangoaudit.stream import AuditStream, STREAM_CHANGES, STREAM_MIRROR
+
+__all__ = ['Command']
+
+class Command(BaseCommand):
+
+    help = ("Write the audit documents as they are recorded as JSON lines, "
+            "each one with the token to resume the stream after it")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            dest='output',
+            default=None,
+            help="The file to append the lines to (defaults to stdout)",
+            )
+        parser.add_argument(
+            '--resume-after',
+            dest='resume_after',
+            default=None,
+            help="The token (as written in the output) of the document to "
+                 "carry on after",
+            )
+        parser.add_argument(
+            '--source',
+            dest='source',
+            choices=[STREAM_CHANGES, STREAM_MIRROR],
+            default=None,
+            help="Read from a change stream or the capped mirror collection "
+                 "(defaults to the latter if it is enabled)",
+            )
+        parser.add_argument(
+            '--follow',
+            action='store_true',
+            dest='follow',
+            default=False,
+            help="Keep waiting for new documents rather than stopping once "
+                 "those recorded so far have been written",
+            )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            dest='limit',
+            default=None,
+            help="Stop after this many documents",
+            )
+
+    def handle(self, *args, **options):
+        resume_after = options['resume_after']
+        if resume_after is not None:
+            try:
+                resume_after = json_util.loads(resume_after)
+            except ValueError, exc:
+                raise CommandError("Invalid resume token: %s" % exc)
+
+        try:
+            stream = AuditStream(resume_after, options['source'],
+                                 options['follow'])
+        except (ValueError, NotImplementedError), exc:
+            raise CommandError(str(exc))
+
+        if options['output']:
+            output = open(options['output'], 'a')
+        else:
+            output = None
+
+        count = 0
+        try:
+            for token, document in stream:
+                line = json_util.dumps(dict(token=token, document=document))
+                if output is None:
+                    self.stdout.write(line)
+                else:
+                    output.write(line + "\n")
+                    output.flush()
+                count += 1
+
+                if options['limit'] is not None and count >= options['limit']:
+                    break
+        except (MongoConnectionError, PyMongoError), exc:
+            raise CommandError(str(exc))
+        finally:
+            if output is not None:
+                output.close()
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+A storage backend keeping the audit documents in the memory of the process,
+for tests and benchmarks which shouldn't need a MongoDB server.
+
+The documents are kept as BSON, so they are read back with the types MongoDB
+would give them (e.g. tuples become lists and dates are truncated to the
+millisecond). They are indexed by the app, model and primary key of their
+object, and the deletions by the app and model, so reading the history of an
+object doesn't scan the whole collection. Queries which don't give the app
+and model of the objects scan all the documents of the collection instead.
+
+"""
+
+from datetime import datetime
+from itertools import count, islice
+from numbers import Number
+from operator import ge, gt, itemgetter, le, lt
+import threading
+
+from bson import BSON, ObjectId
+from pymongo import DESCENDING
+from pymongo.errors import DuplicateKeyError
+
+from djangoaudit.storage import AuditStorage
+
+__all__ = ["MemoryStorage"]
+
+_MISSING = object()
+"""The value of the keys missing from a document"""
+
+_COMPARISONS = {'$gt': gt, '$gte': ge, '$lt': lt, '$lte': le}
+
+_COMPARABLE_TYPES = (Number, basestring, datetime, ObjectId)
+"""The types whose values are compared with each other, as in MongoDB"""
+
+
+def _is_comparable(value, operand):
+    return any(isinstance(value, value_type) and
+               isinstance(operand, value_type) for value_type in
+               _COMPARABLE_TYPES)
+
+
+def _matches_condition(value, condition):
+    """
+    Return whether ``value`` (:data:`_MISSING` if there is none) matches
+    ``condition``, either a value or a dictionary of operators
+
+    """
+    if not isinstance(condition, dict) or \
+       not all(key.startswith('$') for key in condition):
+        if value is _MISSING:
+            return condition is None
+        return value == condition
+
+    for operator, operand in condition.iteritems():
+        if operator == '$exists':
+            matches = (value is not _MISSING) == bool(operand)
+        elif operator == '$in':
+            matches = any(_matches_condition(value, item) for item in operand)
+        elif operator == '$ne':
+            matches = not _matches_condition(value, operand)
+        elif operator in _COMPARISONS:
+            matches = value is not _MISSING and \
+                _is_comparable(value, operand) and \
+                _COMPARISONS[operator](value, operand)
+        else:
+            raise ValueError("The %s operator is not supported by the "
+                             "in-memory storage" % operator)
+
+        if not matches:
+            return False
+
+    return True
+
+
+def _matches(document, query):
+    """Return whether ``document`` matches ``query``"""
+    for key, condition in query.iteritems():
+        if key == '$and':
+            matches = all(_matches(document, clause) for clause in condition)
+        elif key == '$or':
+            matches = any(_matches(document, clause) for clause in condition)
+        elif key == '$nor':
+            matches = not any(_matches(document, clause) for clause in
+                              condition)
+        else:
+            matches = _matches_condition(document.get(key, _MISSING),
+                                         condition)
+
+        if not matches:
+            return False
+
+    return True
+
+
+def _get_object_key(query):
+    """
+    Return the app and model of the objects ``query`` selects, along with
+    their primary keys, so that only their documents are matched against it
+
+    The app and model are ``None`` if ``query`` doesn't give both of them, and
+    the primary keys are ``None`` unless ``query`` gives them as a value or
+    with ``$in``, in which case all the documents are matched.
+
+    """
+    model_key = (query.get('object_app'), query.get('object_model'))
+    if not all(isinstance(value, basestring) for value in model_key):
+        return None, None
+
+    pks = query.get('object_pk', _MISSING)
+    if pks is _MISSING:
+        return model_key, None
+    if isinstance(pks, dict):
+        if pks.keys() != ['$in']:
+            return model_key, None
+        return model_key, set(pks['$in'])
+    return model_key, [pks]
+
+
+class _MemoryCollection(object):
+    """
+    The documents of a collection as ``(sequence, document, BSON)`` entries,
+    where the sequence gives the order they were inserted in
+
+    """
+
+    def __init__(self):
+        self.ids = set()
+        self.sequence = count()
+
+        # The entries of each object by app and model, then primary key:
+        self.objects = {}
+        # The entries recording deletions by app and model:
+        self.deletions = {}
+
+    def add(self, document):
+        """
+        :raises pymongo.errors.DuplicateKeyError: If there is a document with
+            the same ``_id`` already
+
+        """
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+
+        object_id = document['_id']
+        if object_id in self.ids:
+            raise DuplicateKeyError("E11000 duplicate key error: _id %r" %
+                                    object_id, 11000)
+
+        data = BSON.encode(document)
+        stored = data.decode()
+        entry = (next(self.sequence), stored, data)
+        self.ids.add(object_id)
+
+        model_key = (stored.get('object_app'), stored.get('object_model'))
+        pk = stored.get('object_pk')
+        self.objects.setdefault(model_key, {}).setdefault(pk, []).append(entry)
+        if stored.get('audit_is_delete') is True:
+            self.deletions.setdefault(model_key, []).append(entry)
+
+    def get_object_entries(self, model_key, pks):
+        """
+        Return the entries of the objects with ``pks`` in insertion order, or
+        of all the objects if ``model_key`` is ``None``
+
+        """
+        if model_key is None:
+            entries_by_pk = {}
+            for model_entries_by_pk in self.objects.itervalues():
+                for pk, entries in model_entries_by_pk.iteritems():
+                    entries_by_pk.setdefault(pk, []).extend(entries)
+        else:
+            entries_by_pk = self.objects.get(model_key, {})
+
+        if pks is None:
+            pks = entries_by_pk.keys()
+
+        entries = []
+        for pk in pks:
+            entries.extend(entries_by_pk.get(pk, ()))
+        entries.sort(key=itemgetter(0))
+        return entries
+
+    def get_deletion_entries(self, model_key):
+        """
+        Return the entries recording deletions of the objects of
+        ``model_key``, or of all the objects if it's ``None``, in insertion
+        order
+
+        """
+        if model_key is not None:
+            return list(self.deletions.get(model_key, ()))
+
+        entries = []
+        for model_entries in self.deletions.itervalues():
+            entries.extend(model_entries)
+        entries.sort(key=itemgetter(0))
+        return entries
+
+
+class MemoryStorage(AuditStorage):
+    """
+    Keep the audit documents in the memory of the process
+
+    The documents are shared by all the threads of the process, and can be
+    discarded with :meth:`clear`. The compact schema isn't supported, so all
+    the documents are recorded in the standard schema, and neither are the
+    features which manage the collections in MongoDB itself (see
+    :func:`~djangoaudit.storage.require_mongo_storage`).
+
+    :raises ValueError: If a query uses an operator which isn't supported
+
+    """
+
+    supports_compact_schema = False
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def clear(self, collection_name=None):
+        """
+        Discard all the documents, or only those of the collection named
+        ``collection_name``
+
+        """
+        with self._lock:
+            if collection_name is None:
+                self._collections.clear()
+            else:
+                self._collections.pop(collection_name, None)
+
+    def _get_collection(self, collection):
+        name = collection.collection_name
+        memory_collection = self._collections.get(name)
+        if memory_collection is None:
+            memory_collection = self._collections[name] = _MemoryCollection()
+        return memory_collection
+
+    def insert(self, collection, document):
+        self.insert_many(collection, [document])
+
+    def insert_many(self, collection, documents, ordered=True):
+        error = None
+        with self._lock:
+            memory_collection = self._get_collection(collection)
+            for document in documents:
+                try:
+                    memory_collection.add(document)
+                except DuplicateKeyError, exc:
+                    if ordered:
+                        raise
+                    error = error or exc
+
+        if error is not None:
+            raise error
+
+    def _find(self, entries, query, projection, sort, limit=None):
+        """
+        Generate the documents in ``entries`` matching ``query``, decoded
+        afresh so that the caller can change them
+
+        """
+        entries = [entry for entry in entries if _matches(entry[1], query)]
+        for key, direction in reversed(sort or ()):
+            entries.sort(key=lambda entry: entry[1].get(key),
+                         reverse=direction == DESCENDING)
+
+        if projection is not None:
+            if isinstance(projection, dict):
+                projection = [key for key, included in projection.iteritems()
+                              if included]
+            projection = set(projection)
+            projection.add('_id')
+
+        for _, _, data in islice(entries, limit or None):
+            document = data.decode()
+            if projection is not None:
+                document = dict((key, value) for key, value in
+                                document.iteritems() if key in projection)
+            yield document
+
+    def find_by_object(self, collection, query, projection=None, sort=None,
+                       limit=None, batch_size=None):
+        model_key, pks = _get_object_key(query)
+        with self._lock:
+            entries = self._get_collection(collection).get_object_entries(
+                model_key, pks)
+        return self._find(entries, query, projection, sort, limit)
+
+    def find_deletions(self, collection, query, projection=None, sort=None):
+        model_key, _ = _get_object_key(query)
+        with self._lock:
+            entries = self._get_collection(collection).get_deletion_entries(
+                model_key)
+        return self._find(entries, query, projection, sort)
+
+    def find_first(self, collection, query, sort, group_key='object_pk'):
+        first_documents = {}
+        for document in self.find_by_object(collection, query, sort=sort):
+            first_documents.setdefault(document.get(group_key), document)
+        return first_documents.values()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Django middleware for django-audit
+
+"""
+
+from logging import getLogger
+import threading
+
+from djangoaudit.batching import (audit_batch, begin_audit_batch,
+                                  end_audit_batch, reset_audit_batch)
+
+__all__ = ['AuditBatchMiddleware']
+
+_LOGGER = getLogger(__name__)
+
+class AuditBatchMiddleware(object):
+    """
+    Write all the audit documents produced while handling a request together
+    once the response is returned.
+
+    This works both in ``MIDDLEWARE_CLASSES`` and in the newer ``MIDDLEWARE``
+    setting. With ``MIDDLEWARE_CLASSES`` the batch is also written if the view
+    raises an exception, and a batch left open by an earlier request whose
+    response never reached this middleware (e.g. because the
+    ``process_response`` of another middleware raised) is written out before
+    the next request on the thread starts its own.
+
+    """
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        self._local = threading.local()
+
+    def __call__(self, request):
+        with audit_batch():
+            return self.get_response(request)
+
+    def process_request(self, request):
+        if getattr(self._local, 'active', False):
+            _LOGGER.warning("Writing out the audit batch left open by an "
+                            "earlier request")
+            reset_audit_batch()
+
+        begin_audit_batch()
+        self._local.active = True
+
+    def process_exception(self, request, exception):
+        self._end_batch()
+
+    def process_response(self, request, response):
+        self._end_batch()
+        return response
+
+    def _end_batch(self):
+        """End the batch of the current request, unless it's ended already"""
+
+        if getattr(self._local, 'active', False):
+            self._local.active = False
+            end_audit_batch()
@@ -14,20 +14,58 @@
 #
 ##############################################################################
 
-from collections import defaultdict
-from datetime import datetime, date
+from collections import defaultdict, OrderedDict
+from datetime import datetime, date, timedelta
 from decimal import Decimal
+from inspect import getmro
 from logging import getLogger
+import threading
+from timeit import default_timer
 
-
+from bson import BSON
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
 from django.db.models.base import ModelBase, Model
+from django.db.models.manager import Manager
+from django.db.models.query import QuerySet
 from django.db.models.fields import DecimalField
-from django.db.models.loading import get_models
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import ConfigurationError, ConnectionFailure, PyMongoError
+from pymongo.write_concern import WriteConcern
 
+from djangoaudit.batching import get_current_batch
 from djangoaudit.connection import *
+from djangoaudit.indexes import ensure_indexes
+from djangoaudit.instrumentation import (COUNTER_DOCUMENTS_WRITTEN,
+                                         COUNTER_MONGO_UNAVAILABLE,
+                                         COUNTER_SAVES_SKIPPED,
+                                         COUNTER_WRITE_FAILURES,
+                                         PHASE_CHECKPOINT, PHASE_COERCION,
+                                         PHASE_DIFF, PHASE_ENCODING,
+                                         PHASE_INSERT, PHASE_SNAPSHOT,
+                                         TimedFunction,
+                                         increment, is_instrumented,
+                                         record_audit_time, record_timing)
+from djangoaudit.partitions import (is_partitioned, get_partition_name,
+                                    get_partition_names, list_partitions)
+from djangoaudit.schema import (SCHEMA_COMPACT, SCHEMA_STANDARD,
+                                SCHEMA_VERSIONS, compact_key,
+                                compact_projection, compact_query,
+                                compact_sort, decode_document,
+                                encode_document, get_field_dictionary,
+                                get_stored_key, register_field_names)
+from djangoaudit.spool import get_audit_spool, spool_documents
+from djangoaudit.storage import get_storage_backend
+from djangoaudit.writer import get_audit_writer, insert_documents
 
 
-__all__ = ["AuditedModel"] 
+__all__ = ["AuditedModel", "AuditedQuerySet", "AuditedManager",
+           "get_audit_log_cursor", "get_audit_collection_names",
+           "register_bson_coercion", "SNAPSHOT_QUERY", "SNAPSHOT_LOAD",
+           "SNAPSHOT_LAST_AUDIT", "RETENTION_EXPIRE", "RETENTION_ARCHIVE"]
 
     
 _LOGGER = getLogger(__name__)
@@ -41,21 +79,32 @@ class _collection_handler(object):
     the connection
     """
     
-    def __init__(self, collection_name):
+    def __init__(self, collection_name, write_concern=None):
         """
         
         :param collection_name: The name of the collection to use
         :type collection_name: :class:`basestring`
+        :param write_concern: The write concern options for writes to the
+            collection (defaults to those of the client)
+        :type write_concern: :class:`dict`
         
         """
         
         self.collection_name = collection_name
+        self.write_concern = write_concern
         self.collection = None
+        self.generation = None
         
     def _get_collection(self):
         """Actually get the connection and handle failure to acquire it"""
         try:
-            self.collection = MONGO_CONNECTION.get_collection(self.collection_name)
+            collection = MONGO_CONNECTION.get_collection(self.collection_name)
+            if self.write_concern is not None:
+                collection = collection.with_options(
+                    write_concern=WriteConcern(**self.write_concern))
+            
+            self.collection = collection
+            self.generation = MONGO_CONNECTION.generation
         except MongoConnectionError:
             self.collection = None
             raise
@@ -70,15 +119,94 @@ class _collection_handler(object):
         
         """
         
-        if not self.collection:
+        # Go through the connection while its circuit breaker isn't closed, so
+        # that requests fail fast, and once it has a new client:
+        if not self.collection or not MONGO_CONNECTION.breaker.closed or \
+                self.generation != MONGO_CONNECTION.generation:
             self._get_collection()
             
         return self.collection
             
-AUDITING_COLLECTION = _collection_handler(AUDITING_COLLECTION_NAME)    
+_COLLECTION_HANDLERS = {}
+"""The handler for each collection name and write concern"""
+
+def _get_collection_handler(collection_name, write_concern=None):
+    """
+    Return the handler for ``collection_name`` with ``write_concern``, so that
+    the documents for the same collection and write concern are grouped
+    together by the batches and the background writer
+    
+    """
+    
+    if write_concern is None:
+        key = (collection_name, None)
+    else:
+        key = (collection_name, tuple(sorted(write_concern.items())))
+    
+    handler = _COLLECTION_HANDLERS.get(key)
+    if handler is None:
+        handler = _COLLECTION_HANDLERS.setdefault(
+            key, _collection_handler(collection_name, write_concern))
+    return handler
+
+AUDITING_COLLECTION = _get_collection_handler(AUDITING_COLLECTION_NAME)    
 """The collection to use for Auditing"""    
           
 
+class _ModelReference(object):
+    """
+    Stand in for an instance of ``model_class`` with primary key ``pk`` when
+    auditing rows which were never loaded as instances
+    
+    """
+    
+    def __init__(self, model_class, pk):
+        self._meta = model_class._meta
+        self.pk = pk
+        self._model_class = model_class
+    
+    def __getattr__(self, name):
+        # Fall back to the class attributes of the model (e.g. log_fields):
+        if name == '_model_class':
+            raise AttributeError(name)
+        return getattr(self._model_class, name)
+
+
+def _load_related_objects(model, log_values, using=None, chunk_size=500):
+    """
+    Replace the raw values of the related log fields of ``model`` in
+    ``log_values``, the values of rows as returned by
+    :meth:`django.db.models.query.QuerySet.values` keyed by primary key, with
+    the related objects, as :meth:`AuditedModel.save` records them
+    
+    The related objects are read with one query per related field and
+    ``chunk_size`` values. Values whose related object no longer exists are
+    left as they are.
+    
+    :param using: The alias of the database to read the related objects from
+    
+    """
+    for field_name in model._audit_related_fields:
+        field = model._meta.get_field(field_name)
+        target_field = field.rel.get_related_field()
+        manager = field.rel.to._base_manager.db_manager(using)
+        
+        values = list(set(values[field_name] for values in
+                          log_values.itervalues()
+                          if values[field_name] is not None))
+        related_objects = {}
+        for start in xrange(0, len(values), chunk_size):
+            lookup = {'%s__in' % target_field.name:
+                      values[start:start + chunk_size]}
+            for related_object in manager.filter(**lookup):
+                value = getattr(related_object, target_field.attname)
+                related_objects[value] = related_object
+        
+        for values in log_values.itervalues():
+            value = values[field_name]
+            values[field_name] = related_objects.get(value, value)
+
+
 def _get_params_from_model(model):
     """
     Return a dictionary containing object_app, object_model, object_pk
@@ -98,10 +226,54 @@ def _get_params_from_model(model):
                 object_model=model._meta.object_name,
                 object_pk=model.pk)
     
-def _coerce_dict_to_bson_compatible(dikt):
-    for k in dikt.keys():
-        dikt[k] = _coerce_to_bson_compatible(dikt[k])
-    return dikt
+_BSON_COERCIONS = {}
+"""The converters registered with :func:`register_bson_coercion` by type"""
+
+_BSON_COERCION_CACHE = {}
+"""The converter resolved for each type seen so far (``None`` if there's none)"""
+
+def register_bson_coercion(value_type, converter):
+    """
+    Register ``converter`` to make values of ``value_type`` (or of any of its
+    subclasses) BSON compatible before they are recorded
+    
+    e.g. to record UUIDs as strings::
+    
+        register_bson_coercion(UUID, str)
+    
+    :param value_type: The type of the values to convert
+    :type value_type: :class:`type`
+    :param converter: A callable taking the value and returning its BSON
+        compatible equivalent, or ``None`` to leave values of ``value_type``
+        untouched even if a base class has a converter
+    
+    """
+    
+    _BSON_COERCIONS[value_type] = converter
+    
+    # The converters resolved for subclasses may have changed:
+    _BSON_COERCION_CACHE.clear()
+
+def _get_bson_coercion(value_type):
+    """
+    Return the converter for ``value_type``: that of the nearest class in its
+    MRO for which one has been registered
+    
+    """
+    
+    try:
+        return _BSON_COERCION_CACHE[value_type]
+    except KeyError:
+        pass
+    
+    converter = None
+    for base in getmro(value_type):
+        if base in _BSON_COERCIONS:
+            converter = _BSON_COERCIONS[base]
+            break
+    
+    _BSON_COERCION_CACHE[value_type] = converter
+    return converter
 
 def _coerce_to_bson_compatible(value):
     """
@@ -111,19 +283,50 @@ def _coerce_to_bson_compatible(value):
     BSON cannot handle the following:
     * dates - convert to datetime
     * decimals - convert to float
+    * Django models - convert to string
+    
+    Converters for other types can be added with
+    :func:`register_bson_coercion`.
+    
+    """
+    
+    converter = _get_bson_coercion(type(value))
+    if converter is None:
+        return value
+    
+    return converter(value)
+
+register_bson_coercion(Decimal, float)
+register_bson_coercion(date, lambda value: datetime.fromordinal(value.toordinal()))
+register_bson_coercion(datetime, None)
+register_bson_coercion(Model, str)
+
+def _make_field_decoder(field):
+    """
+    Return a callable which converts the values recorded for ``field`` back to
+    the type of the field
+    
+    :param field: The field on the model
+    :type field: :class:`django.db.models.fields.Field`
+    
     """
     
-    if isinstance(value, Decimal):
-        # Convert to float:
-        return float(value)
-    elif isinstance(value, date) and not isinstance(value, datetime):
-        return datetime.fromordinal(value.toordinal())
+    if not isinstance(field, DecimalField):
+        return field.to_python
+    
+    # Due to the inability of Decimal to directly convert floats and
+    # DecimalField's oversight for this fact, convert to a string
+    # first:
+    formatter = "%%%d.%df" % (field.max_digits, field.decimal_places)
+    to_python = field.to_python
+    
+    def decode_decimal(value):
+        if value is None:
+            return None
+        return to_python(formatter % value)
     
-    # If it's a Django model, cast to String
-    if type(value) in get_models():
-        value = str(value)
+    return decode_decimal
 
-    return value
 
 def _coerce_datum_to_model_types(model_class_or_inst, field, value):
     """
@@ -137,20 +340,11 @@ def _coerce_datum_to_model_types(model_class_or_inst, field, value):
     
     """
     
+    decoder = model_class_or_inst._audit_decoders.get(field)
+    if decoder is None:
+        return value
     
-    if field in model_class_or_inst.log_fields:
-        field_inst = model_class_or_inst._meta.get_field_by_name(field)[0]
-        
-        # Due to the inability of Decimal to directly convert floats and
-        # DecimalField's oversight for this fact, convert to a string
-        # first:
-        if isinstance(field_inst, DecimalField):
-            # Make the string formatter:
-            formatter = "%%%d.%df" % (field_inst.max_digits,
-                                      field_inst.decimal_places)
-            value = formatter % value
-        return field_inst.to_python(value)
-    return value
+    return decoder(value)
 
 
 def _coerce_data_to_model_types(model_class_or_inst, data):
@@ -164,233 +358,1731 @@ def _coerce_data_to_model_types(model_class_or_inst, data):
     
     """
     
+    decoders = model_class_or_inst._audit_decoders
+    
     coerced_data = {}
-    for key, value in data.items():
-        coerced_data[key] = _coerce_datum_to_model_types(model_class_or_inst,
-                                                         key,
-                                                         value)
+    for key, value in data.iteritems():
+        decoder = decoders.get(key)
+        if decoder is None:
+            coerced_data[key] = value
+        else:
+            coerced_data[key] = decoder(value)
             
     return coerced_data
 
 
-def _audit_model(model, initial_values, final_values, operator=None, notes=None,
-                 **extra_info):
+_NO_PK = object()
+"""Marker for values which don't have a primary key"""
+
+def _make_audit_document(model, initial_values, final_values, operator=None,
+                         notes=None, **extra_info):
     """
-    Calculate the differences on a model as an adjunct for AuditedModel 
+    Calculate the differences on a model and build the document to record them
     
     :param model: The Django model this change relates to
     :param initial_values: A :class:`dict` of initial values
     :param final_values: A :class:`dict` of final values
     :param operator: Optional operator who made the change
     :param notes: Optional notes to be recorded against this change
+    :return: The audit document or ``None`` if there is nothing to record
+    :rtype: :class:`dict`
+    
+    """
+    
+    has_checkpoints = getattr(model, 'audit_checkpoint_interval', None) or \
+        getattr(model, 'audit_checkpoint_bytes', None)
+    is_compact = getattr(model, 'audit_schema', SCHEMA_STANDARD) == \
+        SCHEMA_COMPACT and get_storage_backend().supports_compact_schema
+    
+    if not is_instrumented():
+        audit = _build_audit_document(model, initial_values, final_values,
+                                      operator, notes, extra_info,
+                                      _coerce_to_bson_compatible)
+        if audit is None:
+            return None
+        
+        if has_checkpoints:
+            _add_checkpoint(model, audit, initial_values, final_values)
+        if is_compact:
+            audit = _encode_compact_document(model, audit)
+        return audit
+    
+    coerce = TimedFunction(_coerce_to_bson_compatible)
+    started_at = default_timer()
+    audit = _build_audit_document(model, initial_values, final_values,
+                                  operator, notes, extra_info, coerce)
+    
+    record_timing(PHASE_DIFF, default_timer() - started_at - coerce.seconds)
+    record_timing(PHASE_COERCION, coerce.seconds)
+    if audit is None:
+        increment(COUNTER_SAVES_SKIPPED)
+        return None
+    
+    if has_checkpoints:
+        started_at = default_timer()
+        _add_checkpoint(model, audit, initial_values, final_values)
+        record_timing(PHASE_CHECKPOINT, default_timer() - started_at)
+    
+    if is_compact:
+        started_at = default_timer()
+        audit = _encode_compact_document(model, audit)
+        record_timing(PHASE_ENCODING, default_timer() - started_at)
+    
+    return audit
+
+
+def _build_audit_document(model, initial_values, final_values, operator, notes,
+                          extra_info, coerce):
+    """
+    Build the document for :func:`_make_audit_document` in the standard
+    schema and without a checkpoint, making the values BSON compatible with
+    ``coerce``
     
     """
     
     # make the object key for this model:
     audit = _get_params_from_model(model)
+    audit['object_pk'] = coerce(audit['object_pk'])
     audit['audit_date_stamp'] = datetime.utcnow()
     
     # append any optional data:
     if operator:
-        audit['audit_operator'] = operator
+        audit['audit_operator'] = coerce(operator)
         
     if notes:
-        audit['audit_notes'] = notes
+        audit['audit_notes'] = coerce(notes)
     
     changes = False
     for key, final_value in final_values.iteritems():
         # If the value has an attribute PK, expect it's a django model and we should log that too
-        try:
-            audit['%s_pk' % key] = getattr(final_value, 'pk')
-        except AttributeError, e:
-            pass
+        final_pk = getattr(final_value, 'pk', _NO_PK)
+        if final_pk is not _NO_PK:
+            audit['%s_pk' % key] = coerce(final_pk)
         initial_value = initial_values.get(key)
         # TODO: Can this be simplified? Seems to break the tests by doing so
         if initial_value is None and final_value is not None:
-            audit[key] = _coerce_to_bson_compatible(final_value)
+            audit[key] = coerce(final_value)
             changes = True
         else:
             if initial_value != final_value:
-                audit[key] = _coerce_to_bson_compatible(final_value)
+                audit[key] = coerce(final_value)
                 changes = True
     
     if extra_info:
         for key, value in extra_info.iteritems():
-            audit[key] = _coerce_to_bson_compatible(value)
+            audit[key] = coerce(value)
             changes = True
     
     if not changes:
         # No point in writing this to to DB:
         return None
     
-    # Write out the document and return it's DB id:
+    if getattr(model, 'audit_record_old_values', False) and \
+       'audit_is_delete' not in final_values:
+        audit['audit_old_values'] = _make_old_values(model, audit,
+                                                     initial_values)
+    
+    retention_days = getattr(model, 'audit_retention_days', None)
+    if retention_days and model.audit_retention_policy == RETENTION_EXPIRE:
+        # Models sharing a collection can keep their documents for different
+        # lengths of time, so the TTL index expires them by this date:
+        audit['audit_expires_at'] = audit['audit_date_stamp'] + \
+            timedelta(days=retention_days)
+    
+    # Every value has been made BSON compatible as it was added:
+    return audit
+
+
+def _add_checkpoint(model, audit, initial_values, final_values):
+    """
+    Add the full state of the log fields to ``audit`` if it is due to carry
+    a checkpoint (see :attr:`AuditedModel.audit_checkpoint_interval`)
+    
+    """
+    is_creation = all(value is None for value in initial_values.values())
+    if _is_checkpoint_due(model, audit, is_creation):
+        audit['audit_checkpoint'] = _make_checkpoint(model, final_values)
+
+
+def _encode_compact_document(model, audit):
+    """
+    Return ``audit`` in the compact schema or, if the field dictionary of
+    ``model`` can't be read, as it is
+    
+    The read methods merge the documents in both schemas, so the history of
+    the object stays in order either way.
+    
+    """
     try:
-        audit = _coerce_dict_to_bson_compatible(audit)
-        return AUDITING_COLLECTION().insert(audit)
-    except MongoConnectionError, exc:
-        _LOGGER.critical("Error while writing document to collection: %s "
-                         "Audit data: %r.",  exc, audit)
-        return None
+        dictionary = register_field_names(model._audit_label,
+                                          model.log_fields)
+    except (MongoConnectionError, PyMongoError), exc:
+        _LOGGER.warning("Could not read the field dictionary of %s, so its "
+                        "audit document is recorded in the standard schema: "
+                        "%s", model._audit_label, exc)
+        return audit
+    
+    return encode_document(audit, dictionary, model.audit_related_pk_only)
 
 
-class AuditedModelMeta(ModelBase):
-    """ Meta class for :class:`AuditedModel` """
+def _make_old_values(model, audit, initial_values):
+    """
+    Return the values in ``initial_values`` of the log fields changed in
+    ``audit``, so that the change can be reported without reading the
+    documents before it
+    
+    The values which were ``None`` are left out.
     
-    def __new__(cls, name, bases, attrs):
-        if not "log_fields" in attrs:
-            attrs["log_fields"] = []
-        
-        new_class = super(AuditedModelMeta, cls).__new__(cls, name, bases, attrs)
-        
-        if new_class.log_fields:
-            # Raise an exception if we're trying to log a field which doesn't
-            # exist on the model:
-            defined_fields = [f.name for f in new_class._meta.fields]
-            for field in new_class.log_fields:
-                if field not in defined_fields:
-                    raise AttributeError("Cannot log data for %r as it does not"
-                                         " exist on the model" % field)
-        else:
-            # Default - Log all
-            new_class.log_fields = [f.name for f in new_class._meta.fields]
-        
-        return new_class
-        
-class AuditedModel(Model):
     """
-    A version of django.db.models.Model that will audit any values specified in 
-    the log_fields class attribute
+    old_values = {}
+    for field in model.log_fields:
+        initial_value = initial_values.get(field)
+        if field in audit and initial_value is not None:
+            old_values[field] = _coerce_to_bson_compatible(initial_value)
     
+    return old_values
+
+
+_CHECKPOINT_COUNTERS = OrderedDict()
+"""
+The number of changes and bytes recorded since the last checkpoint of the
+objects audited most recently by this process, by object key
+
+"""
+
+_CHECKPOINT_COUNTERS_LOCK = threading.Lock()
+
+
+def _get_changes_since_checkpoint(model, object_key):
     """
+    Return the number of changes and bytes recorded for the object identified
+    by ``object_key`` since its last checkpoint, as found in the audit log
     
-    __metaclass__ = AuditedModelMeta
+    Only as many documents as it takes to reach the thresholds of ``model``
+    are read.
     
-    class Meta:
-        abstract = True
+    """
+    interval = model.audit_checkpoint_interval
+    max_bytes = model.audit_checkpoint_bytes
     
-    def __init__(self, *args, **kwargs):
-        super(AuditedModel, self).__init__(*args, **kwargs)
-        
-        # Ensure that we can store any extra auditing information on the instance:
-        self._audit_info = defaultdict(lambda: None)
+    changes = 0
+    size = 0
     
-    def save(self, *args, **kwargs):
-        """
-        The save method performs auditing on the model to record the differences
-        before and after the commit to the DB.
-        
-        """
-        
-        # Before we save to the DB, get the values from the original instance:
-        empty_values = False
-        
-        if self.pk is None:
-            # This is the first save, the record is being created:
-            empty_values = True
-        else:
-            try:
-                init_values = self.__class__.objects.filter(pk=self.pk)\
-                                            .values(*self.log_fields)[0]
-            except IndexError:
-                empty_values = True
-                
-        if empty_values:
-            # we don't know what the initial state is, so assume None:
-            init_values = {}
-            
-            for field in self.log_fields:
-                init_values[field] = None
-                
-        final_values = {}
-        
-        # We can't just get the attribute directly off the instance here
-        # because we need to ensure it is of the same type as the initial
-        # value. To do this we use the field's `to_python` method:
-        for field in self.log_fields:
-            final_values[field] = getattr(self, field)
-        
-        # need to actually save the model here to ensure pk for the auditing
-        super(AuditedModel, self).save(*args, **kwargs)
-            
-        _audit_model(self, init_values, final_values, **self._audit_info)
-        
-    def delete(self, *args, **kwargs):
-        """
-        The delete method performs auditing on the model to record the state of 
-        the model prior to deletion.
-        
-        """
-        
-        initial_values, final_values = {}, dict(audit_is_delete=True)
-        
-        for field in self.log_fields:
-            final_values[field] = getattr(self, field)
-        
-        delete_note = "Object deleted. These are the attributes at delete time."
-        
-        # log that this object is being deleted and cater for the case where
-        # other notes have been specified:
-        notes = self._audit_info['notes']
+    try:
+        cursor = _find_audit_documents(
+            model._audit_collection, dict(object_key),
+            sort=[(key, DESCENDING) for key, _ in _AUDIT_LOG_SORT],
+            limit=interval, model=model)
         
-        if notes is None:
-            notes = delete_note
-        else:
-            notes = "%s\n%s" % (delete_note, notes)
+        for datum in cursor:
+            if 'audit_checkpoint' in datum:
+                break
             
-        _audit_model(self, initial_values, final_values, self._audit_info['operator'], notes)
-        
-        super(AuditedModel, self).delete(*args, **kwargs)
+            changes += 1
+            size += len(BSON.encode(datum))
+            if max_bytes and size >= max_bytes:
+                break
+    except MongoConnectionError:
+        pass
     
-    def set_audit_info(self, **kwargs):
-        """Set extra audit information on this instance."""
-        
-        self._audit_info.update(kwargs)
+    return changes, size
+
+
+def _is_checkpoint_due(model, audit, is_creation):
+    """
+    Count ``audit`` as a change to its object and return whether it should
+    carry a checkpoint, as the change or byte threshold of ``model`` has been
+    reached
     
-    def get_audit_log(self):
-        """
-        Construct a generator of all the items in the audit log for this object.
+    The counts are kept in process for the most recently audited objects and
+    read from the audit log for the others. As other processes may have
+    recorded changes since, checkpoints may be recorded later than the
+    thresholds, but never earlier.
+    
+    """
+    interval = model.audit_checkpoint_interval
+    max_bytes = model.audit_checkpoint_bytes
+    
+    object_key = (('object_app', audit['object_app']),
+                  ('object_model', audit['object_model']),
+                  ('object_pk', audit['object_pk']))
+    
+    with _CHECKPOINT_COUNTERS_LOCK:
+        counters = _CHECKPOINT_COUNTERS.pop(object_key, None)
+    
+    if is_creation:
+        # The creation records the full state already:
+        changes = size = 0
+    else:
+        if counters is None:
+            counters = _get_changes_since_checkpoint(model, object_key)
         
-        All data in the object will be converted into the correct type. Each log
-        entry is returned a dictionary of directly set data with an additional 
-        key called ``audit_changes``. This value is a dictionary of the fields
-        which have changed on the model. e.g.::
+        changes = counters[0] + 1
+        size = counters[1]
+        if max_bytes:
+            size += len(BSON.encode(audit))
+    
+    is_due = bool((interval and changes >= interval) or
+                  (max_bytes and size >= max_bytes))
+    if is_due:
+        changes = size = 0
+    
+    with _CHECKPOINT_COUNTERS_LOCK:
+        _CHECKPOINT_COUNTERS[object_key] = (changes, size)
         
-            {'operator' : 'power_user',
-             'extra': 'Extra info',
-             'audit_changes': {'seats': (10, 20),
-                               'premium': (False, True)
-                              }
-            }
+        max_objects = getattr(settings, 'AUDIT_CHECKPOINT_CACHE_SIZE', 10000)
+        while len(_CHECKPOINT_COUNTERS) > max_objects:
+            _CHECKPOINT_COUNTERS.popitem(last=False)
+    
+    return is_due
+
+
+def _make_checkpoint(model, final_values):
+    """
+    Return the full state of the log fields of ``model`` in ``final_values``,
+    recorded in the same way as the changes are
+    
+    """
+    checkpoint = {}
+    for field in model.log_fields:
+        value = final_values.get(field)
         
-        """
+        value_pk = getattr(value, 'pk', _NO_PK)
+        if value_pk is not _NO_PK:
+            checkpoint['%s_pk' % field] = _coerce_to_bson_compatible(value_pk)
         
-        # First get a list of fields on the model we actually want to diff:
-        diff_fields = frozenset(self.log_fields)
+        checkpoint[field] = _coerce_to_bson_compatible(value)
+    
+    return checkpoint
+
+
+def _get_mirrored(pending):
+    """
+    Return the writes of the documents in ``pending`` to the capped collection
+    named by the ``AUDIT_STREAM_MIRROR_COLLECTION`` setting, if set, from
+    which :class:`djangoaudit.stream.AuditStream` reads them
+    
+    """
+    mirror_collection_name = getattr(settings, 'AUDIT_STREAM_MIRROR_COLLECTION',
+                                     None)
+    if not mirror_collection_name:
+        return []
+    
+    mirror_collection = _get_collection_handler(mirror_collection_name)
+    return [(mirror_collection, audit) for collection, audit in pending]
+
+
+def _write_audit_document(audit, collection=AUDITING_COLLECTION):
+    """
+    Write out ``audit`` to ``collection`` and return its DB id
+    
+    The id is allocated here rather than by MongoDB so that it is known even
+    when the document is held back in a batch, handed over to the background
+    writer or spooled, and so that replaying the spool can tell which
+    documents were already written.
+    
+    :param audit: The audit document
+    :type audit: :class:`dict`
+    :param collection: The collection handler to write to
+    :return: The id of the document
+    :rtype: :class:`bson.objectid.ObjectId`
+    
+    """
+    
+    audit['_id'] = ObjectId()
+    collection = _get_partition(
+        collection, audit.get(get_stored_key(audit, 'audit_date_stamp')))
+    pending = [(collection, audit)]
+    mirrored = _get_mirrored(pending)
+    
+    batch = get_current_batch()
+    if batch is not None:
+        for handler, document in pending + mirrored:
+            batch.add(handler, document)
+        return audit['_id']
+    
+    writer = get_audit_writer()
+    if writer is not None:
+        for handler, document in pending + mirrored:
+            writer.put(handler, document)
+        return audit['_id']
+    
+    instrumented = is_instrumented()
+    started_at = default_timer()
+    try:
+        get_storage_backend().insert(collection, audit)
+    except (MongoConnectionError, ConnectionFailure), exc:
+        if isinstance(exc, ConnectionFailure):
+            MONGO_CONNECTION.breaker.record_failure(exc)
+        if instrumented:
+            increment(COUNTER_MONGO_UNAVAILABLE)
         
-        # Now set up a defaultdict with None for all these fields initial values:
-        previous_fields = defaultdict(lambda: None)
+        if spool_documents(pending + mirrored, exc):
+            return audit['_id']
+        return None
+    except PyMongoError:
+        if instrumented:
+            increment(COUNTER_WRITE_FAILURES)
+        raise
     
-        for datum in AUDITING_COLLECTION().find(_get_params_from_model(self)):
-            entry = {}
-            changes = {}
-            for field, value in datum.iteritems():
-                # If the field is a log field report the diff:
-                if field in diff_fields:
-                    new_value = _coerce_datum_to_model_types(self, field, value)
-                    # Record the delta:
-                    changes[field] = (previous_fields[field], new_value)
-                    
-                    # Now update the previous_fields record:
-                    previous_fields[field] = new_value
-                else:
-                    # Just record this directly as an entry in the log:
-                    entry[field] = value
-            
-            # Now put the log together (combine the direct log and changes):
-            if changes:
-                entry['audit_changes'] = changes 
-            yield entry
-            
+    MONGO_CONNECTION.breaker.record_success()
+    if instrumented:
+        record_timing(PHASE_INSERT, default_timer() - started_at)
+        increment(COUNTER_DOCUMENTS_WRITTEN)
+    
+    if mirrored:
+        insert_documents(mirrored)
+    
+    return audit['_id']
+
+
+def _has_unwritten_audits():
+    """
+    Return whether some audit documents of this process may not have reached
+    MongoDB yet: they are held back in a batch, queued for the background
+    writer or spooled.
+    
+    :rtype: :class:`bool`
+    
+    """
+    
+    if get_current_batch() is not None or get_audit_writer() is not None:
+        return True
+    
+    spool = get_audit_spool()
+    return spool is not None and spool.has_pending_documents()
+
+
+def _prepare_audit_documents(audits, collection):
+    """
+    Allocate the ids of ``audits`` and return them along with the partitions
+    of ``collection`` they go to, followed by their copies for the stream
+    mirror collection, as ``(collection handler, document)`` pairs
+    
+    """
+    pending = []
+    for audit in audits:
+        audit['_id'] = ObjectId()
+        date_stamp = audit.get(get_stored_key(audit, 'audit_date_stamp'))
+        pending.append((_get_partition(collection, date_stamp), audit))
+    return pending, _get_mirrored(pending)
+
+
+def _insert_audit_documents(audits, chunk_size=500,
+                            collection=AUDITING_COLLECTION, raise_errors=False,
+                            ordered=True):
+    """
+    Write out ``audits`` to ``collection`` with ``insert_many`` calls of at
+    most ``chunk_size`` documents, bypassing the current batch and the
+    background writer
+    
+    :param audits: The audit documents
+    :type audits: :class:`list`
+    :param chunk_size: The maximum number of documents per insert
+    :type chunk_size: :class:`int`
+    :param collection: The collection handler to write to
+    :param raise_errors: Whether to raise the errors rather than spool or log
+        the documents (see :func:`djangoaudit.writer.insert_documents`)
+    :type raise_errors: :class:`bool`
+    :param ordered: Whether to write ``audits`` in order
+    :type ordered: :class:`bool`
+    :return: The number of documents written to MongoDB or the spool
+    :rtype: :class:`int`
+    
+    """
+    pending, mirrored = _prepare_audit_documents(audits, collection)
+    
+    written = 0
+    for start in xrange(0, len(pending), chunk_size):
+        written += insert_documents(pending[start:start + chunk_size],
+                                    raise_errors, ordered)
+        if mirrored:
+            insert_documents(mirrored[start:start + chunk_size], raise_errors,
+                             ordered)
+    return written
+
+
+def _write_audit_documents(audits, chunk_size=500,
+                           collection=AUDITING_COLLECTION):
+    """
+    Write out ``audits`` in order to ``collection`` with ``insert_many`` calls
+    of at most ``chunk_size`` documents
+    
+    :param audits: The audit documents
+    :type audits: :class:`list`
+    :param chunk_size: The maximum number of documents per insert
+    :type chunk_size: :class:`int`
+    :param collection: The collection handler to write to
+    :return: The number of documents written to MongoDB or the spool, or
+        handed over to the current batch or the background writer
+    :rtype: :class:`int`
+    
+    """
+    
+    batch = get_current_batch()
+    writer = get_audit_writer()
+    if batch is None and writer is None:
+        return _insert_audit_documents(audits, chunk_size, collection)
+    
+    pending, mirrored = _prepare_audit_documents(audits, collection)
+    for handler, audit in pending + mirrored:
+        if batch is not None:
+            batch.add(handler, audit)
+        else:
+            writer.put(handler, audit)
+    return len(pending)
+
+
+def _audit_model(model, initial_values, final_values, operator=None, notes=None,
+                 **extra_info):
+    """
+    Calculate the differences on a model as an adjunct for AuditedModel 
+    
+    :param model: The Django model this change relates to
+    :param initial_values: A :class:`dict` of initial values
+    :param final_values: A :class:`dict` of final values
+    :param operator: Optional operator who made the change
+    :param notes: Optional notes to be recorded against this change
+    :return: The DB id of the recorded change or ``None`` if nothing changed
+    
+    """
+    
+    audit = _make_audit_document(model, initial_values, final_values,
+                                 operator, notes, **extra_info)
+    if audit is None:
+        return None
+    
+    return _write_audit_document(
+        audit, getattr(model, '_audit_collection', AUDITING_COLLECTION))
+
+
+_AUDIT_META_FIELDS = ('_id', 'object_app', 'object_model', 'object_pk',
+                      'audit_date_stamp', 'audit_operator', 'audit_notes',
+                      'audit_is_delete', 'audit_old_values')
+"""The keys recorded in every audit document which aren't model fields"""
+
+_AUDIT_LOG_SORT = [('audit_date_stamp', ASCENDING), ('_id', ASCENDING)]
+"""The order of the entries in the audit log of an object"""
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def get_audit_log_cursor(entry):
+    """
+    Return the cursor of an entry of :meth:`AuditedModel.get_audit_log`, which
+    can be passed as ``after`` to get the entries following it
+    
+    :param entry: An entry of the audit log
+    :type entry: :class:`dict`
+    :rtype: :class:`str`
+    
+    """
+    delta = entry['audit_date_stamp'] - _EPOCH
+    milliseconds = (delta.days * 86400 + delta.seconds) * 1000 + \
+        delta.microseconds // 1000
+    return "%d-%s" % (milliseconds, entry['_id'])
+
+
+def _parse_audit_log_cursor(cursor):
+    """
+    Return the date stamp and id encoded in ``cursor``
+    
+    :raises ValueError: If ``cursor`` is not valid
+    
+    """
+    try:
+        milliseconds, object_id = cursor.split('-')
+        return (_EPOCH + timedelta(milliseconds=int(milliseconds)),
+                ObjectId(object_id))
+    except (ValueError, InvalidId):
+        raise ValueError("Invalid audit log cursor: %r" % cursor)
+
+
+def _get_keyset_query(position, operator):
+    """
+    Return the query for the documents before (``$lt``) or after (``$gt``)
+    ``position`` in the order of :data:`_AUDIT_LOG_SORT`
+    
+    :param position: The date stamp and id of a document
+    :type position: :class:`tuple`
+    
+    """
+    date_stamp, object_id = position
+    return {'$or': [{'audit_date_stamp': {operator: date_stamp}},
+                    {'audit_date_stamp': date_stamp,
+                     '_id': {operator: object_id}}]}
+
+
+_INDEXED_PARTITIONS = set()
+"""The partitions whose indexes have been ensured by this process"""
+
+
+def _get_partition(collection, when):
+    """
+    Return the handler for the partition of ``collection`` to write a document
+    recorded at ``when`` to, or ``collection`` if it isn't partitioned
+    
+    The indexes of each partition are ensured the first time this process
+    writes to it.
+    
+    """
+    if not is_partitioned():
+        return collection
+    
+    partition_name = get_partition_name(collection.collection_name,
+                                        when or datetime.utcnow())
+    partition = _get_collection_handler(partition_name,
+                                        collection.write_concern)
+    
+    if partition_name not in _INDEXED_PARTITIONS:
+        try:
+            ensure_indexes(partition())
+        except (MongoConnectionError, PyMongoError), exc:
+            _LOGGER.warning("Could not ensure the indexes on %s: %s",
+                            partition_name, exc)
+        else:
+            _INDEXED_PARTITIONS.add(partition_name)
+    
+    return partition
+
+
+def _get_partitions(collection, since=None, until=None):
+    """
+    Return the handlers of ``collection`` and those of its partitions which
+    may hold documents recorded between ``since`` and ``until``, oldest first
+    
+    The documents recorded before partitioning was enabled stay in
+    ``collection`` itself, so it always comes first.
+    
+    """
+    if not is_partitioned():
+        return [collection]
+    
+    partition_names = get_partition_names(collection.collection_name, since,
+                                          until)
+    return [collection] + [_get_collection_handler(partition_name) for
+                           partition_name in partition_names]
+
+
+def _get_schema_queries(model, query):
+    """
+    Return the queries for the documents matching ``query`` in each schema the
+    documents of ``model`` may be recorded in, along with the field dictionary
+    to read them with (``None`` for the standard schema)
+    
+    The compact schema is only queried once the model has a field dictionary,
+    i.e. once it has been switched to it, and if the storage backend supports
+    it.
+    
+    :raises MongoConnectionError: If MongoDB is unavailable
+    
+    """
+    schema_queries = [(query, None)]
+    if model is None or not get_storage_backend().supports_compact_schema:
+        return schema_queries
+    
+    if model.audit_schema == SCHEMA_COMPACT:
+        dictionary = register_field_names(model._audit_label,
+                                          model.log_fields)
+    else:
+        dictionary = get_field_dictionary(model._audit_label)
+    
+    if dictionary is not None:
+        schema_queries.append((compact_query(query, dictionary), dictionary))
+    return schema_queries
+
+
+def _read_documents(collection, query, projection, sort, limit, batch_size,
+                    dictionary, related_fields, decode, deletions):
+    """
+    Generate the documents matching ``query`` in ``collection`` (only those
+    recording deletions if ``deletions`` is set) along with their sort key,
+    decoding them from the compact schema if ``dictionary`` is given and
+    ``decode`` is set
+    
+    """
+    if dictionary is not None:
+        if projection is not None:
+            projection = compact_projection(projection, dictionary)
+        if sort:
+            sort = compact_sort(sort, dictionary)
+    
+    storage = get_storage_backend()
+    if deletions:
+        documents = storage.find_deletions(collection, query, projection,
+                                           sort)
+    else:
+        documents = storage.find_by_object(collection, query, projection,
+                                           sort, limit, batch_size)
+    
+    try:
+        for datum in documents:
+            sort_key = tuple(datum.get(key) for key, _ in sort or ())
+            if decode and dictionary is not None:
+                datum = decode_document(datum, dictionary, related_fields)
+            yield sort_key, datum
+    finally:
+        documents.close()
+
+
+def _merge_documents(readers, reverse):
+    """
+    Generate the documents from ``readers``, which each generate documents
+    along with their sort key in order, in the order of their sort keys
+    
+    """
+    heads = []
+    for reader in readers:
+        for sort_key, datum in reader:
+            heads.append([sort_key, datum, reader])
+            break
+    
+    choose = max if reverse else min
+    while heads:
+        head = choose(heads, key=lambda head: head[0])
+        yield head[1]
+        
+        for sort_key, datum in head[2]:
+            head[:2] = [sort_key, datum]
+            break
+        else:
+            heads.remove(head)
+
+
+def _find_in_collection(collection, schema_queries, projection=None,
+                        sort=_AUDIT_LOG_SORT, limit=None, batch_size=None,
+                        related_fields=frozenset(), decode=True,
+                        deletions=False):
+    """
+    Generate the documents matching the queries in ``schema_queries`` (see
+    :func:`_get_schema_queries`) in ``collection`` in the order of ``sort``,
+    or only those recording deletions if ``deletions`` is set
+    
+    The documents in each schema are read with a query of their own, and the
+    results of the queries merged. Unless ``decode`` is unset, the documents
+    are all returned in the standard schema.
+    
+    :raises MongoConnectionError: If MongoDB is unavailable
+    
+    """
+    if len(schema_queries) > 1 and projection is not None and sort:
+        # The documents are merged by the keys they're sorted by:
+        projection = dict.fromkeys(projection, True)
+        projection.update((key, True) for key, _ in sort)
+    
+    readers = [_read_documents(collection, query, projection, sort, limit,
+                               batch_size, dictionary, related_fields, decode,
+                               deletions)
+               for query, dictionary in schema_queries]
+    try:
+        if not sort:
+            for reader in readers:
+                for _, datum in reader:
+                    yield datum
+        else:
+            for datum in _merge_documents(readers,
+                                          sort[0][1] == DESCENDING):
+                yield datum
+    finally:
+        for reader in readers:
+            reader.close()
+
+
+def _find_audit_documents(collection, query, projection=None,
+                          sort=_AUDIT_LOG_SORT, limit=None, batch_size=None,
+                          since=None, until=None, model=None, deletions=False):
+    """
+    Generate the documents matching ``query`` in ``collection`` or, if it is
+    partitioned, in those of its partitions which may hold documents recorded
+    between ``since`` and ``until``, through the storage backend (see
+    :mod:`djangoaudit.storage`)
+    
+    ``query`` selects the documents of objects by app and model, and maybe
+    primary key. If ``deletions`` is set, only the documents recording the
+    deletion of the objects are read.
+    
+    The partitions don't overlap in time, so reading them one after the other
+    in the direction of the date stamp in ``sort`` returns the documents in
+    the order of ``sort`` without having to merge them, and only as many
+    partitions are read as it takes to reach ``limit``.
+    
+    If ``model`` is given, its documents recorded in the compact schema are
+    read too and returned in the standard schema.
+    
+    :raises MongoConnectionError: If MongoDB is unavailable
+    
+    """
+    schema_queries = _get_schema_queries(model, query)
+    related_fields = getattr(model, '_audit_related_fields', frozenset())
+    
+    partitions = _get_partitions(collection, since, until)
+    if sort and sort[0][1] == DESCENDING:
+        partitions.reverse()
+    
+    remaining = limit
+    for partition in partitions:
+        documents = _find_in_collection(partition, schema_queries, projection,
+                                        sort, remaining, batch_size,
+                                        related_fields, deletions=deletions)
+        try:
+            for datum in documents:
+                yield datum
+                
+                if remaining:
+                    remaining -= 1
+                    if not remaining:
+                        return
+        finally:
+            documents.close()
+
+
+_DELETE_NOTE = "Object deleted. These are the attributes at delete time."
+
+
+def _get_delete_notes(notes):
+    """
+    Return the notes to record against a deletion, which log that the object
+    is being deleted and cater for the case where other ``notes`` have been
+    specified
+    
+    """
+    if notes is None:
+        return _DELETE_NOTE
+    
+    return "%s\n%s" % (_DELETE_NOTE, notes)
+
+
+_PREFETCH_LOG = 'log'
+
+_PREFETCH_CREATION = 'creation'
+
+_NOT_PREFETCHED = object()
+
+
+class AuditedQuerySet(QuerySet):
+    """
+    A version of :class:`django.db.models.query.QuerySet` whose bulk operations
+    are audited like :meth:`AuditedModel.save` and :meth:`AuditedModel.delete`
+    
+    The values before a change are read with a single query and the documents
+    are written with ``insert_many`` in chunks of :attr:`audit_chunk_size`.
+    
+    """
+    
+    audit_chunk_size = 500
+    """The maximum number of rows per query or documents per insert"""
+    
+    def __init__(self, *args, **kwargs):
+        super(AuditedQuerySet, self).__init__(*args, **kwargs)
+        self._audit_info = {}
+        self._audit_prefetch = frozenset()
+    
+    def _clone(self, *args, **kwargs):
+        clone = super(AuditedQuerySet, self)._clone(*args, **kwargs)
+        clone._audit_info = dict(getattr(self, '_audit_info', {}))
+        clone._audit_prefetch = getattr(self, '_audit_prefetch', frozenset())
+        return clone
+    
+    def prefetch_audit_logs(self):
+        """
+        Return a copy of this queryset which retrieves the audit documents of
+        all its instances together when it is evaluated, so that
+        :meth:`AuditedModel.get_audit_log` and
+        :meth:`AuditedModel.get_creation_log` don't query MongoDB for each one
+        
+        """
+        clone = self._clone()
+        clone._audit_prefetch = clone._audit_prefetch | set([_PREFETCH_LOG])
+        return clone
+    
+    def prefetch_creation_logs(self):
+        """
+        Return a copy of this queryset which retrieves the creation documents
+        of all its instances together when it is evaluated, so that
+        :meth:`AuditedModel.get_creation_log` doesn't query MongoDB for each
+        one
+        
+        """
+        clone = self._clone()
+        clone._audit_prefetch = clone._audit_prefetch | set([_PREFETCH_CREATION])
+        return clone
+    
+    def _fetch_all(self):
+        is_fetching = self._result_cache is None
+        super(AuditedQuerySet, self)._fetch_all()
+        
+        if is_fetching and self._audit_prefetch:
+            instances = [obj for obj in self._result_cache
+                         if isinstance(obj, AuditedModel)]
+            try:
+                self._prefetch_audit_documents(instances)
+            except MongoConnectionError, exc:
+                # Leave each instance to query MongoDB itself:
+                _LOGGER.warning("Could not prefetch the audit logs of %d %s "
+                                "objects: %s", len(instances),
+                                self.model._meta.object_name, exc)
+    
+    def _prefetch_audit_documents(self, instances):
+        """
+        Retrieve the audit documents (or just the creation documents) of
+        ``instances`` with one query per :attr:`audit_chunk_size` instances and
+        attach them to each one
+        
+        """
+        instances_by_pk = OrderedDict()
+        for instance in instances:
+            pk = _coerce_to_bson_compatible(instance.pk)
+            instances_by_pk.setdefault(pk, []).append(instance)
+        
+        pks = instances_by_pk.keys()
+        
+        for start in xrange(0, len(pks), self.audit_chunk_size):
+            chunk = pks[start:start + self.audit_chunk_size]
+            query = dict(object_app=self.model._meta.app_label,
+                         object_model=self.model._meta.object_name,
+                         object_pk={'$in': chunk})
+            
+            if _PREFETCH_LOG in self._audit_prefetch:
+                documents = dict((pk, []) for pk in chunk)
+                for datum in _find_audit_documents(self.model._audit_collection,
+                                                   query, model=self.model):
+                    documents[datum['object_pk']].append(datum)
+                
+                for pk, pk_documents in documents.iteritems():
+                    for instance in instances_by_pk[pk]:
+                        instance._prefetched_audit_documents = pk_documents
+            else:
+                creation_logs = dict.fromkeys(chunk)
+                
+                # Only look for the objects not found in earlier partitions:
+                for partition in _get_partitions(self.model._audit_collection):
+                    missing_pks = [pk for pk in chunk if
+                                   creation_logs[pk] is None]
+                    if not missing_pks:
+                        break
+                    
+                    schema_queries = _get_schema_queries(
+                        self.model, dict(query, object_pk={'$in': missing_pks}))
+                    for schema_query, dictionary in schema_queries:
+                        for creation_log in self._aggregate_creation_logs(
+                                partition, schema_query, dictionary):
+                            pk = creation_log['object_pk']
+                            found = creation_logs[pk]
+                            if found is None or \
+                               creation_log['audit_date_stamp'] < \
+                               found['audit_date_stamp']:
+                                creation_logs[pk] = creation_log
+                
+                for pk, creation_log in creation_logs.iteritems():
+                    for instance in instances_by_pk[pk]:
+                        instance._prefetched_creation_log = creation_log
+    
+    def _aggregate_creation_logs(self, collection, query, dictionary):
+        """
+        Generate the first of the documents matching ``query`` in
+        ``collection`` for each object, reading them from the compact schema
+        if ``dictionary`` is given
+        
+        """
+        sort = _AUDIT_LOG_SORT
+        pk_key = 'object_pk'
+        if dictionary is not None:
+            sort = compact_sort(sort, dictionary)
+            pk_key = compact_key(pk_key, dictionary)
+        
+        creation_logs = get_storage_backend().find_first(collection, query,
+                                                         sort, pk_key)
+        for creation_log in creation_logs:
+            if dictionary is None:
+                yield creation_log
+            else:
+                yield decode_document(creation_log, dictionary,
+                                      self.model._audit_related_fields)
+    
+    def set_audit_info(self, **kwargs):
+        """
+        Return a copy of this queryset with extra audit information to record
+        against its bulk operations, as in :meth:`AuditedModel.set_audit_info`
+        
+        """
+        clone = self._clone()
+        clone._audit_info.update(kwargs)
+        return clone
+    
+    def _get_log_values(self):
+        """
+        Return the values of the log fields of the rows in this queryset keyed
+        by their primary key
+        
+        """
+        log_values = OrderedDict()
+        rows = self.values('pk', *self.model.log_fields).iterator()
+        for row in rows:
+            log_values[row.pop('pk')] = row
+        return log_values
+    
+    def _get_log_values_by_pk(self, pks):
+        """
+        Return the values of the log fields of the rows with primary keys in
+        ``pks`` keyed by their primary key
+        
+        """
+        log_values = {}
+        manager = self.model._base_manager.db_manager(self.db)
+        for start in xrange(0, len(pks), self.audit_chunk_size):
+            chunk = pks[start:start + self.audit_chunk_size]
+            rows = manager.filter(pk__in=chunk)\
+                          .values('pk', *self.model.log_fields)
+            for row in rows:
+                log_values[row.pop('pk')] = row
+        return log_values
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        Create ``objs`` in bulk and record their creation.
+        
+        The objects can only be audited if their primary key is known after
+        the insert, and the database backends of Django 1.8 don't return the
+        primary keys of the rows they create, so they must all be set by the
+        caller.
+        
+        :raises ValueError: If some objects have no primary key
+        
+        """
+        objs = list(objs)
+        
+        missing_pks = len([obj for obj in objs if obj.pk is None])
+        if missing_pks:
+            raise ValueError("Cannot audit the creation of %d %s objects as "
+                             "their primary keys are not set" %
+                             (missing_pks, self.model._meta.object_name))
+        
+        created = super(AuditedQuerySet, self).bulk_create(objs, *args,
+                                                           **kwargs)
+        
+        audits = []
+        for obj in objs:
+            initial_values = dict.fromkeys(obj.log_fields)
+            final_values = dict((field, getattr(obj, field)) for field in
+                                obj.log_fields)
+            
+            audit_info = dict(self._audit_info)
+            audit_info.update(getattr(obj, '_audit_info', {}))
+            
+            audit = _make_audit_document(obj, initial_values, final_values,
+                                         **audit_info)
+            if audit is not None:
+                audits.append(audit)
+            
+            if obj.audit_snapshot == SNAPSHOT_LOAD:
+                obj._audit_snapshot = obj._get_log_values()
+        
+        _write_audit_documents(audits, self.audit_chunk_size,
+                               self.model._audit_collection)
+        return created
+    
+    def update(self, **kwargs):
+        """
+        Update the rows in this queryset and record the changes to each one
+        
+        """
+        with transaction.atomic(using=self.db, savepoint=False):
+            initial_values = self._get_log_values()
+            rows = super(AuditedQuerySet, self).update(**kwargs)
+            final_values = self._get_log_values_by_pk(initial_values.keys())
+            
+            # Compare related objects with related objects, so that only the
+            # foreign keys which changed are recorded:
+            _load_related_objects(self.model, initial_values, self.db,
+                                  self.audit_chunk_size)
+            _load_related_objects(self.model, final_values, self.db,
+                                  self.audit_chunk_size)
+        
+        audits = []
+        for pk, initial in initial_values.iteritems():
+            if pk not in final_values:
+                continue
+            
+            audit = _make_audit_document(_ModelReference(self.model, pk),
+                                         initial, final_values[pk],
+                                         **self._audit_info)
+            if audit is not None:
+                audits.append(audit)
+        
+        _write_audit_documents(audits, self.audit_chunk_size,
+                               self.model._audit_collection)
+        return rows
+    
+    update.alters_data = True
+    
+    def delete(self):
+        """
+        Delete the rows in this queryset and record the state of each one prior
+        to deletion
+        
+        """
+        audit_info = dict(self._audit_info)
+        operator = audit_info.pop('operator', None)
+        notes = _get_delete_notes(audit_info.pop('notes', None))
+        
+        with transaction.atomic(using=self.db, savepoint=False):
+            final_values = self._get_log_values()
+            _load_related_objects(self.model, final_values, self.db,
+                                  self.audit_chunk_size)
+            deleted = super(AuditedQuerySet, self).delete()
+        
+        audits = []
+        for pk, values in final_values.iteritems():
+            values['audit_is_delete'] = True
+            audit = _make_audit_document(_ModelReference(self.model, pk), {},
+                                         values, operator, notes)
+            if audit is not None:
+                audits.append(audit)
+        
+        _write_audit_documents(audits, self.audit_chunk_size,
+                               self.model._audit_collection)
+        return deleted
+    
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+class AuditedManager(Manager.from_queryset(AuditedQuerySet)):
+    """The default manager of :class:`AuditedModel`"""
+    
+    pass
+
+
+SNAPSHOT_QUERY = 'query'
+"""Read the values before a save back from the database (the default)"""
+
+SNAPSHOT_LOAD = 'load'
+"""Use the values recorded when the instance was loaded from the database"""
+
+SNAPSHOT_LAST_AUDIT = 'last_audit'
+"""
+Use the state recorded in the audit log for the instance, for models which
+record checkpoints
+"""
+
+SNAPSHOT_STRATEGIES = (SNAPSHOT_QUERY, SNAPSHOT_LOAD, SNAPSHOT_LAST_AUDIT)
+
+RETENTION_EXPIRE = 'expire'
+"""Have MongoDB delete the audit documents once they expire"""
+
+RETENTION_ARCHIVE = 'archive'
+"""Move the expired audit documents to files with ``audit_archive``"""
+
+RETENTION_POLICIES = (RETENTION_EXPIRE, RETENTION_ARCHIVE)
+
+
+def get_audit_collection_names(include_partitions=False):
+    """
+    Return the names of the collections which the installed audited models
+    record their audit documents in
+    
+    :param include_partitions: Whether to include the monthly partitions of
+        each collection, if partitioning is enabled
+    :type include_partitions: :class:`bool`
+    :rtype: :class:`list`
+    :raises MongoConnectionError: If the partitions are included and MongoDB
+        is unavailable
+    
+    """
+    collection_names = set([AUDITING_COLLECTION_NAME])
+    for model in apps.get_models():
+        if issubclass(model, AuditedModel):
+            collection_names.add(model._audit_collection.collection_name)
+    
+    if include_partitions and is_partitioned():
+        for collection_name in list(collection_names):
+            collection_names.update(list_partitions(collection_name))
+    
+    return sorted(collection_names)
+
+
+class AuditedModelMeta(ModelBase):
+    """ Meta class for :class:`AuditedModel` """
+    
+    def __new__(cls, name, bases, attrs):
+        if not "log_fields" in attrs:
+            attrs["log_fields"] = []
+        
+        new_class = super(AuditedModelMeta, cls).__new__(cls, name, bases, attrs)
+        
+        if new_class.log_fields:
+            # Raise an exception if we're trying to log a field which doesn't
+            # exist on the model:
+            defined_fields = [f.name for f in new_class._meta.fields]
+            for field in new_class.log_fields:
+                if field not in defined_fields:
+                    raise AttributeError("Cannot log data for %r as it does not"
+                                         " exist on the model" % field)
+        else:
+            # Default - Log all
+            new_class.log_fields = [f.name for f in new_class._meta.fields]
+        
+        if new_class.audit_snapshot not in SNAPSHOT_STRATEGIES:
+            raise AttributeError("Unknown audit snapshot strategy %r; expected "
+                                 "one of %r" % (new_class.audit_snapshot,
+                                                SNAPSHOT_STRATEGIES))
+        
+        if new_class.audit_retention_policy not in RETENTION_POLICIES:
+            raise AttributeError("Unknown audit retention policy %r; expected "
+                                 "one of %r" % (new_class.audit_retention_policy,
+                                                RETENTION_POLICIES))
+        
+        if new_class.audit_schema not in SCHEMA_VERSIONS:
+            raise AttributeError("Unknown audit schema %r; expected one of %r" %
+                                 (new_class.audit_schema, SCHEMA_VERSIONS))
+        
+        write_concern = new_class.audit_write_concern
+        if write_concern is not None:
+            try:
+                WriteConcern(**write_concern)
+            except (TypeError, ValueError, ConfigurationError), exc:
+                raise AttributeError("Invalid audit write concern %r: %s" %
+                                     (write_concern, exc))
+        
+        # The collection named for the model in the AUDIT_COLLECTIONS setting
+        # takes precedence over the one it declares:
+        model_label = "%s.%s" % (new_class._meta.app_label,
+                                 new_class._meta.object_name)
+        new_class._audit_label = model_label
+        collection_name = getattr(settings, 'AUDIT_COLLECTIONS', {}).get(
+            model_label, new_class.audit_collection)
+        
+        new_class._audit_collection = _get_collection_handler(
+            collection_name or AUDITING_COLLECTION_NAME, write_concern)
+        
+        log_fields = [f for f in new_class._meta.fields
+                      if f.name in new_class.log_fields]
+        
+        # Map the log fields onto the attributes holding their raw values
+        # (e.g. "pilot" -> "pilot_id") as that's what values() would return:
+        new_class._audit_attnames = dict((f.name, f.attname)
+                                         for f in log_fields)
+        
+        # Work out once how to convert the recorded values of each log field
+        # back to its type, rather than on every value read back:
+        new_class._audit_decoders = dict((f.name, _make_field_decoder(f))
+                                         for f in log_fields)
+        
+        new_class._audit_related_fields = frozenset(
+            f.name for f in log_fields if f.name != f.attname)
+        
+        return new_class
+        
+class AuditedModel(Model):
+    """
+    A version of django.db.models.Model that will audit any values specified in 
+    the log_fields class attribute
+    
+    """
+    
+    __metaclass__ = AuditedModelMeta
+    
+    audit_snapshot = SNAPSHOT_QUERY
+    """
+    How the values of the log fields before a save are worked out; one of
+    :data:`SNAPSHOT_STRATEGIES`
+    
+    """
+    
+    audit_checkpoint_interval = None
+    """
+    Record the full state of the log fields with every this many changes to
+    an instance, so that :meth:`get_state_at` doesn't need to read its whole
+    history (``None`` to disable)
+    
+    """
+    
+    audit_checkpoint_bytes = None
+    """
+    Record the full state of the log fields once the changes recorded since
+    the last time take up this many bytes (``None`` to disable)
+    
+    """
+    
+    audit_write_concern = None
+    """
+    The write concern options for the audit documents of this model (e.g.
+    ``{'w': 0}`` or ``{'w': 'majority', 'j': True}``), or ``None`` to use
+    those of the client
+    
+    """
+    
+    audit_collection = None
+    """
+    The name of the collection for the audit documents of this model, or
+    ``None`` to use the auditing collection shared by all models
+    
+    """
+    
+    audit_retention_days = None
+    """
+    The number of days the audit documents of this model are kept in MongoDB,
+    or ``None`` to keep them forever
+    
+    """
+    
+    audit_retention_policy = RETENTION_ARCHIVE
+    """
+    What happens to the audit documents of this model once they are older
+    than :attr:`audit_retention_days`; one of :data:`RETENTION_POLICIES`
+    
+    """
+    
+    audit_schema = SCHEMA_STANDARD
+    """
+    The schema of the audit documents recorded for this model; one of
+    :data:`~djangoaudit.schema.SCHEMA_STANDARD` or
+    :data:`~djangoaudit.schema.SCHEMA_COMPACT`
+    
+    The in-memory storage (see :mod:`djangoaudit.memory`) records the
+    standard schema either way.
+    
+    """
+    
+    audit_record_old_values = False
+    """
+    Whether the documents recording changes to this model also record the
+    values before the changes, so that any page of :meth:`get_audit_log` can
+    be read without the documents before it
+    
+    """
+    
+    audit_related_pk_only = False
+    """
+    Whether related objects are recorded by their primary key alone in the
+    compact schema, rather than by their string form along with their
+    primary key
+    
+    """
+    
+    objects = AuditedManager()
+    
+    class Meta:
+        abstract = True
+    
+    def __init__(self, *args, **kwargs):
+        super(AuditedModel, self).__init__(*args, **kwargs)
+        
+        # Ensure that we can store any extra auditing information on the instance:
+        self._audit_info = defaultdict(lambda: None)
+        
+        # The values of the log fields as they are in the database, if known:
+        self._audit_snapshot = None
+        
+        # The audit documents retrieved by AuditedQuerySet.prefetch_*_logs():
+        self._prefetched_audit_documents = None
+        self._prefetched_creation_log = _NOT_PREFETCHED
+    
+    def _clear_prefetched_audit_documents(self):
+        """Forget the prefetched audit documents, which are now out of date"""
+        
+        self._prefetched_audit_documents = None
+        self._prefetched_creation_log = _NOT_PREFETCHED
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Record the values of the log fields when the instance is loaded if the
+        model uses the :data:`SNAPSHOT_LOAD` strategy.
+        
+        """
+        instance = super(AuditedModel, cls).from_db(db, field_names, values)
+        
+        if cls.audit_snapshot == SNAPSHOT_LOAD:
+            # Deferred fields can't be recorded without a query of their own,
+            # so leave it to save() to query for them:
+            loaded_fields = frozenset(field_names)
+            if loaded_fields.issuperset(cls._audit_attnames.itervalues()):
+                instance._audit_snapshot = instance._get_log_values()
+        
+        return instance
+    
+    def _get_log_values(self):
+        """
+        Return the raw values of the log fields on this instance in the same
+        form as :meth:`django.db.models.query.QuerySet.values`
+        
+        """
+        return dict((field, getattr(self, attname)) for field, attname in
+                    self._audit_attnames.iteritems())
+    
+    def _apply_audit_datum(self, state, datum):
+        """Update ``state`` with the log field values recorded in ``datum``"""
+        
+        for field, attname in self._audit_attnames.iteritems():
+            if field != attname:
+                # Related objects are recorded by their primary key:
+                pk_key = '%s_pk' % field
+                if pk_key in datum:
+                    state[field] = datum[pk_key]
+            elif field in datum:
+                state[field] = _coerce_datum_to_model_types(self, field,
+                                                            datum[field])
+    
+    def get_state_at(self, when=None):
+        """
+        Return the values of the log fields of this instance as recorded in
+        the audit log at ``when``.
+        
+        Only the latest checkpoint recorded by then (see
+        :attr:`audit_checkpoint_interval`) and the changes after it are read.
+        Related objects are given by their primary key.
+        
+        :param when: The time (in UTC) to get the state at; defaults to the
+            latest state
+        :type when: :class:`datetime.datetime`
+        :return: The values by field name or ``None`` if nothing was recorded
+            for this instance by then
+        :rtype: :class:`dict`
+        
+        """
+        query = _get_params_from_model(self)
+        if when is not None:
+            query['audit_date_stamp'] = {'$lte': when}
+        
+        newest_first = [(key, DESCENDING) for key, _ in _AUDIT_LOG_SORT]
+        checkpoint_query = dict(query, audit_checkpoint={'$exists': True})
+        checkpoints = list(_find_audit_documents(
+            self._audit_collection, checkpoint_query,
+            ['audit_date_stamp', 'audit_checkpoint'], sort=newest_first,
+            limit=1, until=when, model=self))
+        
+        state = None
+        since = None
+        if checkpoints:
+            checkpoint = checkpoints[0]
+            state = dict.fromkeys(self.log_fields)
+            self._apply_audit_datum(state, checkpoint['audit_checkpoint'])
+            
+            position = (checkpoint['audit_date_stamp'], checkpoint['_id'])
+            query = dict(query, **_get_keyset_query(position, '$gt'))
+            since = checkpoint['audit_date_stamp']
+        
+        for datum in _find_audit_documents(self._audit_collection, query,
+                                           since=since, until=when,
+                                           model=self):
+            if state is None:
+                state = dict.fromkeys(self.log_fields)
+            
+            self._apply_audit_datum(state, datum)
+        
+        return state
+    
+    def _get_last_audited_state(self):
+        """
+        Return the values of the log fields as recorded in the audit log or
+        ``None`` if there is no audit log for this instance.
+        
+        """
+        return self.get_state_at()
+    
+    def _can_use_last_audit(self):
+        """
+        Return whether the audit log can stand in for the database before a
+        save
+        
+        Without checkpoints, reading the last audited state would replay the
+        whole history of the instance on every save. The audit log is also
+        behind the database while some documents are not written yet.
+        
+        """
+        has_checkpoints = self.audit_checkpoint_interval or \
+            self.audit_checkpoint_bytes
+        return has_checkpoints and not _has_unwritten_audits()
+    
+    def _get_audit_snapshot(self):
+        """
+        Return the values of the log fields before this save, using the
+        strategy set in :attr:`audit_snapshot`, or ``None`` if the record is
+        being created.
+        
+        """
+        if self.pk is None:
+            # This is the first save, the record is being created:
+            return None
+        
+        if self.audit_snapshot == SNAPSHOT_LOAD and \
+           self._audit_snapshot is not None:
+            return self._audit_snapshot
+        
+        if self.audit_snapshot == SNAPSHOT_LAST_AUDIT and \
+           self._can_use_last_audit():
+            try:
+                state = self._get_last_audited_state()
+            except MongoConnectionError:
+                state = None
+                
+            if state is not None:
+                return state
+        
+        # Fall back to reading the values from the database:
+        try:
+            return self.__class__.objects.filter(pk=self.pk)\
+                                 .values(*self.log_fields)[0]
+        except IndexError:
+            return None
+    
+    def save(self, *args, **kwargs):
+        """
+        The save method performs auditing on the model to record the differences
+        before and after the commit to the DB.
+        
+        """
+        
+        instrumented = is_instrumented()
+        
+        # Before we save to the DB, get the values from the original instance:
+        started_at = default_timer()
+        init_values = self._get_audit_snapshot()
+        audit_seconds = default_timer() - started_at
+        if instrumented:
+            record_timing(PHASE_SNAPSHOT, audit_seconds)
+                
+        if init_values is None:
+            # we don't know what the initial state is, so assume None:
+            init_values = {}
+            
+            for field in self.log_fields:
+                init_values[field] = None
+                
+        final_values = {}
+        
+        # We can't just get the attribute directly off the instance here
+        # because we need to ensure it is of the same type as the initial
+        # value. To do this we use the field's `to_python` method:
+        for field in self.log_fields:
+            final_values[field] = getattr(self, field)
+        
+        # need to actually save the model here to ensure pk for the auditing
+        super(AuditedModel, self).save(*args, **kwargs)
+        
+        started_at = default_timer()
+        _audit_model(self, init_values, final_values, **self._audit_info)
+        if instrumented:
+            record_audit_time(self, "save",
+                              audit_seconds + default_timer() - started_at)
+        self._clear_prefetched_audit_documents()
+        
+        if self.audit_snapshot == SNAPSHOT_LOAD:
+            # What we've just saved is what's in the database now:
+            self._audit_snapshot = self._get_log_values()
+        
+    def delete(self, *args, **kwargs):
+        """
+        The delete method performs auditing on the model to record the state of 
+        the model prior to deletion.
+        
+        """
+        
+        initial_values, final_values = {}, dict(audit_is_delete=True)
+        
+        for field in self.log_fields:
+            final_values[field] = getattr(self, field)
+        
+        notes = _get_delete_notes(self._audit_info['notes'])
+            
+        started_at = default_timer()
+        _audit_model(self, initial_values, final_values, self._audit_info['operator'], notes)
+        if is_instrumented():
+            record_audit_time(self, "delete", default_timer() - started_at)
+        self._clear_prefetched_audit_documents()
+        
+        super(AuditedModel, self).delete(*args, **kwargs)
+    
+    def set_audit_info(self, **kwargs):
+        """Set extra audit information on this instance."""
+        
+        self._audit_info.update(kwargs)
+    
+    def get_audit_log(self, since=None, until=None, limit=None, after=None,
+                      fields=None, batch_size=None):
+        """
+        Construct a generator of all the items in the audit log for this object.
+        
+        All data in the object will be converted into the correct type. Each log
+        entry is returned a dictionary of directly set data with an additional 
+        key called ``audit_changes``. This value is a dictionary of the fields
+        which have changed on the model. e.g.::
+        
+            {'operator' : 'power_user',
+             'extra': 'Extra info',
+             'audit_changes': {'seats': (10, 20),
+                               'premium': (False, True)
+                              }
+            }
+        
+        The entries are sorted by MongoDB in the order they were recorded. The
+        log can be read a page at a time by passing the cursor of the last
+        entry of a page (see :func:`get_audit_log_cursor`) as ``after`` to get
+        the next one. The *before* values of the first entry of a page are
+        those recorded before the page, not ``None``.
+        
+        :param since: Only include entries recorded at or after this time
+        :type since: :class:`datetime.datetime`
+        :param until: Only include entries recorded before this time
+        :type until: :class:`datetime.datetime`
+        :param limit: The maximum number of entries to include
+        :type limit: :class:`int`
+        :param after: Only include entries after the one with this cursor
+        :type after: :class:`basestring`
+        :param fields: Only report changes to these log fields, and only
+            include the entries which change them
+        :param batch_size: The number of documents per batch retrieved from
+            MongoDB (defaults to the ``AUDIT_LOG_BATCH_SIZE`` setting)
+        :type batch_size: :class:`int`
+        :raises ValueError: If any of ``fields`` is not a log field or
+            ``after`` is not a valid cursor
+        
+        """
+        
+        # The fields on the model we actually want to diff, along with how to
+        # convert their values:
+        decoders = self._audit_decoders
+        
+        if fields is not None:
+            unknown_fields = set(fields).difference(decoders)
+            if unknown_fields:
+                raise ValueError("Cannot report changes to %s as they are not "
+                                 "log fields" % ", ".join(sorted(unknown_fields)))
+            decoders = dict((field, decoders[field]) for field in fields)
+        
+        if batch_size is None:
+            batch_size = getattr(settings, 'AUDIT_LOG_BATCH_SIZE', 100)
+        
+        object_query = _get_params_from_model(self)
+        window = []
+        
+        # The earliest date stamp in the window:
+        start = since
+        
+        if since is not None:
+            window.append({'audit_date_stamp': {'$gte': since}})
+        
+        if until is not None:
+            window.append({'audit_date_stamp': {'$lt': until}})
+        
+        if after is not None:
+            position = _parse_audit_log_cursor(after)
+            window.append(_get_keyset_query(position, '$gt'))
+            start = max(start, position[0]) if start else position[0]
+        
+        query = dict(object_query)
+        projection = None
+        clauses = list(window)
+        
+        if fields is not None:
+            clauses.append({'$or': [{field: {'$exists': True}}
+                                    for field in fields]})
+            
+            projection = dict.fromkeys(_AUDIT_META_FIELDS, True)
+            for field in fields:
+                projection[field] = True
+                projection['%s_pk' % field] = True
+        
+        if clauses:
+            query['$and'] = clauses
+        
+        # The latest value of each field as far as it is known, which is
+        # None for the fields not recorded yet:
+        previous_fields = {}
+        
+        prefetched = self._prefetched_audit_documents
+        if prefetched is not None and not window and fields is None:
+            # Use the documents retrieved with the rest of the queryset:
+            cursor = prefetched[:limit] if limit else prefetched
+        else:
+            cursor = _find_audit_documents(self._audit_collection, query,
+                                           projection, limit=limit,
+                                           batch_size=batch_size, since=start,
+                                           until=until, model=self)
+        
+        start_clauses = None
+        if start is not None:
+            start_clauses = [{'$nor': [clause]} for clause in window
+                             if clause.get('audit_date_stamp', {}).get('$lt')
+                             is None]
+    
+        for datum in cursor:
+            # The entries recorded with the values before their changes (see
+            # AuditedModel.audit_record_old_values) are reported on their own:
+            old_values = datum.get('audit_old_values')
+            
+            if old_values is None and start_clauses is not None:
+                # Seed the previous values with those in force when the window
+                # starts, unless they have been recorded since:
+                values_before = self._get_values_before(
+                    object_query, start_clauses, start, decoders, batch_size)
+                values_before.update(previous_fields)
+                previous_fields = values_before
+                start_clauses = None
+            
+            entry = {}
+            changes = {}
+            for field, value in datum.iteritems():
+                decoder = decoders.get(field)
+                # If the field is a log field report the diff:
+                if decoder is not None:
+                    new_value = decoder(value)
+                    
+                    if old_values is None:
+                        old_value = previous_fields.get(field)
+                    else:
+                        old_value = old_values.get(field)
+                        if old_value is not None:
+                            old_value = decoder(old_value)
+                    
+                    # Record the delta:
+                    changes[field] = (old_value, new_value)
+                    
+                    # Now update the previous_fields record:
+                    previous_fields[field] = new_value
+                elif field not in ('audit_checkpoint', 'audit_old_values'):
+                    # Just record this directly as an entry in the log:
+                    entry[field] = value
+            
+            # Now put the log together (combine the direct log and changes):
+            if changes:
+                entry['audit_changes'] = changes 
+            yield entry
+    
+    def _get_values_before(self, object_query, clauses, start, decoders,
+                           batch_size):
+        """
+        Return the most recent value recorded for each of the fields in
+        ``decoders`` in the documents matching ``clauses``, which were recorded
+        at or before ``start``
+        
+        The documents are read newest first, so only as many are read as it
+        takes to find a value for every field.
+        
+        """
+        query = dict(object_query)
+        query['$and'] = clauses + [{'$or': [{field: {'$exists': True}}
+                                            for field in decoders]}]
+        
+        projection = dict.fromkeys(decoders, True)
+        sort = [(key, DESCENDING) for key, direction in _AUDIT_LOG_SORT]
+        
+        values = {}
+        cursor = _find_audit_documents(self._audit_collection, query,
+                                       projection, sort, batch_size=batch_size,
+                                       until=start, model=self)
+        for datum in cursor:
+            for field, value in datum.iteritems():
+                if field in decoders and field not in values:
+                    values[field] = decoders[field](value)
+            
+            if len(values) == len(decoders):
+                break
+        
+        cursor.close()
+        return values
+            
     def get_creation_log(self):
         """
         Get the values logged on the creation of this instance or None if not
@@ -401,10 +2093,18 @@ class AuditedModel(Model):
         :rtype: :class:`dict`
         
         """
-        try:
-            data = AUDITING_COLLECTION().find(_get_params_from_model(self))\
-                                        .sort('audit_date_stamp')[0]
-        except IndexError:
+        data = self._prefetched_creation_log
+        if data is _NOT_PREFETCHED and \
+           self._prefetched_audit_documents is not None:
+            data = (self._prefetched_audit_documents or [None])[0]
+        
+        if data is _NOT_PREFETCHED:
+            data = next(_find_audit_documents(
+                self._audit_collection, _get_params_from_model(self),
+                sort=[('audit_date_stamp', ASCENDING)], limit=1, model=self),
+                None)
+        
+        if data is None:
             return None
         
         return _coerce_data_to_model_types(self, data)
@@ -427,5 +2127,7 @@ class AuditedModel(Model):
         if pk:
             query['object_pk'] = pk
         
-        for datum in AUDITING_COLLECTION().find(query):
+        for datum in _find_audit_documents(cls._audit_collection, query,
+                                           sort=None, model=cls,
+                                           deletions=True):
             yield _coerce_data_to_model_types(cls, datum)
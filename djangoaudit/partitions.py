@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Monthly partitioning of the auditing collection.
+
+When the ``AUDIT_PARTITION_BY_MONTH`` setting is ``True`` each audit document
+is written to a collection for the month of its ``audit_date_stamp``, named
+after the auditing collection (e.g. ``audit_data_2026_10``). The indexes of
+each partition only cover a month, and a month of documents is removed by
+dropping its partition rather than deleting them one by one.
+
+"""
+
+from datetime import datetime
+from logging import getLogger
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from djangoaudit.connection import MONGO_CONNECTION
+from djangoaudit.storage import require_mongo_storage
+
+__all__ = ["is_partitioned", "get_partition_name", "get_partition_names",
+           "list_partitions", "drop_partitions"]
+
+_LOGGER = getLogger(__name__)
+
+_PARTITION_NAME_PATTERN = "^%s_(\\d{4})_(\\d{2})$"
+
+_PARTITION_NAMES_CACHE = {}
+"""The partitions found in MongoDB by collection name, along with when"""
+
+_PARTITION_NAMES_CACHE_LOCK = threading.Lock()
+
+
+def is_partitioned():
+    """Return whether the audit documents are partitioned by month"""
+
+    return getattr(settings, 'AUDIT_PARTITION_BY_MONTH', False)
+
+
+def get_partition_name(collection_name, when):
+    """
+    Return the name of the partition of ``collection_name`` for the month of
+    ``when``
+
+    :param collection_name: The name of the partitioned collection
+    :type collection_name: :class:`basestring`
+    :param when: A time in the month
+    :type when: :class:`datetime.datetime`
+    :rtype: :class:`basestring`
+
+    """
+
+    return "%s_%04d_%02d" % (collection_name, when.year, when.month)
+
+
+def _get_previous_month(when):
+    if when.month == 1:
+        return datetime(when.year - 1, 12, 1)
+    return datetime(when.year, when.month - 1, 1)
+
+
+def list_partitions(collection_name):
+    """
+    Return the names of the partitions of ``collection_name`` in MongoDB,
+    oldest first
+
+    :param collection_name: The name of the partitioned collection
+    :type collection_name: :class:`basestring`
+    :rtype: :class:`list`
+    :raises djangoaudit.connection.MongoConnectionError: If MongoDB is
+        unavailable
+    :raises NotImplementedError: If the MongoDB storage backend isn't
+        selected
+
+    """
+
+    require_mongo_storage("Partitioning the auditing collections")
+
+    database = MONGO_CONNECTION.get_collection(collection_name).database
+    pattern = re.compile(_PARTITION_NAME_PATTERN % re.escape(collection_name))
+
+    names = [name for name in database.list_collection_names() if
+             pattern.match(name)]
+
+    with _PARTITION_NAMES_CACHE_LOCK:
+        _PARTITION_NAMES_CACHE[collection_name] = (time.time(), names)
+
+    return sorted(names)
+
+
+def get_partition_names(collection_name, since=None, until=None):
+    """
+    Return the names of the partitions of ``collection_name`` which may hold
+    documents recorded between ``since`` and ``until`` (inclusive), oldest
+    first
+
+    The partitions found in MongoDB are cached for
+    ``AUDIT_PARTITION_CACHE_SECONDS`` seconds (60 by default). The partitions
+    for the current and the previous month are always included, so that
+    partitions created by other processes in the meantime are not missed.
+
+    :param collection_name: The name of the partitioned collection
+    :type collection_name: :class:`basestring`
+    :param since: The earliest time of the documents wanted
+    :type since: :class:`datetime.datetime`
+    :param until: The latest time of the documents wanted
+    :type until: :class:`datetime.datetime`
+    :rtype: :class:`list`
+    :raises djangoaudit.connection.MongoConnectionError: If MongoDB is
+        unavailable
+
+    """
+
+    max_age = getattr(settings, 'AUDIT_PARTITION_CACHE_SECONDS', 60)
+    with _PARTITION_NAMES_CACHE_LOCK:
+        listed_at, names = _PARTITION_NAMES_CACHE.get(collection_name,
+                                                      (None, None))
+
+    if listed_at is None or time.time() - listed_at > max_age:
+        names = list_partitions(collection_name)
+
+    now = datetime.utcnow()
+    names = set(names)
+    names.add(get_partition_name(collection_name, now))
+    names.add(get_partition_name(collection_name, _get_previous_month(now)))
+
+    if since is not None:
+        first_name = get_partition_name(collection_name, since)
+        names = [name for name in names if name >= first_name]
+    if until is not None:
+        last_name = get_partition_name(collection_name, until)
+        names = [name for name in names if name <= last_name]
+
+    return sorted(names)
+
+
+def drop_partitions(collection_name, before):
+    """
+    Drop the partitions of ``collection_name`` for the months before the month
+    of ``before``
+
+    :param collection_name: The name of the partitioned collection
+    :type collection_name: :class:`basestring`
+    :param before: A time in the oldest month to keep
+    :type before: :class:`datetime.datetime`
+    :return: The names of the partitions dropped
+    :rtype: :class:`list`
+    :raises djangoaudit.connection.MongoConnectionError: If MongoDB is
+        unavailable
+
+    """
+
+    first_name = get_partition_name(collection_name, before)
+    database = MONGO_CONNECTION.get_collection(collection_name).database
+
+    dropped = []
+    for name in list_partitions(collection_name):
+        if name >= first_name:
+            break
+
+        database.drop_collection(name)
+        _LOGGER.info("Dropped audit partition %s", name)
+        dropped.append(name)
+
+    # Forget the partitions just dropped:
+    list_partitions(collection_name)
+
+    return dropped
@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+The compact schema of the audit documents.
+
+In the standard schema (version 1) every audit document repeats the long
+names of its keys: ``object_app``, ``audit_date_stamp``, the name of every
+field changed and so on. In the compact schema (version 2) the keys are
+shortened:
+
+* ``s``: The schema version (``2``), which standard documents don't have.
+* ``a``, ``m``, ``p``: The app, model and primary key of the object.
+* ``d``: The date stamp.
+* ``o``, ``n``: The operator and the notes.
+* ``x``, ``c``, ``e``, ``r``: Whether the object was deleted, the checkpoint,
+  the expiry date and the date the document was restored from the archive.
+* ``b``: The values of the fields before the change, keyed by code.
+* ``v``: The values of the fields, keyed by their code in the field
+  dictionary of the model.
+* ``k``: The primary keys of the related objects, keyed in the same way.
+* ``i``: Any other information recorded with the change.
+
+The field dictionary of each model is kept in the collection named by the
+``AUDIT_SCHEMA_COLLECTION`` setting (``audit_schema`` by default). Fields are
+only ever added to it, so the code of a field never changes.
+
+"""
+
+from logging import getLogger
+import threading
+
+from bson import BSON
+from django.apps import apps
+from django.conf import settings
+from pymongo import ReturnDocument
+
+from djangoaudit.connection import MONGO_CONNECTION
+from djangoaudit.storage import require_mongo_storage
+
+__all__ = ["SCHEMA_STANDARD", "SCHEMA_COMPACT", "FieldDictionary",
+           "get_field_dictionary", "register_field_names", "encode_document",
+           "decode_document", "get_stored_key", "measure_document_sizes"]
+
+_LOGGER = getLogger(__name__)
+
+SCHEMA_STANDARD = 1
+"""Record the audit documents with the full names of their keys"""
+
+SCHEMA_COMPACT = 2
+"""Record the audit documents with short keys and coded field names"""
+
+SCHEMA_VERSIONS = (SCHEMA_STANDARD, SCHEMA_COMPACT)
+
+_VERSION_KEY = 's'
+
+_VALUES_KEY = 'v'
+
+_PKS_KEY = 'k'
+
+_EXTRA_KEY = 'i'
+
+_COMPACT_KEYS = {
+    'object_app': 'a',
+    'object_model': 'm',
+    'object_pk': 'p',
+    'audit_date_stamp': 'd',
+    'audit_operator': 'o',
+    'audit_notes': 'n',
+    'audit_is_delete': 'x',
+    'audit_checkpoint': 'c',
+    'audit_expires_at': 'e',
+    'audit_restored_at': 'r',
+    'audit_old_values': 'b',
+    }
+"""The short key of each of the keys which aren't model fields"""
+
+_STANDARD_KEYS = dict((short_key, key) for key, short_key in
+                      _COMPACT_KEYS.iteritems())
+
+_LOGICAL_OPERATORS = ('$and', '$or', '$nor')
+
+_CODE_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _make_code(index):
+    code = ""
+    while True:
+        index, digit = divmod(index, len(_CODE_DIGITS))
+        code = _CODE_DIGITS[digit] + code
+        if not index:
+            return code
+
+
+class FieldDictionary(object):
+    """The codes of the names of the fields of a model"""
+
+    def __init__(self, model_label, field_names):
+        """
+
+        :param model_label: The label of the model (``app_label.ModelName``)
+        :type model_label: :class:`basestring`
+        :param field_names: The names of the fields, in the order they were
+            added
+        :type field_names: :class:`list`
+
+        """
+
+        self.model_label = model_label
+        self.field_names = list(field_names)
+        self.codes = dict((field_name, _make_code(index)) for
+                          index, field_name in enumerate(self.field_names))
+        self.names = dict((code, field_name) for field_name, code in
+                          self.codes.iteritems())
+
+
+_FIELD_DICTIONARIES = {}
+"""The field dictionaries loaded by model label (``None`` if there's none)"""
+
+_FIELD_DICTIONARIES_LOCK = threading.Lock()
+
+
+def _get_dictionary_collection():
+    require_mongo_storage("The compact schema")
+    return MONGO_CONNECTION.get_collection(
+        getattr(settings, 'AUDIT_SCHEMA_COLLECTION', 'audit_schema'))
+
+
+def _cache_field_dictionary(model_label, document):
+    if document is None:
+        dictionary = None
+    else:
+        dictionary = FieldDictionary(model_label, document['fields'])
+
+    with _FIELD_DICTIONARIES_LOCK:
+        _FIELD_DICTIONARIES[model_label] = dictionary
+    return dictionary
+
+
+def get_field_dictionary(model_label, reload=False):
+    """
+    Return the field dictionary of the model labelled ``model_label``, which
+    is read from MongoDB once per process unless ``reload`` is set
+
+    :param model_label: The label of the model (``app_label.ModelName``)
+    :type model_label: :class:`basestring`
+    :return: The dictionary or ``None`` if the model has never recorded a
+        document in the compact schema
+    :rtype: :class:`FieldDictionary`
+    :raises djangoaudit.connection.MongoConnectionError: If MongoDB is
+        unavailable
+    :raises NotImplementedError: If the MongoDB storage backend isn't
+        selected
+
+    """
+
+    if not reload:
+        with _FIELD_DICTIONARIES_LOCK:
+            if model_label in _FIELD_DICTIONARIES:
+                return _FIELD_DICTIONARIES[model_label]
+
+    collection = _get_dictionary_collection()
+    with MONGO_CONNECTION.breaker.recording():
+        document = collection.find_one({'_id': model_label})
+    return _cache_field_dictionary(model_label, document)
+
+
+def register_field_names(model_label, field_names):
+    """
+    Add the names in ``field_names`` missing from the field dictionary of the
+    model labelled ``model_label`` to it
+
+    The dictionary is created if need be. Several processes can add the same
+    names at the same time.
+
+    :param model_label: The label of the model (``app_label.ModelName``)
+    :type model_label: :class:`basestring`
+    :param field_names: The names of the fields
+    :return: The dictionary with all of ``field_names``
+    :rtype: :class:`FieldDictionary`
+    :raises djangoaudit.connection.MongoConnectionError: If MongoDB is
+        unavailable
+    :raises NotImplementedError: If the MongoDB storage backend isn't
+        selected
+
+    """
+
+    dictionary = get_field_dictionary(model_label)
+    if dictionary is not None and \
+       all(field_name in dictionary.codes for field_name in field_names):
+        return dictionary
+
+    # $addToSet keeps the names added by other processes in the meantime,
+    # along with their order:
+    collection = _get_dictionary_collection()
+    with MONGO_CONNECTION.breaker.recording():
+        document = collection.find_one_and_update(
+            {'_id': model_label},
+            {'$addToSet': {'fields': {'$each': list(field_names)}}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            )
+    return _cache_field_dictionary(model_label, document)
+
+
+def _encode_values(values, dictionary, related_pk_only):
+    """
+    Split ``values``, keyed by field name (and ``<field>_pk`` for the primary
+    keys of related objects), into the values, the primary keys and the rest,
+    keyed by the codes of the fields
+
+    """
+
+    encoded_values = {}
+    pks = {}
+    extra = {}
+    for key, value in values.iteritems():
+        if key in dictionary.codes:
+            pk_key = '%s_pk' % key
+            if related_pk_only and pk_key in values:
+                value = values[pk_key]
+            encoded_values[dictionary.codes[key]] = value
+        elif key.endswith('_pk') and key[:-3] in dictionary.codes:
+            if not related_pk_only:
+                pks[dictionary.codes[key[:-3]]] = value
+        else:
+            extra[key] = value
+
+    return encoded_values, pks, extra
+
+
+def _decode_values(encoded_values, pks, dictionary, related_fields):
+    """Reverse :func:`_encode_values`"""
+
+    values = {}
+    for code, value in encoded_values.iteritems():
+        field_name = dictionary.names[code]
+        values[field_name] = value
+
+        if not pks and field_name in related_fields:
+            # The related object was recorded by its primary key alone:
+            values['%s_pk' % field_name] = value
+
+    for code, pk in pks.iteritems():
+        values['%s_pk' % dictionary.names[code]] = pk
+
+    return values
+
+
+def encode_document(document, dictionary, related_pk_only=False):
+    """
+    Return ``document``, in the standard schema, in the compact schema
+
+    :param document: The audit document
+    :type document: :class:`dict`
+    :param dictionary: The field dictionary of the model of the document,
+        with all of its fields
+    :type dictionary: :class:`FieldDictionary`
+    :param related_pk_only: Whether to record related objects by their primary
+        key only, rather than their string form along with their primary key
+    :type related_pk_only: :class:`bool`
+    :rtype: :class:`dict`
+
+    """
+
+    compact = {_VERSION_KEY: SCHEMA_COMPACT}
+
+    values = {}
+    for key, value in document.iteritems():
+        if key == '_id':
+            compact['_id'] = value
+        elif key == 'audit_checkpoint':
+            checkpoint_values, checkpoint_pks, _ = _encode_values(
+                value, dictionary, related_pk_only)
+            compact['c'] = {_VALUES_KEY: checkpoint_values}
+            if checkpoint_pks:
+                compact['c'][_PKS_KEY] = checkpoint_pks
+        elif key == 'audit_old_values':
+            compact['b'] = _encode_values(value, dictionary, False)[0]
+        elif key in _COMPACT_KEYS:
+            compact[_COMPACT_KEYS[key]] = value
+        else:
+            values[key] = value
+
+    encoded_values, pks, extra = _encode_values(values, dictionary,
+                                                related_pk_only)
+    if encoded_values:
+        compact[_VALUES_KEY] = encoded_values
+    if pks:
+        compact[_PKS_KEY] = pks
+    if extra:
+        compact[_EXTRA_KEY] = extra
+
+    return compact
+
+
+def _get_model_label(document):
+    return "%s.%s" % (document['a'], document['m'])
+
+
+def decode_document(document, dictionary=None, related_fields=None):
+    """
+    Return ``document`` in the standard schema, whichever schema it was
+    recorded in
+
+    :param document: The audit document as stored in MongoDB
+    :type document: :class:`dict`
+    :param dictionary: The field dictionary of the model of the document;
+        defaults to the one recorded for it
+    :type dictionary: :class:`FieldDictionary`
+    :param related_fields: The names of the fields of the model which are
+        relations; defaults to those of the model installed
+    :rtype: :class:`dict`
+    :raises ValueError: If the field dictionary of the model doesn't have all
+        the fields in the document
+    :raises djangoaudit.connection.MongoConnectionError: If the field
+        dictionary has to be read and MongoDB is unavailable
+
+    """
+
+    if document.get(_VERSION_KEY) != SCHEMA_COMPACT:
+        return document
+
+    if dictionary is None:
+        dictionary = get_field_dictionary(_get_model_label(document))
+
+    codes = set(document.get(_VALUES_KEY, ())) | \
+        set(document.get(_PKS_KEY, ())) | \
+        set(document.get('c', {}).get(_VALUES_KEY, ()))
+    if dictionary is None or not codes.issubset(dictionary.names):
+        # Another process has recorded fields this one doesn't know about:
+        dictionary = get_field_dictionary(_get_model_label(document),
+                                          reload=True)
+        if dictionary is None or not codes.issubset(dictionary.names):
+            raise ValueError("The field dictionary of %s is missing fields "
+                             "recorded in audit document %s" %
+                             (_get_model_label(document), document['_id']))
+
+    if related_fields is None:
+        try:
+            model = apps.get_model(document['a'], document['m'])
+        except LookupError:
+            model = None
+        related_fields = getattr(model, '_audit_related_fields', frozenset())
+
+    decoded = {}
+    for key, value in document.iteritems():
+        if key == '_id':
+            decoded['_id'] = value
+        elif key == 'c':
+            decoded['audit_checkpoint'] = _decode_values(
+                value.get(_VALUES_KEY, {}), value.get(_PKS_KEY, {}),
+                dictionary, related_fields)
+        elif key == 'b':
+            decoded['audit_old_values'] = _decode_values(value, {},
+                                                         dictionary, ())
+        elif key in _STANDARD_KEYS:
+            decoded[_STANDARD_KEYS[key]] = value
+
+    decoded.update(document.get(_EXTRA_KEY, {}))
+    decoded.update(_decode_values(document.get(_VALUES_KEY, {}),
+                                  document.get(_PKS_KEY, {}), dictionary,
+                                  related_fields))
+    return decoded
+
+
+def get_stored_key(document, key):
+    """
+    Return the key ``key`` of the standard schema is stored under in
+    ``document``
+
+    Only the keys which aren't model fields (e.g. ``audit_date_stamp``) are
+    supported.
+
+    """
+
+    if document.get(_VERSION_KEY) == SCHEMA_COMPACT:
+        return _COMPACT_KEYS[key]
+    return key
+
+
+def compact_key(key, dictionary):
+    """Return the key of the compact schema for ``key``"""
+
+    if key == '_id' or key.startswith('$'):
+        return key
+
+    if key in _COMPACT_KEYS:
+        return _COMPACT_KEYS[key]
+
+    if key in dictionary.codes:
+        return "%s.%s" % (_VALUES_KEY, dictionary.codes[key])
+
+    if key.endswith('_pk') and key[:-3] in dictionary.codes:
+        return "%s.%s" % (_PKS_KEY, dictionary.codes[key[:-3]])
+
+    return "%s.%s" % (_EXTRA_KEY, key)
+
+
+def _compact_clause(clause, dictionary):
+    compact = {}
+    for key, value in clause.iteritems():
+        if key in _LOGICAL_OPERATORS:
+            value = [_compact_clause(sub_clause, dictionary) for sub_clause in
+                     value]
+        compact[compact_key(key, dictionary)] = value
+    return compact
+
+
+def compact_query(query, dictionary):
+    """
+    Return ``query``, on documents in the standard schema, on those in the
+    compact schema
+
+    """
+
+    compact = _compact_clause(query, dictionary)
+    compact[_VERSION_KEY] = SCHEMA_COMPACT
+    return compact
+
+
+def compact_projection(projection, dictionary):
+    """
+    Return ``projection`` (a list or a dict of the keys to include) of the
+    documents in the compact schema, along with their version so that they
+    can be decoded
+
+    """
+
+    compact = dict((compact_key(key, dictionary), True) for key in projection)
+    compact[_VERSION_KEY] = True
+    return compact
+
+
+def compact_sort(sort, dictionary):
+    """Return ``sort`` on the documents in the compact schema"""
+
+    return [(compact_key(key, dictionary), direction) for key, direction in
+            sort]
+
+
+def measure_document_sizes(documents, dictionary, related_pk_only=False,
+                           related_fields=frozenset()):
+    """
+    Measure the size of ``documents`` in the standard and the compact schema
+
+    :param documents: The audit documents of a model, as stored in MongoDB
+    :param dictionary: The field dictionary of the model, with all of its
+        fields
+    :type dictionary: :class:`FieldDictionary`
+    :param related_pk_only: Whether related objects are to be recorded by
+        their primary key only
+    :type related_pk_only: :class:`bool`
+    :param related_fields: The names of the fields of the model which are
+        relations
+    :return: The number of documents, followed by the total size of their
+        BSON in the standard and in the compact schema
+    :rtype: :class:`tuple`
+
+    """
+
+    count = standard_size = compact_size = 0
+    for document in documents:
+        standard = decode_document(document, dictionary, related_fields)
+        compact = encode_document(standard, dictionary, related_pk_only)
+
+        count += 1
+        standard_size += len(BSON.encode(standard))
+        compact_size += len(BSON.encode(compact))
+
+    return count, standard_size, compact_size
@@ -0,0 +1,556 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+A local, append-only spool of the audit documents which could not be written
+to MongoDB, and their replay once it is available again
+
+The spool is a directory of segment files. Each segment is a sequence of
+records made up of a header (the length and CRC-32 of the body) followed by
+the body: a BSON document holding the name of the collection and the audit
+document. Segments are written to with a ``.open`` suffix and renamed with a
+``.spool`` suffix once they are full or the spool is closed.
+
+"""
+
+import atexit
+from glob import glob
+from logging import getLogger
+import os
+import struct
+import threading
+import time
+from zlib import crc32
+
+from bson import BSON
+from django.conf import settings
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+from djangoaudit.connection import MONGO_CONNECTION, MongoConnectionError
+
+__all__ = ["AuditSpool", "get_audit_spool", "read_segment", "spool_documents"]
+
+_LOGGER = getLogger(__name__)
+
+_HEADER = struct.Struct('<II')
+"""The length and CRC-32 of the body of each record"""
+
+_OPEN_SUFFIX = '.open'
+
+_SEALED_SUFFIX = '.spool'
+
+_DUPLICATE_KEY_CODES = (11000, 11001)
+
+
+def _checksum(body):
+    return crc32(body) & 0xffffffff
+
+
+def read_segment(path):
+    """
+    Return the records in the segment at ``path``
+
+    Reading stops at the first incomplete or corrupt record, which is what is
+    left of a write interrupted by a crash.
+
+    :param path: The path to the segment
+    :type path: :class:`basestring`
+    :return: The name of the collection and the document of each record
+    :rtype: :class:`list` of ``(collection name, document)`` pairs
+
+    """
+
+    segment_file = open(path, 'rb')
+    try:
+        data = segment_file.read()
+    finally:
+        segment_file.close()
+
+    records = []
+    offset = 0
+    while offset < len(data):
+        header = data[offset:offset + _HEADER.size]
+        if len(header) < _HEADER.size:
+            break
+
+        length, checksum = _HEADER.unpack(header)
+        body = data[offset + _HEADER.size:offset + _HEADER.size + length]
+        if len(body) < length or _checksum(body) != checksum:
+            break
+
+        record = BSON(body).decode()
+        records.append((record['collection'], record['document']))
+        offset += _HEADER.size + length
+
+    if offset < len(data):
+        _LOGGER.warning("Ignoring %d bytes of incomplete records at the end "
+                        "of spool segment %s", len(data) - offset, path)
+
+    return records
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _insert_skipping_duplicates(collection, documents):
+    """
+    Insert ``documents`` in order into ``collection``, skipping those which
+    have already been inserted
+
+    As each document has its id allocated before it is spooled, a document
+    which was written by an earlier, interrupted replay is found by its id.
+
+    :return: The number of documents inserted
+    :rtype: :class:`int`
+
+    """
+
+    offset = 0
+    skipped = 0
+    while offset < len(documents):
+        try:
+            collection.insert_many(documents[offset:], ordered=True)
+            break
+        except BulkWriteError, exc:
+            # An ordered insert stops at its first error:
+            error = exc.details['writeErrors'][0]
+            if error['code'] not in _DUPLICATE_KEY_CODES:
+                raise
+            offset += error['index'] + 1
+            skipped += 1
+
+    return len(documents) - skipped
+
+
+class AuditSpool(object):
+    """
+    Append audit documents to segment files in ``directory`` and replay them
+    into MongoDB.
+
+    Each append is flushed to the operating system straight away, so it
+    survives the process crashing. Segments are synced to disk once
+    ``fsync_documents`` documents have been appended or ``fsync_interval``
+    seconds have passed since the first unsynced one (by a timer thread),
+    whichever comes first, and sealed once they reach ``segment_size`` bytes.
+
+    """
+
+    def __init__(self, directory, segment_size=16 * 1024 * 1024,
+                 fsync_interval=1.0, fsync_documents=100, replay_interval=None):
+        """
+
+        :param directory: The directory to keep the segments in
+        :type directory: :class:`basestring`
+        :param segment_size: The size (in bytes) at which segments are sealed
+        :type segment_size: :class:`int`
+        :param fsync_interval: The longest time (in seconds) appended documents
+            wait to be synced to disk
+        :type fsync_interval: :class:`float`
+        :param fsync_documents: The largest number of appended documents
+            waiting to be synced to disk
+        :type fsync_documents: :class:`int`
+        :param replay_interval: How often (in seconds) a background thread
+            replays the spool, or ``None`` to leave it to
+            ``manage.py audit_replay_spool``
+        :type replay_interval: :class:`float`
+
+        """
+
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.fsync_documents = fsync_documents
+        self.replay_interval = replay_interval
+
+        self.spooled = 0
+        self.replayed = 0
+
+        self._lock = threading.RLock()
+        self._segment = None
+        self._segment_path = None
+        self._segment_size = 0
+        self._sequence = 0
+        self._unsynced = 0
+        self._synced_at = None
+        self._sync_timer = None
+        # The number of segments waiting to be replayed, once counted:
+        self._segment_count = None
+        self._pid = None
+        self._replayer = None
+        self._atexit_registered = False
+
+    def _open_segment(self):
+        """Start a new segment, owned by this process"""
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        self._sequence += 1
+        name = "audit-%020d-%d-%d%s" % (int(time.time() * 1e6), os.getpid(),
+                                        self._sequence, _OPEN_SUFFIX)
+        self._segment_path = os.path.join(self.directory, name)
+        self._segment = open(self._segment_path, 'ab')
+        self._segment_size = 0
+        self._synced_at = time.time()
+
+        _LOGGER.warning("MongoDB is unavailable; spooling audit documents to "
+                        "%s", self._segment_path)
+
+        if not self._atexit_registered:
+            atexit.register(self.close)
+            self._atexit_registered = True
+
+    def _sync(self):
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+        self._unsynced = 0
+        self._synced_at = time.time()
+
+    def _schedule_sync(self):
+        """
+        Sync the documents appended since the last sync once
+        ``fsync_interval`` seconds have passed, even if no more are appended
+
+        """
+
+        if self._sync_timer is not None:
+            return
+
+        delay = max(self._synced_at + self.fsync_interval - time.time(), 0)
+        self._sync_timer = threading.Timer(delay, self._sync_on_timer)
+        self._sync_timer.daemon = True
+        self._sync_timer.start()
+
+    def _sync_on_timer(self):
+        with self._lock:
+            self._sync_timer = None
+            if self._segment is not None and self._pid == os.getpid() and \
+               self._unsynced:
+                try:
+                    self._sync()
+                except (IOError, OSError), exc:
+                    _LOGGER.critical("Could not sync spool segment %s: %s",
+                                     self._segment_path, exc)
+
+    def _seal_segment(self):
+        """Sync and close the current segment so that it can be replayed"""
+
+        self._sync()
+        self._segment.close()
+        os.rename(self._segment_path,
+                  self._segment_path[:-len(_OPEN_SUFFIX)] + _SEALED_SUFFIX)
+        self._segment = None
+        self._segment_path = None
+
+        if self._segment_count is not None:
+            self._segment_count += 1
+
+    def append(self, pending):
+        """
+        Append ``pending`` to the spool.
+
+        :param pending: The documents to spool
+        :type pending: sequence of ``(collection handler, document)`` pairs
+
+        """
+
+        data = []
+        for collection, document in pending:
+            body = BSON.encode(dict(collection=collection.collection_name,
+                                    document=document))
+            data.append(_HEADER.pack(len(body), _checksum(body)))
+            data.append(body)
+        data = "".join(data)
+
+        with self._lock:
+            if self._pid != os.getpid():
+                # The segment of the parent process is left to it, but the
+                # file inherited is closed. As each append is flushed,
+                # closing it doesn't write anything to the segment:
+                if self._segment is not None:
+                    self._segment.close()
+                self._segment = None
+                self._segment_path = None
+                self._sync_timer = None
+                self._replayer = None
+                self._pid = os.getpid()
+
+            if self._segment is None:
+                self._open_segment()
+
+            self._segment.write(data)
+            self._segment.flush()
+            self._segment_size += len(data)
+            self._unsynced += len(pending)
+            self.spooled += len(pending)
+
+            if self._segment_size >= self.segment_size:
+                self._seal_segment()
+            elif self._unsynced >= self.fsync_documents or \
+                    time.time() - self._synced_at >= self.fsync_interval:
+                self._sync()
+            else:
+                self._schedule_sync()
+
+        if self.replay_interval:
+            self._ensure_replayer()
+
+    def close(self):
+        """
+        Seal the segment being written to.
+
+        This is registered with :mod:`atexit` when the first segment is
+        started.
+
+        """
+
+        with self._lock:
+            if self._segment is not None and self._pid == os.getpid():
+                self._seal_segment()
+
+    def has_pending_documents(self):
+        """
+        Return whether there are spooled documents which have not been
+        replayed yet
+
+        The segments are only counted on the first call; the count is then
+        kept up to date as segments are sealed and replayed by this process.
+
+        :rtype: :class:`bool`
+
+        """
+
+        with self._lock:
+            if self._segment is not None and self._pid == os.getpid():
+                return True
+
+            if self._segment_count is None:
+                self._segment_count = len(self.get_segments())
+            return self._segment_count > 0
+
+    def get_segments(self):
+        """
+        Return the paths of the segments which can be replayed, oldest first
+
+        These are the sealed segments and those left open by processes which
+        are no longer running.
+
+        :rtype: :class:`list`
+
+        """
+
+        segments = glob(os.path.join(self.directory, '*' + _SEALED_SUFFIX))
+
+        for path in glob(os.path.join(self.directory, '*' + _OPEN_SUFFIX)):
+            pid = int(os.path.basename(path).split('-')[2])
+            if not _is_process_alive(pid):
+                segments.append(path)
+
+        return sorted(segments, key=os.path.basename)
+
+    def replay(self, batch_size=500):
+        """
+        Write the spooled documents to MongoDB and remove their segments.
+
+        The documents are inserted in the order they were spooled and those
+        which have already been written (e.g. by an interrupted replay) are
+        skipped, so replaying is safe to repeat. Replaying stops at the first
+        segment which cannot be written; it is left to be replayed later.
+
+        :param batch_size: The maximum number of documents per ``insert_many``
+        :type batch_size: :class:`int`
+        :return: The number of segments replayed
+        :rtype: :class:`int`
+
+        """
+
+        # Make the documents spooled by this process available:
+        self.close()
+
+        segments = self.get_segments()
+        replayed_segments = 0
+        for path in segments:
+            try:
+                records = read_segment(path)
+            except (IOError, OSError):
+                # Replayed concurrently by another process:
+                continue
+
+            try:
+                self._replay_records(records, batch_size)
+            except (MongoConnectionError, ConnectionFailure), exc:
+                if isinstance(exc, ConnectionFailure):
+                    MONGO_CONNECTION.breaker.record_failure(exc)
+                _LOGGER.warning("Could not replay spool segment %s: %s", path,
+                                exc)
+                break
+
+            MONGO_CONNECTION.breaker.record_success()
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            with self._lock:
+                self.replayed += len(records)
+            replayed_segments += 1
+            _LOGGER.info("Replayed %d audit documents from %s", len(records),
+                         path)
+
+        with self._lock:
+            self._segment_count = len(segments) - replayed_segments
+
+        return replayed_segments
+
+    def _replay_records(self, records, batch_size):
+        """
+        Insert ``records`` with one ``insert_many`` per run of at most
+        ``batch_size`` documents for the same collection
+
+        """
+
+        start = 0
+        while start < len(records):
+            collection_name = records[start][0]
+            end = start
+            while end < len(records) and end - start < batch_size and \
+                    records[end][0] == collection_name:
+                end += 1
+
+            collection = MONGO_CONNECTION.get_collection(collection_name)
+            _insert_skipping_duplicates(
+                collection, [document for name, document in records[start:end]])
+            start = end
+
+    def _ensure_replayer(self):
+        """Start the replay thread if it isn't running in this process"""
+
+        if self._replayer is not None:
+            return
+
+        with self._lock:
+            if self._replayer is not None:
+                return
+
+            self._replayer = threading.Thread(target=self._run_replayer,
+                                              name="djangoaudit-spool-replayer")
+            self._replayer.daemon = True
+            self._replayer.start()
+
+    def _run_replayer(self):
+        """Replay the spool every ``replay_interval`` seconds until it's empty"""
+
+        while True:
+            time.sleep(self.replay_interval)
+            try:
+                self.replay()
+            except Exception, exc:
+                _LOGGER.critical("Error while replaying the audit spool: %s",
+                                 exc)
+
+            with self._lock:
+                if not self.has_pending_documents():
+                    self._replayer = None
+                    return
+
+    def stats(self):
+        """
+        Return the number of documents spooled and replayed by this process
+        and the number of segments waiting to be replayed.
+
+        :rtype: :class:`dict`
+
+        """
+
+        with self._lock:
+            return dict(spooled=self.spooled,
+                        replayed=self.replayed,
+                        segments=len(self.get_segments()))
+
+
+_AUDIT_SPOOL = None
+
+_AUDIT_SPOOL_LOCK = threading.Lock()
+
+
+def get_audit_spool():
+    """
+    Return the process-wide :class:`AuditSpool`, or ``None`` if spooling has
+    not been enabled with the ``AUDIT_SPOOL_DIR`` setting.
+
+    """
+
+    global _AUDIT_SPOOL
+
+    directory = getattr(settings, 'AUDIT_SPOOL_DIR', None)
+    if not directory:
+        return None
+
+    if _AUDIT_SPOOL is None:
+        with _AUDIT_SPOOL_LOCK:
+            if _AUDIT_SPOOL is None:
+                _AUDIT_SPOOL = AuditSpool(
+                    directory,
+                    segment_size=getattr(settings, 'AUDIT_SPOOL_SEGMENT_SIZE',
+                                         16 * 1024 * 1024),
+                    fsync_interval=getattr(settings,
+                                           'AUDIT_SPOOL_FSYNC_INTERVAL', 1.0),
+                    fsync_documents=getattr(settings,
+                                            'AUDIT_SPOOL_FSYNC_DOCUMENTS', 100),
+                    replay_interval=getattr(settings,
+                                            'AUDIT_SPOOL_REPLAY_INTERVAL', None),
+                    )
+
+    return _AUDIT_SPOOL
+
+
+def spool_documents(pending, exc):
+    """
+    Append ``pending``, which could not be written to MongoDB because of
+    ``exc``, to the spool
+
+    If spooling is not enabled the documents are logged and discarded.
+
+    :param pending: The documents to spool
+    :type pending: sequence of ``(collection handler, document)`` pairs
+    :param exc: The error raised when writing the documents
+    :return: Whether the documents were spooled
+    :rtype: :class:`bool`
+
+    """
+
+    spool = get_audit_spool()
+    if spool is None:
+        _LOGGER.critical("Error while writing %d documents to collection: %s "
+                         "Audit data: %r.", len(pending), exc,
+                         [document for collection, document in pending])
+        return False
+
+    try:
+        spool.append(pending)
+    except (IOError, OSError), spool_exc:
+        _LOGGER.critical("Error while spooling %d documents: %s Audit data: "
+                         "%r.", len(pending), spool_exc,
+                         [document for collection, document in pending])
+        return False
+
+    return True
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+The storage backends the audit documents are kept in.
+
+The audited models write and read their audit documents through the few
+methods of :class:`AuditStorage` (inserts, the documents of objects, the
+deletions of a model and the first document of each object), so that they
+work the same whichever backend is selected with the
+``AUDIT_STORAGE_BACKEND`` setting.
+
+The features which manage the collections in MongoDB itself (the partitions,
+the archival, the indexes and the audit stream) need the MongoDB backend, and
+check it with :func:`require_mongo_storage`.
+
+"""
+
+from abc import ABCMeta, abstractmethod
+from logging import getLogger
+import threading
+
+from bson import SON
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from djangoaudit.connection import MONGO_CONNECTION
+
+__all__ = ["MONGO_STORAGE", "MEMORY_STORAGE", "AuditStorage", "MongoStorage",
+           "get_storage_backend", "require_mongo_storage"]
+
+_LOGGER = getLogger(__name__)
+
+MONGO_STORAGE = 'djangoaudit.storage.MongoStorage'
+"""The backend keeping the audit documents in MongoDB"""
+
+MEMORY_STORAGE = 'djangoaudit.memory.MemoryStorage'
+"""The backend keeping the audit documents in the memory of the process"""
+
+_BACKENDS = {}
+
+_BACKENDS_LOCK = threading.Lock()
+
+
+class AuditStorage(object):
+    """
+    Base class for the storage backends
+
+    Each method takes the handler of the collection to use, whose
+    ``collection_name`` is the name of the collection and which returns the
+    PyMongo collection when called.
+
+    The queries are MongoDB queries which usually give the app and the model
+    of the objects (``object_app`` and ``object_model``) and may give their
+    primary keys (``object_pk``, either a value or ``{'$in': [...]}``). They
+    only use ``$and``, ``$or``, ``$nor``, ``$exists``, ``$in``, ``$ne`` and
+    the comparison operators. ``sort`` is a list of ``(key, direction)``
+    pairs and ``projection`` a list of keys, or a dictionary of them to
+    ``True``.
+
+    All the methods must be implemented by the subclasses, which can't be
+    instantiated otherwise.
+
+    """
+
+    __metaclass__ = ABCMeta
+
+    supports_compact_schema = True
+    """
+    Whether the documents may be recorded in the compact schema, whose field
+    dictionaries are kept in MongoDB (see :mod:`djangoaudit.schema`)
+
+    """
+
+    @abstractmethod
+    def insert(self, collection, document):
+        """
+        Write ``document``, which has an ``_id``, to ``collection``
+
+        :raises pymongo.errors.PyMongoError: If the document can't be written
+
+        """
+
+    @abstractmethod
+    def insert_many(self, collection, documents, ordered=True):
+        """
+        Write ``documents`` to ``collection``
+
+        :param ordered: Whether to write the documents in order, stopping at
+            the first one which can't be written, rather than in any order,
+            writing all those which can be
+        :type ordered: :class:`bool`
+        :raises pymongo.errors.PyMongoError: If a document can't be written
+
+        """
+
+    @abstractmethod
+    def find_by_object(self, collection, query, projection=None, sort=None,
+                       limit=None, batch_size=None):
+        """
+        Return an iterator over the documents of the objects matching
+        ``query`` in ``collection``
+
+        The iterator has a ``close`` method, to call if it isn't exhausted.
+
+        :param limit: The maximum number of documents to return
+        :type limit: :class:`int`
+        :param batch_size: The number of documents to retrieve at a time
+        :type batch_size: :class:`int`
+
+        """
+
+    @abstractmethod
+    def find_deletions(self, collection, query, projection=None, sort=None):
+        """
+        Return an iterator over the documents recording the deletion of the
+        objects matching ``query`` in ``collection``, as in
+        :meth:`find_by_object`
+
+        ``query`` has ``audit_is_delete`` set to ``True``, or to the key of the
+        field in the compact schema.
+
+        """
+
+    @abstractmethod
+    def find_first(self, collection, query, sort, group_key='object_pk'):
+        """
+        Return the first document in the order of ``sort`` of each object
+        matching ``query`` in ``collection``, i.e. of each value of
+        ``group_key``
+
+        :rtype: :class:`list`
+
+        """
+
+
+class MongoStorage(AuditStorage):
+    """
+    Keep the audit documents in MongoDB
+
+    The outcome of the reads is reported to the circuit breaker of
+    :data:`~djangoaudit.connection.MONGO_CONNECTION`, whereas the callers of
+    the writes report it themselves, as they spool the documents when MongoDB
+    is unavailable.
+
+    :raises djangoaudit.connection.MongoConnectionError: If MongoDB is
+        unavailable
+
+    """
+
+    def insert(self, collection, document):
+        collection().insert_one(document)
+
+    def insert_many(self, collection, documents, ordered=True):
+        collection().insert_many(documents, ordered=ordered)
+
+    def find_by_object(self, collection, query, projection=None, sort=None,
+                       limit=None, batch_size=None):
+        cursor = collection().find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+        return self._read(cursor)
+
+    def _read(self, cursor):
+        try:
+            with MONGO_CONNECTION.breaker.recording():
+                for document in cursor:
+                    yield document
+        finally:
+            cursor.close()
+
+    def find_deletions(self, collection, query, projection=None, sort=None):
+        return self.find_by_object(collection, query, projection, sort)
+
+    def find_first(self, collection, query, sort, group_key='object_pk'):
+        pipeline = [
+            {'$match': query},
+            {'$sort': SON(sort)},
+            {'$group': {'_id': '$%s' % group_key,
+                        'first': {'$first': '$$ROOT'}}},
+            ]
+        handler = collection()
+        with MONGO_CONNECTION.breaker.recording():
+            return [result['first'] for result in handler.aggregate(pipeline)]
+
+
+def get_storage_backend():
+    """
+    Return the backend selected with the ``AUDIT_STORAGE_BACKEND`` setting,
+    the dotted path to a subclass of :class:`AuditStorage`
+    (:data:`MONGO_STORAGE` by default)
+
+    There is one instance of each backend per process, so that the documents
+    kept by the in-memory backend are shared by all the threads.
+
+    :rtype: :class:`AuditStorage`
+
+    """
+    path = getattr(settings, 'AUDIT_STORAGE_BACKEND', MONGO_STORAGE)
+
+    backend = _BACKENDS.get(path)
+    if backend is None:
+        with _BACKENDS_LOCK:
+            backend = _BACKENDS.get(path)
+            if backend is None:
+                backend = import_string(path)()
+                _BACKENDS[path] = backend
+                _LOGGER.debug("Using the %s storage backend", path)
+
+    return backend
+
+
+def require_mongo_storage(feature):
+    """
+    Check that the backend selected keeps the audit documents in MongoDB,
+    before using ``feature``, which manages the collections in MongoDB itself
+
+    :param feature: The name of the feature, for the error message
+    :type feature: :class:`basestring`
+    :raises NotImplementedError: If another backend is selected
+
+    """
+    storage = get_storage_backend()
+    if not isinstance(storage, MongoStorage):
+        raise NotImplementedError(
+            "%s is not supported by the %s storage backend, only by %s" %
+            (feature, type(storage).__name__, MONGO_STORAGE))
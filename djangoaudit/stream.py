@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Stream the audit documents to downstream consumers as they are written.
+
+The documents are read from a MongoDB change stream on the auditing collection
+(which needs a replica set) or, if the ``AUDIT_STREAM_MIRROR_COLLECTION``
+setting is set, from a tailable cursor on a capped collection to which every
+audit document is also written.
+
+"""
+
+from logging import getLogger
+import re
+import time
+
+from django.conf import settings
+from pymongo import ASCENDING, CursorType
+from pymongo.errors import CollectionInvalid, ConnectionFailure
+
+from djangoaudit.connection import MONGO_CONNECTION, MongoConnectionError
+from djangoaudit.models import AUDITING_COLLECTION, get_audit_collection_names
+from djangoaudit.partitions import is_partitioned
+from djangoaudit.schema import decode_document
+from djangoaudit.storage import require_mongo_storage
+
+__all__ = ["AuditStream", "STREAM_CHANGES", "STREAM_MIRROR",
+           "ensure_mirror_collection"]
+
+_LOGGER = getLogger(__name__)
+
+STREAM_CHANGES = 'changes'
+"""Read the audit documents from a change stream on the auditing collection"""
+
+STREAM_MIRROR = 'mirror'
+"""Read the audit documents from the capped mirror collection"""
+
+
+def _get_mirror_collection_name():
+    return getattr(settings, 'AUDIT_STREAM_MIRROR_COLLECTION', None)
+
+
+def ensure_mirror_collection(database):
+    """
+    Create the capped collection named by the
+    ``AUDIT_STREAM_MIRROR_COLLECTION`` setting if it doesn't exist yet.
+
+    Its size in bytes is given by the ``AUDIT_STREAM_MIRROR_SIZE`` setting
+    (64MB by default). The collection has to be created before any audit
+    document is written to it, otherwise MongoDB creates it uncapped.
+
+    :param database: The database holding the auditing collection
+    :type database: :class:`pymongo.database.Database`
+    :return: Whether the collection was created
+    :rtype: :class:`bool`
+
+    """
+
+    name = _get_mirror_collection_name()
+    if not name:
+        return False
+
+    size = getattr(settings, 'AUDIT_STREAM_MIRROR_SIZE', 64 * 1024 * 1024)
+    try:
+        database.create_collection(name, capped=True, size=size)
+    except CollectionInvalid:
+        # It already exists:
+        if not database[name].options().get('capped'):
+            _LOGGER.warning("The audit stream mirror collection %s is not "
+                            "capped, so it can't be tailed", name)
+        return False
+
+    _LOGGER.info("Created the audit stream mirror collection %s", name)
+    return True
+
+
+class AuditStream(object):
+    """
+    Iterate over the audit documents as they are written.
+
+    Each item is a ``(resume token, document)`` pair. Passing the token of the
+    last document processed as ``resume_after`` to a new stream carries on
+    from the next one. The token of the last document read is also available
+    as :attr:`resume_token`.
+
+    The documents recorded in the compact schema are given in the standard
+    one (see :func:`djangoaudit.schema.decode_document`).
+
+    :param resume_after: The token of the document to carry on after, or
+        ``None`` to start with the next document written (change streams) or
+        the oldest one in the mirror collection
+    :type resume_after: :class:`dict`
+    :param source: :data:`STREAM_CHANGES` or :data:`STREAM_MIRROR`; defaults
+        to the latter if the ``AUDIT_STREAM_MIRROR_COLLECTION`` setting is set
+    :param follow: Whether to wait for new documents once all those written so
+        far have been read, rather than stopping
+    :type follow: :class:`bool`
+    :param poll_interval: The seconds to wait before reconnecting when
+        following the stream and MongoDB is unavailable
+    :type poll_interval: :class:`float`
+    :param max_await_time_ms: The longest MongoDB waits for new documents
+        before returning an empty batch
+    :type max_await_time_ms: :class:`int`
+    :param batch_size: The number of documents per batch
+    :type batch_size: :class:`int`
+    :raises ValueError: If ``source`` is :data:`STREAM_MIRROR` and no mirror
+        collection is configured
+    :raises NotImplementedError: If the MongoDB storage backend isn't
+        selected
+
+    """
+
+    def __init__(self, resume_after=None, source=None, follow=True,
+                 poll_interval=1.0, max_await_time_ms=1000, batch_size=None):
+        mirror_collection_name = _get_mirror_collection_name()
+        if source is None:
+            source = STREAM_MIRROR if mirror_collection_name else \
+                     STREAM_CHANGES
+        if source == STREAM_MIRROR and not mirror_collection_name:
+            raise ValueError("The AUDIT_STREAM_MIRROR_COLLECTION setting is "
+                             "not set")
+        if source not in (STREAM_CHANGES, STREAM_MIRROR):
+            raise ValueError("Unknown audit stream source %r" % source)
+
+        require_mongo_storage("The audit stream")
+
+        self.source = source
+        self.resume_token = resume_after
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.max_await_time_ms = max_await_time_ms
+        self.batch_size = batch_size
+
+        self._mirror_collection_name = mirror_collection_name
+
+    def __iter__(self):
+        if self.source == STREAM_CHANGES:
+            read_documents = self._read_changes
+        else:
+            read_documents = self._read_mirror
+
+        while True:
+            try:
+                for token, document in read_documents():
+                    self.resume_token = token
+                    yield token, decode_document(document)
+                return
+            except (MongoConnectionError, ConnectionFailure), exc:
+                if not self.follow:
+                    raise
+                _LOGGER.warning("Lost the audit stream, resuming in %s "
+                                "seconds: %s", self.poll_interval, exc)
+                time.sleep(self.poll_interval)
+
+    def _read_changes(self):
+        """Read the documents inserted since :attr:`resume_token`"""
+
+        options = dict(resume_after=self.resume_token,
+                       max_await_time_ms=self.max_await_time_ms)
+        if self.batch_size:
+            options['batch_size'] = self.batch_size
+
+        match = {'operationType': 'insert'}
+        watched = AUDITING_COLLECTION()
+
+        collection_names = get_audit_collection_names()
+        if is_partitioned() or len(collection_names) > 1:
+            # Watch the whole database for inserts into any of the auditing
+            # collections or their partitions:
+            pattern = "^(%s)(_\\d{4}_\\d{2})?$" % "|".join(
+                re.escape(collection_name) for collection_name in
+                collection_names)
+            match['ns.coll'] = {'$regex': pattern}
+            watched = watched.database
+
+        pipeline = [{'$match': match}]
+        with watched.watch(pipeline, **options) as changes:
+            while changes.alive:
+                change = changes.try_next()
+                if change is not None:
+                    yield change['_id'], change['fullDocument']
+                elif not self.follow:
+                    return
+
+    def _read_mirror(self):
+        """
+        Read the documents in the mirror collection after
+        :attr:`resume_token`, in the order they were written
+
+        A capped collection can only be read in its natural order, so the
+        documents up to the one resumed after are read and skipped. If that
+        document has been overwritten since, the stream carries on from the
+        oldest document left and some documents are lost.
+
+        """
+
+        collection = MONGO_CONNECTION.get_collection(
+            self._mirror_collection_name)
+
+        while True:
+            skip_to = None
+            if self.resume_token is not None:
+                skip_to = self.resume_token['_id']
+                if collection.find_one({'_id': skip_to}, {'_id': True}) is None:
+                    _LOGGER.warning("Audit document %s is no longer in %s; "
+                                    "some documents have been missed", skip_to,
+                                    self._mirror_collection_name)
+                    skip_to = None
+
+            if self.follow:
+                cursor_type = CursorType.TAILABLE_AWAIT
+            else:
+                cursor_type = CursorType.NON_TAILABLE
+            cursor = collection.find(cursor_type=cursor_type,
+                                     sort=[('$natural', ASCENDING)])
+            if self.follow:
+                cursor = cursor.max_await_time_ms(self.max_await_time_ms)
+            if self.batch_size:
+                cursor = cursor.batch_size(self.batch_size)
+
+            while True:
+                for document in cursor:
+                    if skip_to is not None:
+                        if document['_id'] == skip_to:
+                            skip_to = None
+                        continue
+                    yield {'_id': document['_id']}, document
+
+                if not (self.follow and cursor.alive):
+                    break
+
+            if not self.follow:
+                return
+
+            # The cursor dies if the collection was empty or the writes
+            # overtook it, so start again after the last document read:
+            time.sleep(self.poll_interval)
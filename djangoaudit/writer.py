@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""
+Writing of audit documents to MongoDB, either directly or from a background
+thread
+
+"""
+
+import atexit
+from collections import OrderedDict
+from logging import getLogger
+import os
+from Queue import Queue, Empty, Full
+import threading
+import time
+from timeit import default_timer
+
+from django.conf import settings
+from pymongo.errors import ConnectionFailure, PyMongoError
+
+from djangoaudit.connection import MONGO_CONNECTION, MongoConnectionError
+from djangoaudit.instrumentation import (COUNTER_DOCUMENTS_WRITTEN,
+                                         COUNTER_MONGO_UNAVAILABLE,
+                                         COUNTER_WRITE_FAILURES, PHASE_INSERT,
+                                         increment, is_instrumented,
+                                         record_timing)
+from djangoaudit.spool import get_audit_spool, spool_documents
+from djangoaudit.storage import get_storage_backend
+
+__all__ = ["AuditWriter", "get_audit_writer", "insert_documents",
+           "OVERFLOW_BLOCK", "OVERFLOW_DROP_OLDEST", "OVERFLOW_SPILL"]
+
+_LOGGER = getLogger(__name__)
+
+OVERFLOW_BLOCK = 'block'
+"""Block the saving thread until there is room on the queue"""
+
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+"""Discard the oldest queued document to make room for the new one"""
+
+OVERFLOW_SPILL = 'spill'
+"""Append the new document to the spool instead of queuing it"""
+
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+_STOP = object()
+"""Sentinel put on the queue to ask the worker thread to finish"""
+
+
+def insert_documents(pending, raise_errors=False, ordered=True):
+    """
+    Write ``pending`` with one ``insert_many`` per collection, through the
+    storage backend (see :mod:`djangoaudit.storage`).
+
+    Unless ``ordered`` is unset, the relative order of the documents for each
+    collection is preserved and the writes to a collection stop at the first
+    document which can't be written. If
+    MongoDB is unavailable the documents are spooled (see
+    :func:`djangoaudit.spool.spool_documents`). Any other failure is logged
+    once for the whole batch rather than once per document.
+
+    :param pending: The documents to write
+    :type pending: sequence of ``(collection handler, document)`` pairs
+    :param raise_errors: Whether to raise the errors rather than spool or log
+        the documents
+    :type raise_errors: :class:`bool`
+    :param ordered: Whether to write the documents of each collection in
+        order (see :meth:`~djangoaudit.storage.AuditStorage.insert_many`)
+    :type ordered: :class:`bool`
+    :return: The number of documents written to MongoDB or the spool
+    :rtype: :class:`int`
+    :raises pymongo.errors.PyMongoError: If ``raise_errors`` is set and the
+        documents can't be written
+    :raises djangoaudit.connection.MongoConnectionError: If ``raise_errors``
+        is set and MongoDB is unavailable
+
+    """
+
+    by_collection = OrderedDict()
+    for collection, document in pending:
+        by_collection.setdefault(collection, []).append(document)
+
+    storage = get_storage_backend()
+    instrumented = is_instrumented()
+    written = 0
+    for collection, documents in by_collection.iteritems():
+        started_at = default_timer()
+        try:
+            storage.insert_many(collection, documents, ordered)
+        except (MongoConnectionError, ConnectionFailure), exc:
+            if isinstance(exc, ConnectionFailure):
+                MONGO_CONNECTION.breaker.record_failure(exc)
+            if instrumented:
+                increment(COUNTER_MONGO_UNAVAILABLE)
+            if raise_errors:
+                raise
+
+            if spool_documents([(collection, document) for document in
+                                documents], exc):
+                written += len(documents)
+        except PyMongoError, exc:
+            if instrumented:
+                increment(COUNTER_WRITE_FAILURES)
+            if raise_errors:
+                raise
+
+            _LOGGER.critical("Error while writing %d documents to collection "
+                             "%s: %s Audit data: %r.", len(documents),
+                             collection.collection_name, exc, documents)
+        else:
+            MONGO_CONNECTION.breaker.record_success()
+            written += len(documents)
+            if instrumented:
+                record_timing(PHASE_INSERT, default_timer() - started_at)
+                increment(COUNTER_DOCUMENTS_WRITTEN, len(documents))
+
+    return written
+
+
+class AuditWriter(object):
+    """
+    Queue audit documents in process and write them in batches from a
+    background thread.
+
+    A batch is written once ``batch_size`` documents have been collected or
+    ``flush_interval`` seconds have passed since the first document of the
+    batch was queued, whichever comes first.
+
+    """
+
+    def __init__(self, queue_size=10000, batch_size=500, flush_interval=1.0,
+                 overflow_policy=OVERFLOW_BLOCK, spool=None):
+        """
+
+        :param queue_size: The maximum number of documents waiting to be
+            written
+        :type queue_size: :class:`int`
+        :param batch_size: The maximum number of documents per ``insert_many``
+        :type batch_size: :class:`int`
+        :param flush_interval: The longest time (in seconds) a document waits
+            for its batch to fill up
+        :type flush_interval: :class:`float`
+        :param overflow_policy: What to do when the queue is full; one of
+            :data:`OVERFLOW_POLICIES`
+        :param spool: The spool to append documents to when the policy is
+            :data:`OVERFLOW_SPILL`
+        :type spool: :class:`djangoaudit.spool.AuditSpool`
+        :raises ValueError: If the policy is unknown or spilling is requested
+            without a ``spool``
+
+        """
+
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy %r; expected one of %r" %
+                             (overflow_policy, OVERFLOW_POLICIES))
+
+        if overflow_policy == OVERFLOW_SPILL and spool is None:
+            raise ValueError("A spool is required for the %r overflow policy" %
+                             OVERFLOW_SPILL)
+
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.spool = spool
+
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed = 0
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._atexit_registered = False
+
+    def _ensure_worker(self):
+        """
+        Start the worker thread if it isn't running in this process.
+
+        Threads do not survive a fork, so a child process gets its own queue
+        and worker rather than inheriting the parent's.
+
+        """
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+
+            self._queue = Queue(self.queue_size)
+            self._thread = threading.Thread(target=self._run,
+                                            name="djangoaudit-writer")
+            self._thread.daemon = True
+            self._pid = os.getpid()
+            self._thread.start()
+
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    def put(self, collection, document):
+        """
+        Queue ``document`` for writing to ``collection``.
+
+        :param collection: The collection handler to write to
+        :param document: The audit document
+        :type document: :class:`dict`
+
+        """
+
+        self._ensure_worker()
+        item = (collection, document)
+
+        if self.overflow_policy == OVERFLOW_BLOCK:
+            self._queue.put(item)
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except Full:
+                pass
+
+            if self.overflow_policy == OVERFLOW_SPILL:
+                self._spill([item])
+                return
+
+            # Make room by discarding the oldest document:
+            try:
+                self._queue.get_nowait()
+            except Empty:
+                continue
+
+            self._queue.task_done()
+            with self._lock:
+                self.dropped += 1
+
+    def _spill(self, items):
+        """Append ``items`` to the spool"""
+
+        self.spool.append(items)
+
+        with self._lock:
+            self.spilled += len(items)
+
+    def _run(self):
+        """Drain the queue in batches until asked to stop"""
+
+        queue = self._queue
+        stopping = False
+
+        while not stopping:
+            # Wait for as long as it takes for the first document of a batch,
+            # then only as long as the flush interval for the rest of it:
+            item = queue.get()
+            batch = []
+            deadline = time.time() + self.flush_interval
+
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    queue.task_done()
+                    break
+
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+
+                try:
+                    item = queue.get(timeout=timeout)
+                except Empty:
+                    break
+
+            if batch:
+                # Anything left unhandled would stop the thread and leave
+                # flush() and blocked saves waiting for good:
+                try:
+                    self._write(batch)
+                except Exception, exc:
+                    _LOGGER.critical("Error while writing %d audit documents: "
+                                     "%s Audit data: %r.", len(batch), exc,
+                                     [document for _, document in batch],
+                                     exc_info=True)
+                    with self._lock:
+                        self.failed += len(batch)
+                finally:
+                    for _ in batch:
+                        queue.task_done()
+
+    def _write(self, batch):
+        """Write out ``batch`` and update the counters"""
+
+        written = insert_documents(batch)
+        with self._lock:
+            self.written += written
+            self.failed += len(batch) - written
+
+    def flush(self):
+        """Block until every document queued so far has been handled"""
+
+        if self._pid == os.getpid() and self._thread is not None:
+            self._queue.join()
+
+    def shutdown(self, timeout=None):
+        """
+        Write out any queued documents and stop the worker thread.
+
+        This is registered with :mod:`atexit` when the worker is started.
+
+        :param timeout: The longest time (in seconds) to wait for the queue to
+            be drained
+        :type timeout: :class:`float`
+
+        """
+
+        if self._pid != os.getpid() or self._thread is None:
+            return
+
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+        if self._thread.is_alive():
+            # Keep the thread, which is still writing out the queue:
+            _LOGGER.critical("Timed out while writing out audit documents on "
+                             "shutdown; %d documents remain queued.",
+                             self._queue.qsize())
+        else:
+            self._thread = None
+
+    def stats(self):
+        """
+        Return the queue depth and document counters for this writer.
+
+        :rtype: :class:`dict`
+
+        """
+
+        if self._pid == os.getpid() and self._queue is not None:
+            queue_depth = self._queue.qsize()
+        else:
+            queue_depth = 0
+
+        with self._lock:
+            return dict(queue_depth=queue_depth,
+                        written=self.written,
+                        dropped=self.dropped,
+                        spilled=self.spilled,
+                        failed=self.failed)
+
+
+_AUDIT_WRITER = None
+
+_AUDIT_WRITER_LOCK = threading.Lock()
+
+
+def get_audit_writer():
+    """
+    Return the process-wide :class:`AuditWriter`, or ``None`` if background
+    writing has not been enabled with the ``AUDIT_BACKGROUND_WRITER`` setting.
+
+    """
+
+    global _AUDIT_WRITER
+
+    if not getattr(settings, 'AUDIT_BACKGROUND_WRITER', False):
+        return None
+
+    if _AUDIT_WRITER is None:
+        with _AUDIT_WRITER_LOCK:
+            if _AUDIT_WRITER is None:
+                _AUDIT_WRITER = AuditWriter(
+                    queue_size=getattr(settings, 'AUDIT_WRITER_QUEUE_SIZE',
+                                       10000),
+                    batch_size=getattr(settings, 'AUDIT_WRITER_BATCH_SIZE', 500),
+                    flush_interval=getattr(settings,
+                                           'AUDIT_WRITER_FLUSH_INTERVAL', 1.0),
+                    overflow_policy=getattr(settings,
+                                            'AUDIT_WRITER_OVERFLOW_POLICY',
+                                            OVERFLOW_BLOCK),
+                    spool=get_audit_spool(),
+                    )
+
+    return _AUDIT_WRITER
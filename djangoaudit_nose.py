@@ -59,6 +59,20 @@ class DjangoMongoDBPlugin(Plugin):
             help=deactivate_help
         )
         
+        in_memory_help = (
+            "Keep the audit documents of the models in memory instead of a "
+            "MongoDB server, so that no server is needed and test processes "
+            "don't share any data [NOSE_DJANGO_MONGO_IN_MEMORY]"
+        )
+        
+        parser.add_option(
+            "--%s-in-memory" % self.name,
+            action="store_true",
+            default=bool(env.get("NOSE_DJANGO_MONGO_IN_MEMORY")),
+            dest="django_mongo_in_memory",
+            help=in_memory_help
+        )
+        
     def configure(self, options, conf):
         """See whether we should enable or disable the plugin"""
         super(DjangoMongoDBPlugin, self).configure(options, conf)
@@ -77,6 +91,12 @@ class DjangoMongoDBPlugin(Plugin):
         from django.conf import settings
 
         from djangoaudit.connection import MONGO_CONNECTION
+        from djangoaudit.storage import MEMORY_STORAGE, get_storage_backend
+        
+        self.storage = None
+        if options.django_mongo_in_memory:
+            settings.AUDIT_STORAGE_BACKEND = MEMORY_STORAGE
+            self.storage = get_storage_backend()
 
         self.test_db_name = u'%s_test' % settings.MONGO_DATABASE_NAME
         self.audit_collection_name = u"audit_data"
@@ -98,6 +118,10 @@ class DjangoMongoDBPlugin(Plugin):
     def beforeTest(self, test):
         """Ensure that we've got a fresh collection before each test"""
         
+        if self.storage is not None:
+            self.storage.clear()
+            return
+        
         test_db = self.mc.database
         
         try:
@@ -113,6 +137,10 @@ class DjangoMongoDBPlugin(Plugin):
         Ensure the auditing collection is torn down after the test completes
         """
         
+        if self.storage is not None:
+            self.storage.clear()
+            return
+        
         try:
             self.mc.database.drop_collection(self.audit_collection_name)
         except PyMongoError, exc:
@@ -122,6 +150,9 @@ class DjangoMongoDBPlugin(Plugin):
     def finalize(self, result=None):
         """Remove the test database from MongoDB"""
         
+        if self.storage is not None:
+            return
+        
         try:
             self.mc.connection.drop_database(self.mc.database)
         except PyMongoError, exc:
@@ -52,11 +52,12 @@ setup(name="django-audit",
         "nose",
         ],
       install_requires=[
-        "Django >= 1.1",
-        "pymongo >= 1.4",
+        "Django >= 1.8",
+        "pymongo >= 3.8",
         ],
       extras_require = {
         'nose': ["nose >= 0.11"],
+        'benchmarks': ["mongomock"],
         },
       test_suite="nose.collector",
       entry_points = """\
@@ -21,7 +21,7 @@ from decimal import Decimal
 
 from fixture import DataSet
 
-__all__ = ['PilotData', 'VesselData']
+__all__ = ['PilotData', 'VesselData', 'PatrolData']
 
 class PilotData(DataSet):
     """Pilot fixtures for testing AuditedModel"""
@@ -88,4 +88,13 @@ class VesselData(DataSet):
     class Raptor259:
         name = "Raptor 259"
         pilot = PilotData.Athena
-        
\ No newline at end of file
+        
+class PatrolData(DataSet):
+    """Patrol fixtures for testing related log fields"""
+    
+    class Meta:
+        django_model = "bsg.Patrol"
+        
+    class CombatAirPatrol:
+        name = "Combat Air Patrol"
+        pilot = PilotData.Athena
@@ -25,7 +25,7 @@ from django.db import models
 
 from djangoaudit.models import AuditedModel
 
-__all__ = ['Pilot', 'Vessel']
+__all__ = ['Pilot', 'Vessel', 'Patrol']
 
 CRAFT_CHOICES = (
     (0, "Viper"),
@@ -58,5 +58,16 @@ class Vessel(AuditedModel):
     name = models.CharField(max_length=30)
     pilot = models.ForeignKey(Pilot, related_name="vessels")
     
+    def __unicode__(self):
+        return self.name
+    
+class Patrol(AuditedModel):
+    """A dummy model to test related log fields"""
+    
+    log_fields = ['name', 'pilot']
+    
+    name = models.CharField(max_length=30)
+    pilot = models.ForeignKey(Pilot, related_name="patrols")
+    
     def __unicode__(self):
         return self.name
\ No newline at end of file
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the retention policies and the archival of audit documents"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+import os
+import shutil
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from bson import ObjectId
+from django.core.management import call_command
+from fixture.django_testcase import FixtureTestCase
+from nose.tools import eq_, ok_, raises
+
+from djangoaudit import schema
+from djangoaudit.archive import (ARCHIVE_BSON, AuditArchive,
+                                 read_archive_file)
+from djangoaudit.connection import MONGO_CONNECTION
+from djangoaudit.models import (AUDITING_COLLECTION, AuditedModel,
+                                RETENTION_EXPIRE, _get_params_from_model)
+from djangoaudit.schema import encode_document, register_field_names
+from tests.fixtures.sampledjango.bsg.models import *
+from tests.fixtures.sampledjango.bsg.fixtures import *
+from tests.utils import find_audit_documents, skip_unless_mongo_storage
+
+
+_NOW = datetime(2025, 6, 1)
+
+
+def _make_documents(*ages):
+    """Make a document for Pilot #1 ``age`` days before :data:`_NOW`"""
+
+    return [{'_id': ObjectId(),
+             'object_app': "bsg",
+             'object_model': "Pilot",
+             'object_pk': 1,
+             'audit_date_stamp': _NOW - timedelta(days=age),
+             'audit_changes': {'age': (age, age + 1)}}
+            for age in ages]
+
+
+class TestRetentionExpiry(FixtureTestCase):
+    """Tests for the :data:`RETENTION_EXPIRE` retention policy"""
+
+    datasets = [PilotData, VesselData]
+
+    def setUp(self):
+        Pilot.audit_retention_days = 30
+
+    def tearDown(self):
+        del Pilot.audit_retention_days
+        del Pilot.audit_retention_policy
+
+    def test_expiry_date(self):
+        """Check that the documents are given the date they expire at"""
+
+        Pilot.audit_retention_policy = RETENTION_EXPIRE
+
+        pilot = Pilot.objects.get(call_sign="Apollo")
+        pilot.age += 1
+        pilot.save()
+
+        document = find_audit_documents(AUDITING_COLLECTION,
+                                        **_get_params_from_model(pilot))[-1]
+        eq_(document['audit_expires_at'],
+            document['audit_date_stamp'] + timedelta(days=30))
+
+    def test_archived_documents_do_not_expire(self):
+        """Check that the documents to be archived are not given an expiry"""
+
+        Pilot.audit_retention_policy = "archive"
+
+        pilot = Pilot.objects.get(call_sign="Apollo")
+        pilot.age += 1
+        pilot.save()
+
+        document = find_audit_documents(AUDITING_COLLECTION,
+                                        **_get_params_from_model(pilot))[-1]
+        ok_('audit_expires_at' not in document)
+
+
+@raises(AttributeError)
+def test_unknown_retention_policy():
+    """Check that the retention policy of a model is validated"""
+
+    class Dradis(AuditedModel):
+        audit_retention_policy = "shred"
+
+        class Meta:
+            abstract = True
+
+
+class TestAuditArchive(object):
+    """Tests for :class:`AuditArchive`"""
+
+    def setup(self):
+        skip_unless_mongo_storage()
+
+        Pilot.audit_retention_days = 30
+        self.directory = mkdtemp()
+        self.collection = MONGO_CONNECTION.get_collection("audit_data")
+        self.collection.delete_many({'object_app': "bsg"})
+
+        self.documents = _make_documents(90, 60, 45, 10)
+        self.collection.insert_many([dict(document) for document in
+                                     self.documents])
+
+    def teardown(self):
+        self.collection.delete_many({'object_app': "bsg"})
+        shutil.rmtree(self.directory)
+        del Pilot.audit_retention_days
+
+    def _get_remaining(self):
+        return [document['_id'] for document in
+                self.collection.find({'object_app': "bsg"},
+                                     sort=[('audit_date_stamp', 1)])]
+
+    def _check_archive(self, archive_format):
+        archive = AuditArchive(self.directory, archive_format)
+
+        eq_(archive.archive([Pilot], now=_NOW), {"bsg.Pilot": 3})
+        eq_(self._get_remaining(), [self.documents[3]['_id']])
+
+        manifest = archive.read_manifest()
+        eq_(len(manifest), 1)
+        eq_(manifest[0]['model'], "bsg.Pilot")
+        eq_(manifest[0]['format'], archive_format)
+        eq_(manifest[0]['documents'], 3)
+        eq_(manifest[0]['first_date_stamp'],
+            self.documents[0]['audit_date_stamp'])
+        eq_(manifest[0]['last_date_stamp'],
+            self.documents[2]['audit_date_stamp'])
+
+        path = os.path.join(self.directory, manifest[0]['file'])
+        archived = list(read_archive_file(path, archive_format))
+        eq_([document['_id'] for document in archived],
+            [document['_id'] for document in self.documents[:3]])
+        eq_(archived[0]['audit_date_stamp'],
+            self.documents[0]['audit_date_stamp'])
+
+    def test_archive_json(self):
+        """Check that expired documents are moved to a JSON lines file"""
+
+        self._check_archive("jsonl")
+
+    def test_archive_bson(self):
+        """Check that expired documents are moved to a BSON file"""
+
+        self._check_archive(ARCHIVE_BSON)
+
+    def test_rotation(self):
+        """Check that a new file is started once one reaches the file size"""
+
+        archive = AuditArchive(self.directory, file_size=1)
+        archive.archive([Pilot], now=_NOW)
+
+        eq_([entry['documents'] for entry in archive.read_manifest()],
+            [1, 1, 1])
+        eq_(sorted(os.listdir(self.directory)),
+            sorted([entry['file'] for entry in archive.read_manifest()] +
+                   ["manifest.json"]))
+
+    def test_not_expired(self):
+        """Check that the models without a retention period are skipped"""
+
+        del Pilot.audit_retention_days
+
+        try:
+            archive = AuditArchive(self.directory)
+            eq_(archive.archive([Pilot, Vessel], now=_NOW), {})
+            eq_(len(self._get_remaining()), 4)
+        finally:
+            Pilot.audit_retention_days = 30
+
+    def test_restore(self):
+        """Check that a range of archived documents is written back"""
+
+        archive = AuditArchive(self.directory)
+        archive.archive([Pilot], now=_NOW)
+
+        restored = archive.restore(since=_NOW - timedelta(days=70),
+                                   until=_NOW - timedelta(days=50))
+        eq_(restored, 1)
+        eq_(self._get_remaining(),
+            [self.documents[1]['_id'], self.documents[3]['_id']])
+
+        document = self.collection.find_one(self.documents[1]['_id'])
+        ok_('audit_restored_at' in document)
+        eq_(document['audit_changes'], {'age': [60, 61]})
+
+        # Restoring the range again leaves the restored document alone:
+        eq_(archive.restore(model_labels=["bsg.Pilot"]), 2)
+        eq_(len(self._get_remaining()), 4)
+        eq_(archive.restore(model_labels=["bsg.Vessel"]), 0)
+
+    def test_restored_documents_not_archived_again(self):
+        """Check that restored documents are deleted once they expire again"""
+
+        archive = AuditArchive(self.directory)
+        archive.archive([Pilot], now=_NOW)
+        archive.restore()
+
+        now = datetime.utcnow()
+        eq_(archive.archive([Pilot], now=now), {"bsg.Pilot": 1})
+        eq_(len(self._get_remaining()), 3)
+
+        eq_(archive.archive([Pilot], now=now + timedelta(days=31)),
+            {"bsg.Pilot": 0})
+        eq_(self._get_remaining(), [])
+        eq_([entry['documents'] for entry in archive.read_manifest()], [3, 1])
+
+    def test_compact_schema(self):
+        """Check that documents are archived in the schema they're in"""
+
+        dictionary = register_field_names("bsg.Pilot", Pilot.log_fields)
+        compact_documents = [encode_document(document, dictionary) for
+                             document in _make_documents(80, 5)]
+        self.collection.insert_many(compact_documents)
+
+        try:
+            archive = AuditArchive(self.directory)
+            eq_(archive.archive([Pilot], now=_NOW), {"bsg.Pilot": 4})
+            eq_(self._get_remaining(), [self.documents[3]['_id']])
+            eq_(self.collection.count({'s': 2}), 1)
+
+            path = os.path.join(self.directory,
+                                archive.read_manifest()[0]['file'])
+            archived = list(read_archive_file(path, "jsonl"))
+            eq_([document['_id'] for document in archived],
+                [self.documents[0]['_id'], compact_documents[0]['_id'],
+                 self.documents[1]['_id'], self.documents[2]['_id']])
+            eq_(archived[1]['s'], 2)
+
+            eq_(archive.restore(), 4)
+            ok_('r' in self.collection.find_one(compact_documents[0]['_id']))
+        finally:
+            self.collection.delete_many({'a': "bsg"})
+            MONGO_CONNECTION.get_collection("audit_schema").drop()
+            schema._FIELD_DICTIONARIES.clear()
+
+    def test_commands(self):
+        """Check the management commands to archive and restore"""
+
+        for document in self.documents:
+            document['audit_date_stamp'] += datetime.utcnow() - _NOW
+            self.collection.update_one(
+                {'_id': document['_id']},
+                {'$set': {'audit_date_stamp': document['audit_date_stamp']}})
+
+        stdout = StringIO()
+        call_command('audit_archive', directory=self.directory,
+                     archive_format=ARCHIVE_BSON, stdout=stdout)
+        ok_("Archived 3 documents of bsg.Pilot" in
+            stdout.getvalue().splitlines())
+
+        stdout = StringIO()
+        call_command('audit_restore_archive', directory=self.directory,
+                     models=["bsg.Pilot"], stdout=stdout)
+        eq_(stdout.getvalue().splitlines(), ["Restored 3 documents"])
+        eq_(len(self._get_remaining()), 4)
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the backfill of baseline audit documents"""
+from decimal import Decimal
+import os
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from fixture.django_testcase import FixtureTestCase
+from nose.tools import eq_, ok_, raises
+
+from djangoaudit.backfill import AuditBackfill
+from djangoaudit.models import AUDITING_COLLECTION
+from tests.fixtures.sampledjango.bsg.models import *
+from tests.fixtures.sampledjango.bsg.fixtures import *
+from tests.utils import drop_audit_collection, find_audit_documents
+
+
+class TestAuditBackfill(FixtureTestCase):
+    """Tests for :class:`AuditBackfill`"""
+
+    datasets = [PilotData, VesselData, PatrolData]
+
+    def setUp(self):
+        # The rows are taken to have existed before Pilot was audited:
+        drop_audit_collection("audit_data")
+
+        self.pks = list(Pilot.objects.order_by('pk')
+                        .values_list('pk', flat=True))
+
+    def tearDown(self):
+        drop_audit_collection("audit_data")
+
+    def _get_audited_pks(self):
+        documents = find_audit_documents(AUDITING_COLLECTION,
+                                         object_app="bsg",
+                                         object_model="Pilot")
+        return sorted(set(document['object_pk'] for document in documents))
+
+    def test_backfill(self):
+        """Check that each row is given a baseline like its creation's"""
+
+        backfill = AuditBackfill(Pilot, chunk_size=2, notes="Baseline")
+        eq_(backfill.backfill(), (len(self.pks), 0))
+        eq_(self._get_audited_pks(), self.pks)
+
+        starbuck = Pilot.objects.get(call_sign="Starbuck")
+        creation_log = starbuck.get_creation_log()
+        eq_(creation_log['call_sign'], "Starbuck")
+        eq_(creation_log['fastest_landing'], Decimal("46.77"))
+        eq_(creation_log['audit_notes'], "Baseline")
+
+        starbuck.age += 1
+        starbuck.save()
+        eq_([entry['audit_changes'].get('age') for entry in
+             starbuck.get_audit_log()], [(None, 27), (27, 28)])
+
+    def test_related_objects(self):
+        """Check that related objects are recorded as they are by save()"""
+
+        AuditBackfill(Patrol).backfill()
+
+        patrol = Patrol.objects.get(name=PatrolData.CombatAirPatrol.name)
+        eq_(patrol.get_creation_log()['pilot'], "Athena")
+        eq_(patrol.get_state_at()['pilot'], patrol.pilot_id)
+
+    def test_skip_audited(self):
+        """Check that the rows which already have audit documents are skipped"""
+
+        starbuck = Pilot.objects.get(call_sign="Starbuck")
+        starbuck.age += 1
+        starbuck.save()
+
+        eq_(AuditBackfill(Pilot, chunk_size=2).backfill(),
+            (len(self.pks) - 1, 1))
+        eq_(AuditBackfill(Pilot).backfill(), (0, len(self.pks)))
+        eq_(len(find_audit_documents(AUDITING_COLLECTION, object_app="bsg",
+                                     object_model="Pilot",
+                                     object_pk=starbuck.pk)), 1)
+
+    def test_resume(self):
+        """Check that the backfill can be resumed from a primary key"""
+
+        reports = []
+        backfill = AuditBackfill(Pilot, chunk_size=2)
+        backfill.backfill(self.pks[1],
+                          lambda *report: reports.append(report))
+
+        eq_(self._get_audited_pks(), self.pks[2:])
+        eq_(reports[-1], (self.pks[-1], len(self.pks) - 2, 0))
+        eq_([report[0] for report in reports], self.pks[3::2] +
+            ([self.pks[-1]] if len(self.pks) % 2 else []))
+
+    def test_workers(self):
+        """Check that the chunks can be recorded by a pool of threads"""
+
+        reports = []
+        backfill = AuditBackfill(Pilot, chunk_size=1, workers=3)
+        eq_(backfill.backfill(progress_callback=lambda *report:
+                              reports.append(report)),
+            (len(self.pks), 0))
+
+        eq_(self._get_audited_pks(), self.pks)
+        eq_([report[0] for report in reports], self.pks)
+
+    def test_command(self):
+        """Check the management command to backfill a model"""
+
+        stdout = StringIO()
+        call_command('audit_backfill', "bsg.Pilot", after=str(self.pks[0]),
+                     stdout=stdout, stderr=StringIO())
+
+        eq_(stdout.getvalue().splitlines(),
+            ["Recorded %d baseline documents of bsg.Pilot and skipped 0 rows"
+             % (len(self.pks) - 1)])
+        eq_(self._get_audited_pks(), self.pks[1:])
+
+    @raises(CommandError)
+    def test_command_unknown_model(self):
+        """Check that the model to backfill is validated"""
+
+        call_command('audit_backfill', "bsg.Raptor", stdout=StringIO())
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the connection to MongoDB"""
+import os
+import time
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from django.test.utils import override_settings
+from nose.tools import eq_, ok_, raises
+from pymongo.errors import AutoReconnect
+
+from djangoaudit.connection import (MONGO_CONNECTION, MongoConnection,
+                                    MongoConnectionError, CircuitBreaker,
+                                    BREAKER_CLOSED, BREAKER_OPEN,
+                                    BREAKER_HALF_OPEN)
+from tests.utils import requires_mongo_storage
+
+
+class TestCircuitBreaker(object):
+    """Tests for :class:`CircuitBreaker`"""
+
+    def test_opens_after_threshold(self):
+        """Check that the breaker opens after consecutive failures"""
+
+        breaker = CircuitBreaker(failure_threshold=2, cool_down=60)
+
+        breaker.record_failure()
+        ok_(breaker.allow_request())
+
+        breaker.record_failure()
+        eq_(breaker.state, BREAKER_OPEN)
+        ok_(not breaker.allow_request())
+
+        eq_(breaker.stats(), dict(state=BREAKER_OPEN, failures=2, opened=1,
+                                  rejected=1))
+
+    def test_success_resets_failures(self):
+        """Check that only consecutive failures open the breaker"""
+
+        breaker = CircuitBreaker(failure_threshold=2, cool_down=60)
+
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+
+        eq_(breaker.state, BREAKER_CLOSED)
+
+    def test_half_open_trial(self):
+        """Check that a single trial is let through after the cool down"""
+
+        breaker = CircuitBreaker(failure_threshold=1, cool_down=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+
+        ok_(breaker.allow_request())
+        eq_(breaker.state, BREAKER_HALF_OPEN)
+        ok_(not breaker.allow_request())
+
+        breaker.record_success()
+        eq_(breaker.state, BREAKER_CLOSED)
+        ok_(breaker.allow_request())
+
+    def test_failed_trial(self):
+        """Check that the breaker opens again if the trial fails"""
+
+        breaker = CircuitBreaker(failure_threshold=1, cool_down=0.01)
+        breaker.record_failure()
+        time.sleep(0.02)
+
+        ok_(breaker.allow_request())
+        breaker.record_failure()
+
+        eq_(breaker.state, BREAKER_OPEN)
+        eq_(breaker.opened, 2)
+
+    def test_recording(self):
+        """Check that the outcome of the requests in a block is reported"""
+
+        breaker = CircuitBreaker(failure_threshold=1, cool_down=0.01)
+
+        try:
+            with breaker.recording():
+                raise AutoReconnect("down")
+        except AutoReconnect:
+            pass
+        eq_(breaker.state, BREAKER_OPEN)
+
+        time.sleep(0.02)
+        ok_(breaker.allow_request())
+        with breaker.recording():
+            pass
+        eq_(breaker.state, BREAKER_CLOSED)
+
+    def test_probe(self):
+        """Check that a successful probe closes the breaker"""
+
+        probes = []
+        breaker = CircuitBreaker(failure_threshold=1, cool_down=60,
+                                 probe=lambda: probes.append(True),
+                                 probe_interval=0.01)
+        breaker.record_failure(AutoReconnect("down"))
+
+        for _ in range(100):
+            if breaker.closed:
+                break
+            time.sleep(0.01)
+
+        eq_(breaker.state, BREAKER_CLOSED)
+        ok_(probes)
+
+
+class TestMongoConnectionBreaker(object):
+    """Tests for the circuit breaker of :class:`MongoConnection`"""
+
+    def setup(self):
+        self.original_breaker = MONGO_CONNECTION.breaker
+        MONGO_CONNECTION.breaker = CircuitBreaker(failure_threshold=1,
+                                                  cool_down=60)
+
+    def teardown(self):
+        MONGO_CONNECTION.breaker = self.original_breaker
+
+    @raises(MongoConnectionError)
+    def test_fail_fast(self):
+        """Check that no collection is retrieved while the breaker is open"""
+
+        MONGO_CONNECTION.breaker.record_failure()
+        MONGO_CONNECTION.get_collection("audit_data")
+
+    @requires_mongo_storage
+    def test_audit_write_fails_fast(self):
+        """Check that audited writes don't try MongoDB while it's open"""
+
+        from djangoaudit.models import AUDITING_COLLECTION, _write_audit_document
+
+        # Make sure the collection is cached by the handler:
+        AUDITING_COLLECTION()
+        MONGO_CONNECTION.breaker.record_failure()
+
+        eq_(_write_audit_document({'n': 1}), None)
+        eq_(MONGO_CONNECTION.breaker.rejected, 1)
+
+    @requires_mongo_storage
+    def test_trial_read(self):
+        """Check that a read let through as the trial closes the breaker"""
+
+        from djangoaudit.models import AUDITING_COLLECTION, _find_audit_documents
+
+        MONGO_CONNECTION.breaker = CircuitBreaker(failure_threshold=1,
+                                                  cool_down=0.01)
+        MONGO_CONNECTION.breaker.record_failure()
+        time.sleep(0.02)
+
+        list(_find_audit_documents(AUDITING_COLLECTION, {'object_pk': -1}))
+
+        eq_(MONGO_CONNECTION.breaker.state, BREAKER_CLOSED)
+
+
+class TestLazyConnection(object):
+    """Tests for the creation of the client of :class:`MongoConnection`"""
+
+    def setup(self):
+        from django.conf import settings
+
+        self.connection = MongoConnection(settings.MONGO_HOST,
+                                          settings.MONGO_PORT)
+
+    def teardown(self):
+        self.connection.close()
+
+    def test_lazy(self):
+        """Check that the client is only created when it's first used"""
+
+        ok_(self.connection._connection is None)
+        ok_(self.connection.connection is not None)
+        ok_(self.connection._connection is not None)
+
+    def test_close(self):
+        """Check that closing the connection makes it create a new client"""
+
+        client = self.connection.connection
+        generation = self.connection.generation
+
+        self.connection.close()
+
+        ok_(self.connection.connection is not client)
+        eq_(self.connection.generation, generation + 1)
+
+    def test_fork(self):
+        """Check that a client created by another process is replaced"""
+
+        client = self.connection.connection
+        generation = self.connection.generation
+
+        # As if the client had been created by the parent process:
+        self.connection._pid = os.getpid() + 1
+
+        ok_(self.connection.connection is not client)
+        eq_(self.connection.generation, generation + 1)
+
+    def test_collection_retrieved_again(self):
+        """Check that collection handlers pick up a new client"""
+
+        from djangoaudit.models import _collection_handler
+
+        retrieved = []
+        original_get_collection = MONGO_CONNECTION.get_collection
+
+        def get_collection(collection_name):
+            retrieved.append(collection_name)
+            return original_get_collection(collection_name)
+
+        MONGO_CONNECTION.get_collection = get_collection
+        try:
+            handler = _collection_handler("audit_data")
+            handler()
+            handler()
+            eq_(len(retrieved), 1)
+
+            MONGO_CONNECTION._generation += 1
+
+            handler()
+            eq_(len(retrieved), 2)
+        finally:
+            MONGO_CONNECTION.get_collection = original_get_collection
+
+    def test_client_options(self):
+        """Check that the client is created with the options given"""
+
+        connection = MongoConnection("localhost", 27017, maxPoolSize=7, w=0)
+        try:
+            client = connection.connection
+            eq_(client.max_pool_size, 7)
+            eq_(client.write_concern.document, {'w': 0})
+        finally:
+            connection.close()
+
+    def test_server_selection_timeout(self):
+        """Check that an unavailable server is reported after the timeout"""
+
+        with override_settings(MONGO_CONNECT_TIMEOUT_MS=500):
+            connection = MongoConnection("localhost", 27017)
+            eq_(connection.client_options['serverSelectionTimeoutMS'], 500)
+
+            connection = MongoConnection("localhost", 27017,
+                                         serverSelectionTimeoutMS=100)
+            eq_(connection.client_options['serverSelectionTimeoutMS'], 100)
+
+            connection = MongoConnection(
+                "localhost", 27017,
+                uri="mongodb://localhost/?serverSelectionTimeoutMS=200")
+            ok_('serverSelectionTimeoutMS' not in connection.client_options)
+            eq_(connection.client_options['connectTimeoutMS'], 500)
+
+    def test_uri(self):
+        """Check that the URI takes precedence over the host and port"""
+
+        connection = MongoConnection("example.com", 1,
+                                     uri="mongodb://localhost:27017/?w=0")
+        try:
+            eq_(connection.connection.write_concern.document, {'w': 0})
+        finally:
+            connection.close()
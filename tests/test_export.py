@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the export of audit documents"""
+import csv
+from datetime import datetime, timedelta
+from decimal import Decimal
+import json
+import os
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from StringIO import StringIO
+
+from bson import ObjectId, decode_all
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from fixture.django_testcase import FixtureTestCase
+from nose.tools import eq_, ok_, raises
+
+from djangoaudit.export import (CSV_COLUMNS, EXPORT_BSON, EXPORT_CSV,
+                                AuditExport)
+from djangoaudit.models import AUDITING_COLLECTION, RETENTION_EXPIRE
+from djangoaudit.storage import get_storage_backend
+from tests.fixtures.sampledjango.bsg.models import *
+from tests.fixtures.sampledjango.bsg.fixtures import *
+from tests.utils import find_audit_documents
+
+
+@raises(ValueError)
+def test_unknown_format():
+    """Check that the export format is validated"""
+
+    AuditExport("xml")
+
+
+class TestAuditExport(FixtureTestCase):
+    """Tests for :class:`AuditExport`"""
+
+    datasets = [PilotData, VesselData]
+
+    def setUp(self):
+        Pilot(first_name="Brendan", last_name="Costanza", call_sign="Hot Dog",
+              age=25, craft=1, fastest_landing=Decimal("101.67")).save()
+        self.hot_dog = Pilot.objects.get(call_sign="Hot Dog")
+
+        self.hot_dog.age = 26
+        self.hot_dog.set_audit_info(operator="Adama", reason="Promotion")
+        self.hot_dog.save()
+
+    def tearDown(self):
+        if self.hot_dog.pk is not None:
+            self.hot_dog.delete()
+
+    def _export(self, export_format="jsonl", **filters):
+        output = StringIO()
+        exported = AuditExport(export_format, batch_size=1).export(
+            output, [Pilot], [self.hot_dog.pk], **filters)
+        return exported, output.getvalue()
+
+    def test_json(self):
+        """Check that the documents are exported as lines of JSON"""
+
+        exported, output = self._export()
+        documents = [json.loads(line) for line in output.splitlines()]
+
+        eq_(exported, 2)
+        eq_(len(documents), 2)
+        eq_(documents[0]['age'], 25)
+        eq_(documents[0]['fastest_landing'], "101.67")
+        eq_(documents[0]['object_pk'], self.hot_dog.pk)
+        eq_(documents[1]['age'], 26)
+        eq_(documents[1]['audit_operator'], "Adama")
+        eq_(documents[1]['reason'], "Promotion")
+        ok_('audit_checkpoint' not in documents[0])
+
+    def test_bson(self):
+        """Check that the documents are exported as recorded in BSON"""
+
+        exported, output = self._export(EXPORT_BSON)
+        documents = decode_all(output)
+
+        eq_(exported, 2)
+        eq_([document['age'] for document in documents], [25, 26])
+        eq_(documents[0]['fastest_landing'], 101.67)
+
+    def test_csv(self):
+        """Check that the documents are exported one row per field"""
+
+        Pilot.audit_record_old_values = True
+        try:
+            self.hot_dog.age = 27
+            self.hot_dog.save()
+        finally:
+            del Pilot.audit_record_old_values
+
+        exported, output = self._export(EXPORT_CSV)
+        rows = list(csv.reader(StringIO(output)))
+
+        eq_(exported, 3)
+        eq_(tuple(rows[0]), CSV_COLUMNS)
+
+        age_rows = [dict(zip(CSV_COLUMNS, row)) for row in rows[1:] if
+                    row[CSV_COLUMNS.index('field')] == "age"]
+        eq_([(row['old_value'], row['value']) for row in age_rows],
+            [("", "25"), ("", "26"), ("26", "27")])
+        eq_(age_rows[1]['audit_operator'], "Adama")
+        eq_(age_rows[1]['object_pk'], str(self.hot_dog.pk))
+        ok_("reason" in [row[CSV_COLUMNS.index('field')] for row in rows])
+
+    def test_csv_metadata(self):
+        """Check that the keys which aren't model fields aren't exported"""
+
+        Pilot.audit_retention_days = 30
+        Pilot.audit_retention_policy = RETENTION_EXPIRE
+        try:
+            self.hot_dog.age = 27
+            self.hot_dog.save()
+        finally:
+            del Pilot.audit_retention_days
+            del Pilot.audit_retention_policy
+
+        # The last document as restored from an archive:
+        document = find_audit_documents(AUDITING_COLLECTION, object_app="bsg",
+                                        object_model="Pilot",
+                                        object_pk=self.hot_dog.pk)[-1]
+        document.update(_id=ObjectId(), audit_restored_at=datetime.utcnow())
+        get_storage_backend().insert(AUDITING_COLLECTION, document)
+
+        exported, output = self._export(EXPORT_CSV)
+        fields = [row[CSV_COLUMNS.index('field')] for row in
+                  csv.reader(StringIO(output))]
+
+        eq_(exported, 4)
+        ok_('audit_expires_at' not in fields)
+        ok_('audit_restored_at' not in fields)
+        ok_('reason' in fields)
+
+    def test_filters(self):
+        """Check that the documents are filtered by operator and time"""
+
+        eq_(self._export(operator="Adama")[0], 1)
+        eq_(self._export(operator="Starbuck")[0], 0)
+
+        now = datetime.utcnow()
+        eq_(self._export(since=now - timedelta(hours=1))[0], 2)
+        eq_(self._export(since=now + timedelta(hours=1))[0], 0)
+        eq_(self._export(until=now - timedelta(hours=1))[0], 0)
+
+    def test_progress(self):
+        """Check that the progress is reported once the export is complete"""
+
+        reports = []
+        export = AuditExport(progress_callback=lambda *args:
+                             reports.append(args))
+        export.export(StringIO(), [Pilot], [self.hot_dog.pk])
+
+        eq_(len(reports), 1)
+        eq_(reports[0][0], 2)
+
+    def test_command(self):
+        """Check the management command to export the documents"""
+
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command('audit_export', models=["bsg.Pilot"],
+                     pks=[str(self.hot_dog.pk)], operator="Adama",
+                     stdout=stdout, stderr=stderr)
+
+        eq_([json.loads(line)['age'] for line in
+             stdout.getvalue().splitlines()], [26])
+        ok_(stderr.getvalue().startswith("Exported 1 documents in "))
+
+    @raises(CommandError)
+    def test_command_pk_without_model(self):
+        """Check that primary keys can only be given with a single model"""
+
+        call_command('audit_export', apps=["bsg"], pks=["1"],
+                     stdout=StringIO(), stderr=StringIO())
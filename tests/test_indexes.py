@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the indexes on the auditing collection"""
+import os
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from StringIO import StringIO
+
+from django.core.management import call_command
+from nose.tools import eq_, ok_
+
+from djangoaudit.connection import MONGO_CONNECTION
+from djangoaudit.indexes import (AUDIT_INDEXES, ensure_indexes,
+                                 explain_read_queries, _get_plan_stages)
+from tests.utils import skip_unless_mongo_storage
+
+
+class TestIndexes(object):
+    """Tests for :func:`ensure_indexes` and :func:`explain_read_queries`"""
+    
+    def setup(self):
+        skip_unless_mongo_storage()
+        
+        self.auditing_collection = MONGO_CONNECTION.get_collection("audit_data")
+        self.index_names = [index['name'] for index in AUDIT_INDEXES]
+    
+    def test_ensure_indexes(self):
+        """Check that missing indexes are created and existing ones reported"""
+        
+        report = ensure_indexes(self.auditing_collection)
+        eq_(report, [(name, True) for name in self.index_names])
+        
+        existing_indexes = self.auditing_collection.index_information()
+        for name in self.index_names:
+            ok_(name in existing_indexes, "Index %s was not created" % name)
+        
+        report = ensure_indexes(self.auditing_collection)
+        eq_(report, [(name, False) for name in self.index_names])
+    
+    def test_read_queries_use_indexes(self):
+        """Check that none of the read methods scan the whole collection"""
+        
+        ensure_indexes(self.auditing_collection)
+        
+        for name, index_names in explain_read_queries(self.auditing_collection):
+            ok_(index_names, "The query for %s doesn't use an index" % name)
+    
+    def test_command(self):
+        """Check that the management command reports on each index"""
+        
+        stdout = StringIO()
+        call_command('audit_ensure_indexes', skip_explain=True, stdout=stdout)
+        
+        eq_(stdout.getvalue().splitlines(),
+            ["Created index %s" % name for name in self.index_names])
+
+
+class TestGetPlanStages(object):
+    """Tests for :func:`_get_plan_stages`"""
+    
+    def test_nested_stages(self):
+        """Check that the stages are found through all the inputs of a plan"""
+        
+        plan = {'stage': 'FETCH',
+                'inputStage': {'stage': 'OR',
+                               'inputStages': [
+                                   {'stage': 'IXSCAN', 'indexName': 'a'},
+                                   {'stage': 'IXSCAN', 'indexName': 'b'},
+                                   ]}}
+        
+        eq_(_get_plan_stages(plan), [('FETCH', None), ('OR', None),
+                                     ('IXSCAN', 'a'), ('IXSCAN', 'b')])
+    
+    def test_collection_scan(self):
+        """Check that no index is reported for a collection scan"""
+        
+        eq_(_get_plan_stages({'stage': 'COLLSCAN'}), [('COLLSCAN', None)])
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the instrumentation of the auditing of changes"""
+from decimal import Decimal
+import os
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from django.test.utils import override_settings
+from fixture.django_testcase import FixtureTestCase
+from nose.tools import eq_, ok_
+from pymongo.errors import OperationFailure
+
+import djangoaudit
+from djangoaudit.connection import MongoConnectionError
+from djangoaudit.instrumentation import CallbackStatsSink, MemoryStatsSink
+from djangoaudit.schema import SCHEMA_COMPACT
+from djangoaudit.storage import MONGO_STORAGE
+from djangoaudit.writer import insert_documents
+from tests.fixtures.sampledjango.bsg.models import *
+from tests.fixtures.sampledjango.bsg.fixtures import *
+from tests.utils import requires_mongo_storage
+
+
+class _RecordingSink(object):
+    """Sink recording everything it is given"""
+
+    def __init__(self):
+        self.timings = []
+        self.increments = []
+
+    def timing(self, name, seconds):
+        self.timings.append(name)
+
+    def increment(self, name, count=1):
+        self.increments.append((name, count))
+
+
+class _BrokenCollectionHandler(object):
+    """Collection handler whose inserts fail with ``error``"""
+
+    collection_name = "broken"
+
+    def __init__(self, error):
+        self.error = error
+
+    def __call__(self):
+        return self
+
+    def insert_many(self, documents, ordered=True):
+        raise self.error
+
+
+class TestMemoryStatsSink(object):
+    """Tests for :class:`MemoryStatsSink`"""
+
+    def test_snapshot(self):
+        """Check that the timings are summarised and the counters added up"""
+
+        sink = MemoryStatsSink(slow_audits_kept=1)
+        sink.timing("diff", 0.25)
+        sink.timing("diff", 0.75)
+        sink.increment("documents_written")
+        sink.increment("documents_written", 2)
+        sink.add_slow_audit("bsg.Pilot", 1, "save", 2.0)
+        sink.add_slow_audit("bsg.Pilot", 2, "save", 3.0)
+
+        snapshot = sink.snapshot()
+        eq_(snapshot['counters'], {'documents_written': 3})
+        eq_(snapshot['timings'], {'diff': dict(count=2, total_seconds=1.0,
+                                               mean_seconds=0.5,
+                                               max_seconds=0.75)})
+        eq_([audit['pk'] for audit in snapshot['slow_audits']], [2])
+
+        sink.reset()
+        eq_(sink.snapshot(),
+            dict(counters={}, timings={}, slow_audits=[]))
+
+
+def test_callback_sink():
+    """Check that the callback sink reports milliseconds under a prefix"""
+
+    calls = []
+    sink = CallbackStatsSink(lambda *args: calls.append(args),
+                             lambda *args: calls.append(args))
+    sink.timing("insert", 0.5)
+    sink.increment("documents_written", 2)
+
+    eq_(calls, [("djangoaudit.insert", 500.0),
+                ("djangoaudit.documents_written", 2)])
+
+
+class TestInstrumentation(FixtureTestCase):
+    """Tests for the measurements of the auditing of saves and deletions"""
+
+    datasets = [PilotData, VesselData]
+
+    def setUp(self):
+        self.sink = _RecordingSink()
+        self.settings = override_settings(AUDIT_INSTRUMENTATION=True,
+                                          AUDIT_STATS_SINKS=[self.sink])
+        self.settings.enable()
+        djangoaudit.reset_stats()
+
+        self.pilot = Pilot.objects.get(call_sign="Apollo")
+
+    def tearDown(self):
+        self.settings.disable()
+        djangoaudit.reset_stats()
+
+    def test_save(self):
+        """Check that each phase of a save is timed"""
+
+        self.pilot.age += 1
+        self.pilot.save()
+
+        stats = djangoaudit.stats()
+        eq_(sorted(stats['timings']),
+            ["coercion", "diff", "insert", "snapshot"])
+        eq_(stats['timings']['insert']['count'], 1)
+        eq_(stats['counters'], {'documents_written': 1})
+        eq_(sorted(self.sink.timings),
+            ["coercion", "diff", "insert", "snapshot"])
+        eq_(self.sink.increments, [("documents_written", 1)])
+
+    @requires_mongo_storage
+    def test_checkpoint_and_encoding(self):
+        """Check that checkpoints and the compact schema are timed apart"""
+
+        Pilot.audit_checkpoint_interval = 50
+        Pilot.audit_schema = SCHEMA_COMPACT
+        try:
+            self.pilot.age += 1
+            self.pilot.save()
+        finally:
+            del Pilot.audit_checkpoint_interval
+            del Pilot.audit_schema
+
+        eq_(sorted(djangoaudit.stats()['timings']),
+            ["checkpoint", "coercion", "diff", "encoding", "insert",
+             "snapshot"])
+
+    def test_skipped(self):
+        """Check that the saves without changes are counted"""
+
+        self.pilot.save()
+        self.pilot.craft = 1 - self.pilot.craft
+        self.pilot.save()
+
+        eq_(djangoaudit.stats()['counters'], {'saves_skipped': 2})
+
+    def test_bulk(self):
+        """Check that the documents written in bulk are counted"""
+
+        Pilot.objects.filter(craft=0).update(age=40)
+
+        stats = djangoaudit.stats()
+        eq_(stats['counters']['documents_written'],
+            Pilot.objects.filter(craft=0).count())
+        eq_(stats['timings']['insert']['count'], 1)
+
+    @override_settings(AUDIT_STORAGE_BACKEND=MONGO_STORAGE)
+    def test_failures(self):
+        """Check that the failed writes are counted"""
+
+        insert_documents([
+            (_BrokenCollectionHandler(OperationFailure("denied")), {'n': 1}),
+            (_BrokenCollectionHandler(MongoConnectionError("down")),
+             {'n': 2}),
+            ])
+
+        eq_(djangoaudit.stats()['counters'],
+            {'write_failures': 1, 'mongo_unavailable': 1})
+
+    def test_slow_audit(self):
+        """Check that the audits over the threshold are reported"""
+
+        with override_settings(AUDIT_SLOW_THRESHOLD=0):
+            self.pilot.age += 1
+            self.pilot.save()
+            self.pilot.delete()
+
+        stats = djangoaudit.stats()
+        eq_(stats['counters']['slow_audits'], 2)
+        eq_([(audit['model'], audit['operation']) for audit in
+             stats['slow_audits']],
+            [("bsg.Pilot", "save"), ("bsg.Pilot", "delete")])
+        ok_(stats['slow_audits'][0]['seconds'] >= 0)
+
+    def test_broken_sink(self):
+        """Check that a failing sink doesn't break the save"""
+
+        with override_settings(AUDIT_STATS_SINKS=[object()]):
+            self.pilot.age += 1
+            self.pilot.save()
+
+        eq_(djangoaudit.stats()['counters'], {'documents_written': 1})
+
+    def test_disabled(self):
+        """Check that nothing is measured unless enabled"""
+
+        with override_settings(AUDIT_INSTRUMENTATION=False):
+            self.pilot.age += 1
+            self.pilot.save()
+
+        eq_(djangoaudit.stats(),
+            dict(counters={}, timings={}, slow_audits=[]))
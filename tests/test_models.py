@@ -18,12 +18,16 @@
 from datetime import datetime, timedelta, date
 from decimal import Decimal
 import os
+from StringIO import StringIO
 
 # Have to set this here to ensure this is Django-like
 os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
 
 from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
 from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext, override_settings
 from nose.tools import (eq_, ok_, assert_false, assert_not_equal, assert_raises,
                         raises)
 from pymongo.errors import PyMongoError
@@ -32,10 +36,20 @@ from fixture.django_testcase import FixtureTestCase
 
 #from mongofixture import MongoFixtureTestCase
 from djangoaudit.models import (_coerce_data_to_model_types, _audit_model, 
-                                _coerce_to_bson_compatible, AuditedModel)
-from djangoaudit.connection import MONGO_CONNECTION
+                                _coerce_to_bson_compatible, AuditedModel,
+                                register_bson_coercion, get_audit_log_cursor,
+                                AUDITING_COLLECTION, _get_params_from_model,
+                                _CHECKPOINT_COUNTERS, _get_collection_handler,
+                                get_audit_collection_names,
+                                SNAPSHOT_QUERY, SNAPSHOT_LOAD,
+                                SNAPSHOT_LAST_AUDIT)
+from djangoaudit.batching import audit_batch
+from djangoaudit.connection import MONGO_CONNECTION, CircuitBreaker
+from djangoaudit.storage import get_storage_backend
 from tests.fixtures.sampledjango.bsg.models import *
 from tests.fixtures.sampledjango.bsg.fixtures import *
+from tests.utils import (drop_audit_collection, find_audit_documents,
+                         requires_mongo_storage)
 
 
 class TestEnsureBSONCompatible(object):
@@ -62,6 +76,43 @@ class TestEnsureBSONCompatible(object):
             (expected, got))
 
 
+    def test_datetime_unchanged(self):
+        """Ensure that :class:`datetime` is left as it is"""
+        
+        value = datetime(2001, 9, 11, 8, 46)
+        got = _coerce_to_bson_compatible(value)
+        
+        ok_(got is value, "Expected %r to be left as it is, got %r" %
+            (value, got))
+        
+    def test_model_to_string(self):
+        """Ensure that models are converted to strings"""
+        
+        got = _coerce_to_bson_compatible(Pilot(call_sign="Boomer"))
+        
+        eq_(got, "Boomer")
+        
+    def test_registered_coercion(self):
+        """Ensure that registered converters apply to subclasses too"""
+        
+        class Rank(object):
+            def __init__(self, name):
+                self.name = name
+                
+        class CommissionedRank(Rank):
+            pass
+        
+        register_bson_coercion(Rank, lambda rank: rank.name)
+        
+        eq_(_coerce_to_bson_compatible(Rank("Lieutenant")), "Lieutenant")
+        eq_(_coerce_to_bson_compatible(CommissionedRank("Major")), "Major")
+        
+        # Registering a more specific type takes precedence:
+        register_bson_coercion(CommissionedRank, lambda rank: rank.name.upper())
+        
+        eq_(_coerce_to_bson_compatible(CommissionedRank("Major")), "MAJOR")
+
+
 class MockModelMeta(object):
     """ Mock of :class:`django.db.options.Options` """
     
@@ -83,14 +134,11 @@ class TestAuditModel(object):
     
     
     def setup(self):
-        self.audit_collection_name = "audit_data"
-        self.auditing_collection = MONGO_CONNECTION\
-            .get_collection(self.audit_collection_name)
         self.profile = MockModel("profiles", "Profile", 123)
                 
     def fetch_record_by_id(self, id):
         
-        return self.auditing_collection.find_one({"_id":id})
+        return find_audit_documents(AUDITING_COLLECTION, _id=id)[0]
     
     def test_no_changes_empty_dicts(self):
         """Check that passing two empty value dicts results in a no-op"""
@@ -270,11 +318,6 @@ class TestAuditedModel(FixtureTestCase):
     datasets = [PilotData, VesselData]
     
     def setUp(self):
-        self.audit_collection_name = "audit_data"
-        
-        self.auditing_collection = MONGO_CONNECTION\
-            .get_collection(self.audit_collection_name)
-            
         # Now set up the records:
         self.helo = Pilot.objects.filter(call_sign="Helo")[0] # wtf - no idea why fixture seems to be putting two of these in the DB
         self.athena = Pilot.objects.get(call_sign="Athena")
@@ -597,10 +640,9 @@ class TestAuditedModel(FixtureTestCase):
              (initial_log, creation_log))
         
         # Test that fail gracefully when no creation log exists:
-        for item in hot_dog.get_audit_log():
-            self.auditing_collection.remove(item['_id'])
+        unaudited = Pilot(pk=hot_dog.pk + 1)
         
-        empty_log = hot_dog.get_creation_log()
+        empty_log = unaudited.get_creation_log()
         
         eq_(empty_log, None, "The creation log should be None")
         
@@ -633,4 +675,671 @@ class TestAuditedModel(FixtureTestCase):
         
         eq_(pre_delete_data, entry,
             "Expected to find deletion log as: %r, got %r" % 
-            (pre_delete_data, entry))
\ No newline at end of file
+            (pre_delete_data, entry))
+
+class TestSnapshotStrategies(FixtureTestCase):
+    """Tests for the snapshot strategies of AuditedModel"""
+    
+    datasets = [PilotData, VesselData]
+    
+    def setUp(self):
+        self.original_strategy = Pilot.audit_snapshot
+        self.original_interval = Pilot.audit_checkpoint_interval
+        
+    def tearDown(self):
+        Pilot.audit_snapshot = self.original_strategy
+        Pilot.audit_checkpoint_interval = self.original_interval
+    
+    def _update_hot_dog(self, strategy):
+        """
+        Create a pilot and update its age twice under ``strategy``, returning
+        the number of queries the last save took
+        
+        """
+        Pilot.audit_snapshot = strategy
+        Pilot(first_name="Brendan", last_name="Costanza", call_sign="Hot Dog",
+              age=25, craft=1, fastest_landing=Decimal("101.67")).save()
+        hot_dog = Pilot.objects.get(call_sign="Hot Dog")
+        
+        hot_dog.age = 40
+        hot_dog.save()
+        
+        hot_dog.age = 30
+        with CaptureQueriesContext(connection) as queries:
+            hot_dog.save()
+        
+        log = list(hot_dog.get_audit_log())
+        eq_([entry['audit_changes'] for entry in log[1:]],
+            [{'age': (25, 40)}, {'age': (40, 30)}])
+        
+        hot_dog.delete()
+        
+        return len(queries)
+    
+    @raises(AttributeError)
+    def test_unknown_strategy(self):
+        """Check that unknown snapshot strategies are rejected"""
+        
+        class NaughtyAuditedModel(AuditedModel):
+            audit_snapshot = 'guess'
+    
+    def test_query(self):
+        """Check that the query strategy reads the initial values back"""
+        
+        num_queries = self._update_hot_dog(SNAPSHOT_QUERY)
+        
+        eq_(num_queries, self._update_hot_dog(SNAPSHOT_LOAD) + 1)
+    
+    def test_load(self):
+        """Check that the load strategy avoids the query before the save"""
+        
+        Pilot.audit_snapshot = SNAPSHOT_LOAD
+        athena = Pilot.objects.get(call_sign="Athena")
+        
+        athena.age = 40
+        with CaptureQueriesContext(connection) as queries:
+            athena.save()
+        
+        ok_(not [query for query in queries.captured_queries
+                 if query['sql'].startswith('SELECT')],
+            "No SELECT should be made when saving, got %r" %
+            queries.captured_queries)
+    
+    def test_last_audit(self):
+        """Check that the last audit strategy avoids the query before the save"""
+        
+        Pilot.audit_checkpoint_interval = 50
+        num_queries = self._update_hot_dog(SNAPSHOT_LAST_AUDIT)
+        
+        eq_(num_queries, self._update_hot_dog(SNAPSHOT_LOAD))
+    
+    def test_last_audit_without_checkpoints(self):
+        """
+        Check that the last audit strategy queries the database when there are
+        no checkpoints to read the state from
+        
+        """
+        
+        num_queries = self._update_hot_dog(SNAPSHOT_LAST_AUDIT)
+        
+        eq_(num_queries, self._update_hot_dog(SNAPSHOT_QUERY))
+    
+    def test_last_audit_in_batch(self):
+        """
+        Check that the last audit strategy doesn't miss the changes held back
+        in a batch
+        
+        """
+        
+        Pilot.audit_checkpoint_interval = 50
+        Pilot.audit_snapshot = SNAPSHOT_LAST_AUDIT
+        Pilot(first_name="Brendan", last_name="Costanza", call_sign="Hot Dog",
+              age=25, craft=1, fastest_landing=Decimal("101.67")).save()
+        hot_dog = Pilot.objects.get(call_sign="Hot Dog")
+        
+        with audit_batch():
+            hot_dog.age = 40
+            hot_dog.save()
+            hot_dog.age = 25
+            hot_dog.save()
+        
+        log = list(hot_dog.get_audit_log())
+        eq_([entry['audit_changes'] for entry in log[1:]],
+            [{'age': (25, 40)}, {'age': (40, 25)}])
+        
+        hot_dog.delete()
+
+
+class TestAuditedQuerySet(FixtureTestCase):
+    """Tests for the bulk operations of AuditedQuerySet"""
+    
+    datasets = [PilotData, VesselData, PatrolData]
+    
+    def test_update(self):
+        """Check that each row changed by update() is audited"""
+        
+        pilots = Pilot.objects.filter(call_sign__in=["Apollo", "Starbuck"])
+        rows = pilots.set_audit_info(operator="me").update(age=50)
+        
+        eq_(rows, 2)
+        
+        for call_sign in ("Apollo", "Starbuck"):
+            pilot = Pilot.objects.get(call_sign=call_sign)
+            entry = list(pilot.get_audit_log())[-1]
+            
+            eq_(entry['audit_changes'].keys(), ['age'])
+            eq_(entry['audit_changes']['age'][1], 50)
+            eq_(entry['audit_operator'], "me")
+    
+    def test_update_related(self):
+        """
+        Check that related objects changed by update() are recorded as they
+        are by save()
+        
+        """
+        
+        patrol = Patrol.objects.get(name=PatrolData.CombatAirPatrol.name)
+        apollo = Pilot.objects.get(call_sign="Apollo")
+        
+        Patrol.objects.filter(pk=patrol.pk).update(pilot=apollo)
+        
+        entry = list(patrol.get_audit_log())[-1]
+        eq_(entry['audit_changes'].keys(), ['pilot'])
+        eq_(entry['audit_changes']['pilot'][1], "Apollo")
+        eq_(patrol.get_state_at()['pilot'], apollo.pk)
+        
+        Patrol.objects.filter(pk=patrol.pk).update(name="Dawn Patrol")
+        
+        entry = list(patrol.get_audit_log())[-1]
+        eq_(entry['audit_changes'].keys(), ['name'])
+        eq_(patrol.get_state_at()['pilot'], apollo.pk)
+    
+    @raises(ValueError)
+    def test_bulk_create_without_pks(self):
+        """Check that objects which couldn't be audited aren't created"""
+        
+        Pilot.objects.bulk_create([
+            Pilot(first_name="Brendan", last_name="Costanza",
+                  call_sign="Hot Dog", age=25, craft=1,
+                  fastest_landing=Decimal("101.67"))])
+    
+    def test_update_no_changes(self):
+        """Check that rows which update() doesn't change aren't audited"""
+        
+        apollo = Pilot.objects.get(call_sign="Apollo")
+        num_log_items = len(list(apollo.get_audit_log()))
+        
+        Pilot.objects.filter(pk=apollo.pk).update(age=apollo.age, craft=1)
+        
+        eq_(len(list(apollo.get_audit_log())), num_log_items)
+    
+    def test_delete(self):
+        """Check that each row removed by delete() is audited like delete()"""
+        
+        starbuck = Pilot.objects.get(call_sign="Starbuck")
+        
+        Pilot.objects.filter(pk=starbuck.pk).set_audit_info(notes="Bulk")\
+                     .delete()
+        
+        eq_(Pilot.objects.filter(pk=starbuck.pk).count(), 0)
+        
+        log = list(Pilot.get_deleted_log(starbuck.pk))
+        eq_(len(log), 1)
+        
+        entry = log[0]
+        for field in Pilot.log_fields:
+            eq_(entry[field], getattr(PilotData.Starbuck, field))
+        
+        ok_(entry['audit_is_delete'])
+        eq_(entry['audit_notes'], "Object deleted. These are the attributes "
+            "at delete time.\nBulk")
+    
+    def test_bulk_create(self):
+        """Check that objects created by bulk_create() are audited"""
+        
+        params = dict(first_name="Brendan",
+                      last_name="Costanza",
+                      call_sign="Hot Dog",
+                      age=25,
+                      last_flight=datetime(2000, 6, 4, 23, 01),
+                      craft=1,
+                      is_cylon=False,
+                      fastest_landing=Decimal("101.67"))
+        
+        Pilot.objects.bulk_create([Pilot(pk=1000, **params)])
+        
+        hot_dog = Pilot.objects.get(pk=1000)
+        creation_log = hot_dog.get_creation_log()
+        
+        for field in Pilot.log_fields:
+            eq_(creation_log[field], params[field])
+
+
+class TestAuditLogQueries(FixtureTestCase):
+    """Tests for the windows, pages and fields of get_audit_log()"""
+    
+    datasets = [PilotData, VesselData]
+    
+    def setUp(self):
+        # A pilot whose history is recorded a day apart, without a row:
+        self.hot_dog = Pilot(pk=1000, first_name="Brendan",
+                             last_name="Costanza", call_sign="Hot Dog",
+                             age=25, craft=1,
+                             fastest_landing=Decimal("101.67"))
+        
+        params = _get_params_from_model(self.hot_dog)
+        storage = get_storage_backend()
+        
+        self.start = datetime(2000, 1, 1)
+        changes = [dict(age=25, call_sign="Hot Dog"),
+                   dict(age=26),
+                   dict(call_sign="Hotter Dog"),
+                   dict(age=27),
+                   dict(age=28, call_sign="Hottest Dog")]
+        for day, change in enumerate(changes):
+            document = dict(params, **change)
+            document['audit_date_stamp'] = self.start + timedelta(days=day)
+            storage.insert(AUDITING_COLLECTION, document)
+    
+    def _get_changes(self, **kwargs):
+        return [entry.get('audit_changes') for entry in
+                self.hot_dog.get_audit_log(**kwargs)]
+    
+    def test_sorted(self):
+        """Check that the entries are in the order they were recorded"""
+        
+        log = list(self.hot_dog.get_audit_log())
+        
+        eq_([entry['audit_date_stamp'] for entry in log],
+            [self.start + timedelta(days=day) for day in range(5)])
+        eq_(log[1]['audit_changes'], {'age': (25, 26)})
+    
+    def test_window(self):
+        """Check that since is inclusive and until is exclusive"""
+        
+        changes = self._get_changes(since=self.start + timedelta(days=1),
+                                    until=self.start + timedelta(days=3))
+        
+        eq_(changes, [{'age': (25, 26)},
+                      {'call_sign': ("Hot Dog", "Hotter Dog")}])
+    
+    def test_pages(self):
+        """Check that the log can be read a page at a time"""
+        
+        first_page = list(self.hot_dog.get_audit_log(limit=2))
+        eq_(len(first_page), 2)
+        
+        after = get_audit_log_cursor(first_page[-1])
+        second_page = self._get_changes(after=after, limit=2)
+        
+        eq_(second_page, [{'call_sign': ("Hot Dog", "Hotter Dog")},
+                          {'age': (26, 27)}])
+    
+    @raises(ValueError)
+    def test_invalid_cursor(self):
+        """Check that invalid cursors are rejected"""
+        
+        list(self.hot_dog.get_audit_log(after="yesterday"))
+    
+    def test_fields(self):
+        """Check that only the entries which change the fields are included"""
+        
+        log = list(self.hot_dog.get_audit_log(fields=['call_sign']))
+        
+        eq_([entry['audit_changes'] for entry in log],
+            [{'call_sign': (None, "Hot Dog")},
+             {'call_sign': ("Hot Dog", "Hotter Dog")},
+             {'call_sign': ("Hotter Dog", "Hottest Dog")}])
+        ok_('age' not in log[-1])
+    
+    @raises(ValueError)
+    def test_unknown_fields(self):
+        """Check that fields which aren't log fields are rejected"""
+        
+        list(self.hot_dog.get_audit_log(fields=['craft']))
+
+
+class TestAuditWriteConcern(object):
+    """Tests for the write concern of the audit documents of a model"""
+    
+    def test_default(self):
+        """Check that models use the write concern of the client by default"""
+        
+        ok_(Pilot._audit_collection is AUDITING_COLLECTION)
+    
+    def test_override(self):
+        """Check that models can declare their own write concern"""
+        
+        class Clickstream(AuditedModel):
+            audit_write_concern = {'w': 0}
+            
+            class Meta:
+                abstract = True
+        
+        class OtherClickstream(AuditedModel):
+            audit_write_concern = {'w': 0}
+            
+            class Meta:
+                abstract = True
+        
+        handler = Clickstream._audit_collection
+        ok_(handler is not AUDITING_COLLECTION)
+        ok_(handler is OtherClickstream._audit_collection)
+        eq_(handler.collection_name, AUDITING_COLLECTION.collection_name)
+        eq_(handler().write_concern.document, {'w': 0})
+    
+    @raises(AttributeError)
+    def test_invalid(self):
+        """Check that invalid write concerns are rejected"""
+        
+        class NaughtyAuditedModel(AuditedModel):
+            audit_write_concern = {'w': 'majority', 'wtimeout': 'soon'}
+            
+            class Meta:
+                abstract = True
+
+
+class TestAuditCollection(FixtureTestCase):
+    """Tests for the routing of the audit documents of a model"""
+    
+    datasets = [PilotData, VesselData]
+    
+    def setUp(self):
+        self.original_collection = Pilot._audit_collection
+        Pilot._audit_collection = _get_collection_handler("audit_pilots")
+    
+    def tearDown(self):
+        Pilot._audit_collection = self.original_collection
+        drop_audit_collection("audit_pilots")
+    
+    def test_declared(self):
+        """Check that models can declare their own collection"""
+        
+        class Clickstream(AuditedModel):
+            audit_collection = "audit_clickstream"
+            audit_write_concern = {'w': 0}
+            
+            class Meta:
+                abstract = True
+        
+        handler = Clickstream._audit_collection
+        eq_(handler.collection_name, "audit_clickstream")
+        eq_(handler.write_concern, {'w': 0})
+    
+    def test_setting(self):
+        """Check that the AUDIT_COLLECTIONS setting takes precedence"""
+        
+        with override_settings(AUDIT_COLLECTIONS={'bsg.Clickstream':
+                                                  "audit_clicks"}):
+            class Clickstream(AuditedModel):
+                audit_collection = "audit_clickstream"
+                
+                class Meta:
+                    abstract = True
+                    app_label = 'bsg'
+        
+        eq_(Clickstream._audit_collection.collection_name, "audit_clicks")
+    
+    def test_reads_and_writes(self):
+        """Check that the audit documents are written to and read from the
+        collection of the model"""
+        
+        Pilot(first_name="Brendan", last_name="Costanza", call_sign="Hot Dog",
+              age=25, craft=1, fastest_landing=Decimal("101.67")).save()
+        hot_dog = Pilot.objects.get(call_sign="Hot Dog")
+        hot_dog.age = 26
+        hot_dog.save()
+        
+        query = _get_params_from_model(hot_dog)
+        eq_(len(find_audit_documents(Pilot._audit_collection, **query)), 2)
+        eq_(len(find_audit_documents(AUDITING_COLLECTION, **query)), 0)
+        
+        eq_([entry['audit_changes']['age'] for entry in
+             hot_dog.get_audit_log()], [(None, 25), (25, 26)])
+        eq_(hot_dog.get_creation_log()['age'], 25)
+        
+        hot_dog.delete()
+        eq_(len(list(Pilot.get_deleted_log(hot_dog.pk))), 1)
+    
+    @requires_mongo_storage
+    def test_indexes(self):
+        """Check that the indexes are created on the collection of each
+        model"""
+        
+        eq_(get_audit_collection_names(), ["audit_data", "audit_pilots"])
+        
+        call_command('audit_ensure_indexes', skip_explain=True,
+                     stdout=StringIO())
+        
+        collection = MONGO_CONNECTION.get_collection("audit_pilots")
+        ok_('audit_object_history' in collection.index_information())
+
+
+class TestCheckpoints(FixtureTestCase):
+    """Tests for the checkpoints of the state of audited instances"""
+    
+    datasets = [PilotData, VesselData]
+    
+    def setUp(self):
+        Pilot.audit_checkpoint_interval = 2
+        _CHECKPOINT_COUNTERS.clear()
+        
+        Pilot(first_name="Brendan", last_name="Costanza", call_sign="Hot Dog",
+              age=25, craft=1, fastest_landing=Decimal("101.67")).save()
+        self.hot_dog = Pilot.objects.get(call_sign="Hot Dog")
+        
+        # Record the time after each change:
+        self.times = [datetime.utcnow()]
+        for age in (26, 27, 28, 29):
+            self.hot_dog.age = age
+            self.hot_dog.save()
+            self.times.append(datetime.utcnow())
+    
+    def tearDown(self):
+        del Pilot.audit_checkpoint_interval
+        _CHECKPOINT_COUNTERS.clear()
+        self.hot_dog.delete()
+    
+    def _get_documents(self):
+        return find_audit_documents(AUDITING_COLLECTION,
+                                    **_get_params_from_model(self.hot_dog))
+    
+    def test_interval(self):
+        """Check that every other change records the full state"""
+        
+        documents = self._get_documents()
+        
+        eq_(['audit_checkpoint' in document for document in documents],
+            [False, False, True, False, True])
+        
+        checkpoint = documents[-1]['audit_checkpoint']
+        eq_(sorted(checkpoint), sorted(Pilot.log_fields))
+        eq_(checkpoint['age'], 29)
+        eq_(checkpoint['call_sign'], "Hot Dog")
+    
+    def test_counters_read_back(self):
+        """Check that the changes since the last checkpoint are read back"""
+        
+        _CHECKPOINT_COUNTERS.clear()
+        
+        self.hot_dog.age = 30
+        self.hot_dog.save()
+        
+        ok_('audit_checkpoint' not in self._get_documents()[-1])
+        
+        _CHECKPOINT_COUNTERS.clear()
+        
+        self.hot_dog.age = 31
+        self.hot_dog.save()
+        
+        ok_('audit_checkpoint' in self._get_documents()[-1])
+    
+    def test_get_state_at(self):
+        """Check that the state at each point in time is reconstructed"""
+        
+        for age, when in zip((25, 26, 27, 28, 29), self.times):
+            state = self.hot_dog.get_state_at(when)
+            eq_(state['age'], age)
+            eq_(state['fastest_landing'], Decimal("101.67"))
+        
+        eq_(self.hot_dog.get_state_at()['age'], 29)
+        eq_(self.hot_dog.get_state_at(datetime(2000, 1, 1)), None)
+    
+    def test_not_in_log(self):
+        """Check that checkpoints aren't reported in the audit log"""
+        
+        for entry in self.hot_dog.get_audit_log():
+            ok_('audit_checkpoint' not in entry)
+
+
+class TestPrefetchAuditLogs(FixtureTestCase):
+    """Tests for the prefetching of audit documents by querysets"""
+    
+    datasets = [PilotData, VesselData]
+    
+    def setUp(self):
+        for call_sign in ("Hot Dog", "Kat"):
+            Pilot(first_name="Brendan", last_name="Costanza",
+                  call_sign=call_sign, age=25, craft=1,
+                  fastest_landing=Decimal("101.67")).save()
+        
+        hot_dog = Pilot.objects.get(call_sign="Hot Dog")
+        hot_dog.age = 26
+        hot_dog.save()
+        
+        self.pilots = Pilot.objects.filter(call_sign__in=["Hot Dog", "Kat"])\
+                                   .order_by('call_sign')
+        self.original_breaker = MONGO_CONNECTION.breaker
+    
+    def tearDown(self):
+        MONGO_CONNECTION.breaker = self.original_breaker
+        self.pilots.delete()
+    
+    def _disconnect(self):
+        """Make any further query to MongoDB fail"""
+        
+        MONGO_CONNECTION.breaker = CircuitBreaker(failure_threshold=1,
+                                                  cool_down=60)
+        MONGO_CONNECTION.breaker.record_failure()
+    
+    def test_audit_logs(self):
+        """Check that the audit logs are read from the prefetched documents"""
+        
+        expected = dict((pilot.call_sign, list(pilot.get_audit_log())) for
+                        pilot in self.pilots)
+        
+        pilots = list(self.pilots.prefetch_audit_logs())
+        self._disconnect()
+        
+        for pilot in pilots:
+            eq_(list(pilot.get_audit_log()), expected[pilot.call_sign])
+            eq_(list(pilot.get_audit_log(limit=1)),
+                expected[pilot.call_sign][:1])
+            eq_(pilot.get_creation_log()['age'], 25)
+        
+        eq_(len(expected["Hot Dog"]), 2)
+        eq_(expected["Hot Dog"][1]['audit_changes']['age'], (25, 26))
+    
+    def test_creation_logs(self):
+        """Check that the creation logs are read from the prefetched documents"""
+        
+        pilots = list(self.pilots.prefetch_creation_logs())
+        self._disconnect()
+        
+        for pilot in pilots:
+            creation_log = pilot.get_creation_log()
+            eq_(creation_log['call_sign'], pilot.call_sign)
+            eq_(creation_log['age'], 25)
+            eq_(creation_log['fastest_landing'], Decimal("101.67"))
+    
+    def test_not_prefetched_after_save(self):
+        """Check that saving an instance discards its prefetched documents"""
+        
+        hot_dog = self.pilots.prefetch_audit_logs().get(call_sign="Hot Dog")
+        hot_dog.age = 27
+        hot_dog.save()
+        
+        eq_(len(list(hot_dog.get_audit_log())), 3)
+    
+    @requires_mongo_storage
+    def test_unavailable(self):
+        """Check that the queryset is still evaluated if MongoDB is down"""
+        
+        self._disconnect()
+        
+        pilots = list(self.pilots.prefetch_audit_logs())
+        
+        eq_([pilot.call_sign for pilot in pilots], ["Hot Dog", "Kat"])
+        ok_(pilots[0]._prefetched_audit_documents is None)
+
+
+class TestOldValues(FixtureTestCase):
+    """Tests for the documents recording the values before each change"""
+    
+    datasets = [PilotData, VesselData]
+    
+    def setUp(self):
+        # Start the history without the old values:
+        Pilot(first_name="Brendan", last_name="Costanza", call_sign="Hot Dog",
+              age=25, craft=1, fastest_landing=Decimal("101.67")).save()
+        self.hot_dog = Pilot.objects.get(call_sign="Hot Dog")
+        
+        Pilot.audit_record_old_values = True
+        
+        for age in (26, 27):
+            self.hot_dog.age = age
+            self.hot_dog.save()
+        
+        self.hot_dog.call_sign = "Hotter Dog"
+        self.hot_dog.fastest_landing = Decimal("99.50")
+        self.hot_dog.save()
+    
+    def tearDown(self):
+        del Pilot.audit_record_old_values
+        if self.hot_dog.pk is not None:
+            self.hot_dog.delete()
+    
+    def _get_documents(self):
+        return find_audit_documents(AUDITING_COLLECTION,
+                                    **_get_params_from_model(self.hot_dog))
+    
+    def test_recorded(self):
+        """Check that the values before each change are recorded"""
+        
+        documents = self._get_documents()
+        
+        ok_('audit_old_values' not in documents[0])
+        eq_(documents[1]['audit_old_values'], {'age': 25})
+        eq_(documents[3]['audit_old_values'],
+            {'call_sign': "Hot Dog", 'fastest_landing': 101.67})
+    
+    def test_creation(self):
+        """Check that the values of a new instance are recorded as changes"""
+        
+        Pilot(first_name="Sharon", last_name="Valerii", call_sign="Boomer",
+              age=24, craft=1, fastest_landing=Decimal("98.20")).save()
+        boomer = Pilot.objects.get(call_sign="Boomer")
+        
+        document = find_audit_documents(AUDITING_COLLECTION,
+                                        **_get_params_from_model(boomer))[0]
+        eq_(document['audit_old_values'], {})
+        eq_(list(boomer.get_audit_log())[0]['audit_changes']['age'],
+            (None, 24))
+        
+        boomer.delete()
+    
+    def test_page_read_on_its_own(self):
+        """Check that a page of entries doesn't read the documents before it"""
+        
+        first_page = list(self.hot_dog.get_audit_log(limit=2))
+        
+        def fail(*args, **kwargs):
+            raise AssertionError("The earlier documents were read")
+        self.hot_dog._get_values_before = fail
+        
+        second_page = list(self.hot_dog.get_audit_log(
+            after=get_audit_log_cursor(first_page[-1])))
+        
+        eq_([entry['audit_changes'] for entry in second_page],
+            [{'age': (26, 27)},
+             {'call_sign': ("Hot Dog", "Hotter Dog"),
+              'fastest_landing': (Decimal("101.67"), Decimal("99.50"))}])
+        ok_('audit_old_values' not in second_page[0])
+    
+    def test_legacy_documents(self):
+        """Check that the documents without old values are still reported"""
+        
+        log = list(self.hot_dog.get_audit_log(fields=['age']))
+        eq_([entry['audit_changes'] for entry in log],
+            [{'age': (None, 25)}, {'age': (25, 26)}, {'age': (26, 27)}])
+        
+    
+    def test_deletion(self):
+        """Check that deletions are recorded without the old values"""
+        
+        params = _get_params_from_model(self.hot_dog)
+        self.hot_dog.delete()
+        
+        document = find_audit_documents(AUDITING_COLLECTION,
+                                        audit_is_delete=True, **params)[0]
+        ok_('audit_old_values' not in document)
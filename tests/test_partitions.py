@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the monthly partitioning of the auditing collection"""
+from datetime import datetime
+from decimal import Decimal
+import os
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test.utils import override_settings
+from fixture.django_testcase import FixtureTestCase
+from nose.tools import eq_, ok_
+
+from djangoaudit import partitions
+from djangoaudit.connection import MONGO_CONNECTION
+from djangoaudit.indexes import AUDIT_INDEXES
+from djangoaudit.models import (AUDITING_COLLECTION, _INDEXED_PARTITIONS,
+                                _find_audit_documents, _write_audit_document,
+                                _write_audit_documents,
+                                _get_params_from_model)
+from djangoaudit.partitions import (get_partition_name, get_partition_names,
+                                    list_partitions, drop_partitions)
+from tests.fixtures.sampledjango.bsg.models import *
+from tests.fixtures.sampledjango.bsg.fixtures import *
+from tests.utils import skip_unless_mongo_storage
+
+
+def _drop_partitions():
+    database = MONGO_CONNECTION.get_collection("audit_data").database
+    for name in list_partitions("audit_data"):
+        database.drop_collection(name)
+
+    partitions._PARTITION_NAMES_CACHE.clear()
+    _INDEXED_PARTITIONS.clear()
+
+
+class PartitionedTestCase(object):
+    """Enable the partitioning for the duration of each test"""
+
+    def setup(self):
+        skip_unless_mongo_storage()
+
+        self.settings = override_settings(AUDIT_PARTITION_BY_MONTH=True)
+        self.settings.enable()
+        _drop_partitions()
+
+    def teardown(self):
+        _drop_partitions()
+        self.settings.disable()
+
+
+class TestPartitions(PartitionedTestCase):
+    """Tests for the writing and reading of partitioned audit documents"""
+
+    def _write(self, *months):
+        documents = [{'audit_date_stamp': datetime(2025, month, 1, 12),
+                      'n': number} for number, month in enumerate(months)]
+        _write_audit_documents(documents)
+        return documents
+
+    def test_routing(self):
+        """Check that documents are written to the partition for their month"""
+
+        _write_audit_document({'audit_date_stamp': datetime(2025, 1, 5),
+                               'n': 0})
+        self._write(2, 2)
+
+        eq_(list_partitions("audit_data"),
+            ["audit_data_2025_01", "audit_data_2025_02"])
+        eq_(MONGO_CONNECTION.get_collection("audit_data_2025_02").count(), 2)
+        eq_(MONGO_CONNECTION.get_collection("audit_data").count(), 0)
+
+    def test_indexes(self):
+        """Check that the indexes of new partitions are created"""
+
+        self._write(1)
+
+        index_information = MONGO_CONNECTION.get_collection(
+            "audit_data_2025_01").index_information()
+        for index in AUDIT_INDEXES:
+            ok_(index['name'] in index_information)
+
+    def test_read_in_order(self):
+        """Check that the partitions are read in the order of the sort"""
+
+        self._write(3, 1, 2, 1)
+
+        documents = _find_audit_documents(AUDITING_COLLECTION, {})
+        eq_([document['n'] for document in documents], [1, 3, 2, 0])
+
+        newest_first = [('audit_date_stamp', -1), ('_id', -1)]
+        documents = _find_audit_documents(AUDITING_COLLECTION, {},
+                                          sort=newest_first, limit=3)
+        eq_([document['n'] for document in documents], [0, 2, 3])
+
+    def test_pruning(self):
+        """Check that only the partitions for the time range are read"""
+
+        self._write(1, 2, 3)
+
+        names = get_partition_names("audit_data", since=datetime(2025, 2, 10),
+                                    until=datetime(2025, 3, 1))
+        eq_(names, ["audit_data_2025_02", "audit_data_2025_03"])
+
+        documents = _find_audit_documents(AUDITING_COLLECTION, {},
+                                          since=datetime(2025, 2, 10))
+        eq_([document['n'] for document in documents], [1, 2])
+
+    def test_unpartitioned_documents(self):
+        """Check that documents recorded before partitioning are still read"""
+
+        MONGO_CONNECTION.get_collection("audit_data").insert_one(
+            {'audit_date_stamp': datetime(2024, 1, 1), 'n': -1})
+        self._write(1)
+
+        documents = _find_audit_documents(AUDITING_COLLECTION, {})
+        eq_([document['n'] for document in documents], [-1, 0])
+
+    def test_drop(self):
+        """Check that whole partitions are dropped before the month given"""
+
+        self._write(1, 2, 3)
+
+        eq_(drop_partitions("audit_data", datetime(2025, 2, 20)),
+            ["audit_data_2025_01"])
+        eq_(list_partitions("audit_data"),
+            ["audit_data_2025_02", "audit_data_2025_03"])
+
+        stdout = StringIO()
+        call_command('audit_drop_partitions', before="2025-03", stdout=stdout)
+
+        eq_(stdout.getvalue().splitlines(), ["Dropped audit_data_2025_02"])
+
+
+class TestPartitionedModel(PartitionedTestCase, FixtureTestCase):
+    """Tests for the read methods of audited models over partitions"""
+
+    datasets = [PilotData, VesselData]
+
+    def setUp(self):
+        self.setup()
+
+        Pilot(first_name="Brendan", last_name="Costanza", call_sign="Hot Dog",
+              age=25, craft=1, fastest_landing=Decimal("101.67")).save()
+        self.hot_dog = Pilot.objects.get(call_sign="Hot Dog")
+        self.hot_dog.age = 26
+        self.hot_dog.save()
+
+        # Move the creation to an earlier month:
+        partition = MONGO_CONNECTION.get_collection(
+            get_partition_name("audit_data", datetime.utcnow()))
+        creation = partition.find(_get_params_from_model(self.hot_dog))\
+                            .sort('audit_date_stamp')[0]
+        partition.delete_one({'_id': creation['_id']})
+
+        creation['audit_date_stamp'] = datetime(2025, 1, 1)
+        MONGO_CONNECTION.get_collection("audit_data_2025_01").insert_one(
+            creation)
+
+    def tearDown(self):
+        self.teardown()
+
+    def test_get_audit_log(self):
+        """Check that the audit log is read across partitions"""
+
+        log = list(self.hot_dog.get_audit_log())
+
+        eq_([entry['audit_changes']['age'] for entry in log],
+            [(None, 25), (25, 26)])
+        eq_(log[0]['audit_date_stamp'], datetime(2025, 1, 1))
+
+        log = list(self.hot_dog.get_audit_log(since=datetime(2025, 2, 1)))
+        eq_([entry['audit_changes']['age'] for entry in log], [(25, 26)])
+
+    def test_get_creation_log(self):
+        """Check that the creation log is found in an earlier partition"""
+
+        eq_(self.hot_dog.get_creation_log()['age'], 25)
+
+    def test_get_state_at(self):
+        """Check that the state is reconstructed across partitions"""
+
+        eq_(self.hot_dog.get_state_at(datetime(2025, 6, 1))['age'], 25)
+        eq_(self.hot_dog.get_state_at()['age'], 26)
+
+    def test_get_deleted_log(self):
+        """Check that the deletion is found in the current partition"""
+
+        self.hot_dog.delete()
+
+        eq_([datum['call_sign'] for datum in
+             Pilot.get_deleted_log(self.hot_dog.pk)], ["Hot Dog"])
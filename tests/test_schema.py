@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the compact schema of the audit documents"""
+from datetime import datetime
+from decimal import Decimal
+import os
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from StringIO import StringIO
+
+from bson import BSON, ObjectId
+from django.core.management import call_command
+from django.test.utils import override_settings
+from fixture.django_testcase import FixtureTestCase
+from nose.tools import eq_, ok_, raises
+
+from djangoaudit import schema
+from djangoaudit.connection import MONGO_CONNECTION
+from djangoaudit.models import AuditedModel
+from djangoaudit.schema import (SCHEMA_COMPACT, FieldDictionary,
+                                compact_query, decode_document,
+                                encode_document, get_field_dictionary,
+                                register_field_names)
+from djangoaudit.stream import AuditStream
+from tests.fixtures.sampledjango.bsg.models import *
+from tests.fixtures.sampledjango.bsg.fixtures import *
+from tests.utils import skip_unless_mongo_storage
+
+
+def _clear_field_dictionaries():
+    MONGO_CONNECTION.get_collection("audit_schema").drop()
+    schema._FIELD_DICTIONARIES.clear()
+
+
+_DICTIONARY = FieldDictionary("bsg.Vessel", ['name', 'pilot'])
+
+_DOCUMENT = {
+    '_id': ObjectId(),
+    'object_app': "bsg",
+    'object_model': "Vessel",
+    'object_pk': 3,
+    'audit_date_stamp': datetime(2025, 3, 1, 12),
+    'audit_operator': "Adama",
+    'name': "Galactica",
+    'pilot': "Apollo",
+    'pilot_pk': 2,
+    'reason': "Refit",
+    'audit_old_values': {'name': "Pegasus"},
+    'audit_checkpoint': {'name': "Galactica", 'pilot': "Apollo",
+                         'pilot_pk': 2},
+    }
+
+
+class TestDocumentEncoding(object):
+    """Tests for the encoding of documents in the compact schema"""
+
+    def test_encode(self):
+        """Check that the keys are shortened and the fields coded"""
+
+        compact = encode_document(_DOCUMENT, _DICTIONARY)
+
+        eq_(compact, {
+            '_id': _DOCUMENT['_id'],
+            's': 2,
+            'a': "bsg",
+            'm': "Vessel",
+            'p': 3,
+            'd': datetime(2025, 3, 1, 12),
+            'o': "Adama",
+            'v': {'0': "Galactica", '1': "Apollo"},
+            'k': {'1': 2},
+            'i': {'reason': "Refit"},
+            'b': {'0': "Pegasus"},
+            'c': {'v': {'0': "Galactica", '1': "Apollo"}, 'k': {'1': 2}},
+            })
+        ok_(len(BSON.encode(compact)) < len(BSON.encode(_DOCUMENT)))
+
+    def test_round_trip(self):
+        """Check that compact documents are decoded to the standard schema"""
+
+        compact = encode_document(_DOCUMENT, _DICTIONARY)
+
+        eq_(decode_document(compact, _DICTIONARY), _DOCUMENT)
+
+    def test_standard_document(self):
+        """Check that documents in the standard schema are left alone"""
+
+        eq_(decode_document(_DOCUMENT, _DICTIONARY), _DOCUMENT)
+
+    def test_related_pk_only(self):
+        """Check that related objects can be recorded by primary key alone"""
+
+        compact = encode_document(_DOCUMENT, _DICTIONARY, related_pk_only=True)
+
+        eq_(compact['v'], {'0': "Galactica", '1': 2})
+        ok_('k' not in compact)
+
+        standard = decode_document(compact, _DICTIONARY,
+                                   related_fields=frozenset(['pilot']))
+        eq_(standard['pilot'], 2)
+        eq_(standard['pilot_pk'], 2)
+        eq_(standard['audit_checkpoint']['pilot_pk'], 2)
+
+    def test_query(self):
+        """Check that queries are translated to the compact schema"""
+
+        query = {'object_app': "bsg", 'object_pk': 3,
+                 '$and': [{'$or': [{'name': {'$exists': True}},
+                                   {'pilot_pk': {'$exists': True}}]},
+                          {'$nor': [{'audit_date_stamp': {'$lt': 1}}]}]}
+
+        eq_(compact_query(query, _DICTIONARY), {
+            's': 2, 'a': "bsg", 'p': 3,
+            '$and': [{'$or': [{'v.0': {'$exists': True}},
+                              {'k.1': {'$exists': True}}]},
+                     {'$nor': [{'d': {'$lt': 1}}]}]})
+
+
+class TestFieldDictionary(object):
+    """Tests for the field dictionaries kept in MongoDB"""
+
+    def setup(self):
+        skip_unless_mongo_storage()
+
+        _clear_field_dictionaries()
+
+    def teardown(self):
+        _clear_field_dictionaries()
+
+    def test_register(self):
+        """Check that fields keep their codes as new ones are registered"""
+
+        eq_(get_field_dictionary("bsg.Vessel"), None)
+
+        dictionary = register_field_names("bsg.Vessel", ['name'])
+        eq_(dictionary.codes, {'name': '0'})
+
+        dictionary = register_field_names("bsg.Vessel", ['pilot', 'name'])
+        eq_(dictionary.codes, {'name': '0', 'pilot': '1'})
+
+        schema._FIELD_DICTIONARIES.clear()
+        eq_(get_field_dictionary("bsg.Vessel").codes,
+            {'name': '0', 'pilot': '1'})
+
+    def test_many_fields(self):
+        """Check that the codes stay short with many fields"""
+
+        field_names = ['field%d' % index for index in xrange(40)]
+        dictionary = register_field_names("bsg.Vessel", field_names)
+
+        eq_(dictionary.codes['field35'], 'z')
+        eq_(dictionary.codes['field36'], '10')
+
+    def test_unknown_code(self):
+        """Check that the dictionary is reloaded for fields it doesn't know"""
+
+        register_field_names("bsg.Vessel", ['name'])
+        stale_dictionary = get_field_dictionary("bsg.Vessel")
+
+        MONGO_CONNECTION.get_collection("audit_schema").update_one(
+            {'_id': "bsg.Vessel"}, {'$push': {'fields': "pilot"}})
+        compact = encode_document(_DOCUMENT, _DICTIONARY)
+
+        eq_(decode_document(compact, stale_dictionary)['pilot_pk'], 2)
+
+    @raises(ValueError)
+    def test_missing_code(self):
+        """Check that fields missing from the dictionary are reported"""
+
+        register_field_names("bsg.Vessel", ['name'])
+        compact = encode_document(_DOCUMENT, _DICTIONARY)
+
+        decode_document(compact)
+
+
+@raises(AttributeError)
+def test_unknown_schema():
+    """Check that the schema of a model is validated"""
+
+    class Raptor(AuditedModel):
+        audit_schema = 3
+
+        class Meta:
+            abstract = True
+
+
+class TestCompactModel(FixtureTestCase):
+    """Tests for the read methods of models recording compact documents"""
+
+    datasets = [PilotData, VesselData]
+
+    def setUp(self):
+        skip_unless_mongo_storage()
+
+        _clear_field_dictionaries()
+
+        # Start the history in the standard schema:
+        Pilot(first_name="Brendan", last_name="Costanza", call_sign="Hot Dog",
+              age=25, craft=1, fastest_landing=Decimal("101.67")).save()
+        self.hot_dog = Pilot.objects.get(call_sign="Hot Dog")
+
+        Pilot.audit_schema = SCHEMA_COMPACT
+
+        self.hot_dog.age = 26
+        self.hot_dog.set_audit_info(operator="Adama", reason="Promotion")
+        self.hot_dog.save()
+
+        self.collection = MONGO_CONNECTION.get_collection("audit_data")
+
+    def tearDown(self):
+        del Pilot.audit_schema
+        _clear_field_dictionaries()
+
+    def test_recorded(self):
+        """Check that the change is recorded in the compact schema"""
+
+        document = self.collection.find_one({'s': 2, 'p': self.hot_dog.pk})
+
+        eq_(document['a'], "bsg")
+        eq_(document['o'], "Adama")
+        eq_(document['i'], {'reason': "Promotion"})
+        eq_(document['v'], {get_field_dictionary("bsg.Pilot").codes['age']: 26})
+
+    def test_get_audit_log(self):
+        """Check that the history in both schemas is read in order"""
+
+        log = list(self.hot_dog.get_audit_log())
+
+        eq_([entry['audit_changes']['age'] for entry in log],
+            [(None, 25), (25, 26)])
+        eq_(log[1]['audit_operator'], "Adama")
+        eq_(log[1]['reason'], "Promotion")
+        ok_('s' not in log[1])
+
+        newest = list(self.hot_dog.get_audit_log(since=log[1]['audit_date_stamp'],
+                                                 fields=['age']))
+        eq_([entry['audit_changes'] for entry in newest], [{'age': (25, 26)}])
+
+    def test_get_creation_log(self):
+        """Check that the creation log is found in the standard schema"""
+
+        eq_(self.hot_dog.get_creation_log()['age'], 25)
+
+        pilot = Pilot.objects.prefetch_creation_logs().get(pk=self.hot_dog.pk)
+        eq_(pilot.get_creation_log()['age'], 25)
+
+    def test_get_state_at(self):
+        """Check that the state is rebuilt from the documents in both schemas"""
+
+        self.hot_dog.call_sign = "Hotter Dog"
+        self.hot_dog.save()
+
+        state = self.hot_dog.get_state_at()
+        eq_(state['age'], 26)
+        eq_(state['call_sign'], "Hotter Dog")
+        eq_(state['first_name'], "Brendan")
+
+    def test_get_deleted_log(self):
+        """Check that deletions recorded in the compact schema are found"""
+
+        self.hot_dog.delete()
+
+        eq_([datum['call_sign'] for datum in
+             Pilot.get_deleted_log(self.hot_dog.pk)], ["Hot Dog"])
+
+    def test_switched_back(self):
+        """Check that compact documents are still read once switched back"""
+
+        del Pilot.audit_schema
+        schema._FIELD_DICTIONARIES.clear()
+
+        self.hot_dog.age = 27
+        self.hot_dog.save()
+
+        eq_([entry['audit_changes']['age'] for entry in
+             self.hot_dog.get_audit_log()], [(None, 25), (25, 26), (26, 27)])
+
+        Pilot.audit_schema = SCHEMA_COMPACT
+
+    def test_stream(self):
+        """Check that the stream gives the documents in the standard schema"""
+
+        mirror_settings = override_settings(
+            AUDIT_STREAM_MIRROR_COLLECTION="audit_stream")
+        mirror_settings.enable()
+        try:
+            self.hot_dog.age = 27
+            self.hot_dog.save()
+
+            documents = [document for token, document in
+                         AuditStream(follow=False)]
+            eq_(documents[-1]['age'], 27)
+            eq_(documents[-1]['object_model'], "Pilot")
+        finally:
+            MONGO_CONNECTION.get_collection("audit_stream").drop()
+            mirror_settings.disable()
+
+    def test_measure(self):
+        """Check that the measurement command reports both sizes"""
+
+        stdout = StringIO()
+        call_command('audit_measure_schema', models=["bsg.Pilot"],
+                     stdout=stdout)
+
+        line = stdout.getvalue().strip()
+        ok_(line.startswith("bsg.Pilot: "), line)
+        ok_("bytes per document in the standard schema" in line, line)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the spooling of audit documents while MongoDB is unavailable"""
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+import time
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from bson.objectid import ObjectId
+from django.test.utils import override_settings
+from nose.tools import eq_, ok_
+
+from djangoaudit import spool as spool_module
+from djangoaudit.connection import MONGO_CONNECTION, MongoConnectionError
+from djangoaudit.spool import AuditSpool, read_segment
+from djangoaudit.writer import insert_documents
+from tests.test_writer import MockCollectionHandler, MockCollectionTestCase
+from tests.utils import requires_mongo_storage
+
+
+class TestAuditSpool(object):
+    """Tests for :class:`AuditSpool`"""
+
+    def setup(self):
+        self.directory = mkdtemp()
+        self.handler = MockCollectionHandler("audit_data")
+
+    def teardown(self):
+        rmtree(self.directory)
+
+    def _spool_documents(self, spool, count):
+        documents = [{'_id': ObjectId(), 'n': number} for number in
+                     range(count)]
+        for document in documents:
+            spool.append([(self.handler, document)])
+        return documents
+
+    def test_read_back(self):
+        """Check that the spooled documents are read back in order"""
+
+        spool = AuditSpool(self.directory)
+        documents = self._spool_documents(spool, 3)
+        spool.close()
+
+        segments = spool.get_segments()
+        eq_(len(segments), 1)
+        eq_(read_segment(segments[0]),
+            [(u'audit_data', document) for document in documents])
+
+    def test_incomplete_record(self):
+        """Check that a record cut short by a crash is ignored"""
+
+        spool = AuditSpool(self.directory)
+        documents = self._spool_documents(spool, 2)
+        spool.close()
+
+        path = spool.get_segments()[0]
+        segment_file = open(path, 'ab')
+        segment_file.write(open(path, 'rb').read()[:10])
+        segment_file.close()
+
+        eq_(read_segment(path),
+            [(u'audit_data', document) for document in documents])
+
+    def test_rotation(self):
+        """Check that full segments are sealed and a new one started"""
+
+        spool = AuditSpool(self.directory, segment_size=1)
+        self._spool_documents(spool, 3)
+
+        eq_(len(spool.get_segments()), 3)
+
+    def test_flushed(self):
+        """Check that each append reaches the segment file straight away"""
+
+        spool = AuditSpool(self.directory, fsync_documents=100)
+        documents = self._spool_documents(spool, 2)
+
+        eq_(read_segment(spool._segment_path),
+            [(u'audit_data', document) for document in documents])
+        spool.close()
+
+    def test_interval_sync(self):
+        """Check that the documents are synced once the interval has passed"""
+
+        spool = AuditSpool(self.directory, fsync_interval=0.01,
+                           fsync_documents=100)
+        self._spool_documents(spool, 1)
+        eq_(spool._unsynced, 1)
+
+        time.sleep(0.1)
+        eq_(spool._unsynced, 0)
+        spool.close()
+
+    def test_fork(self):
+        """Check that the segment of the parent process is closed, unsealed"""
+
+        spool = AuditSpool(self.directory)
+        self._spool_documents(spool, 1)
+        parent_segment = spool._segment
+
+        # As if the segment had been started by the parent process:
+        spool._pid = os.getpid() + 1
+        self._spool_documents(spool, 1)
+
+        ok_(parent_segment.closed)
+        ok_(spool._segment is not parent_segment)
+        eq_(spool.get_segments(), [])
+        spool.close()
+
+    def test_pending_documents_counted(self):
+        """Check that the segments are only counted once"""
+
+        spool = AuditSpool(self.directory, segment_size=1)
+        ok_(not spool.has_pending_documents())
+
+        self._spool_documents(spool, 2)
+
+        def get_segments():
+            raise AssertionError("The segments were counted again")
+        spool.get_segments = get_segments
+
+        ok_(spool.has_pending_documents())
+        eq_(spool._segment_count, 2)
+
+    @requires_mongo_storage
+    def test_replay(self):
+        """Check that replaying writes the documents once and in order"""
+
+        spool = AuditSpool(self.directory, segment_size=100)
+        documents = self._spool_documents(spool, 4)
+
+        # As if an earlier replay had been interrupted:
+        collection = MONGO_CONNECTION.get_collection("audit_data")
+        collection.insert_one(dict(documents[1]))
+
+        spool.replay(batch_size=2)
+
+        replayed = list(collection.find({'_id': {'$in': [
+            document['_id'] for document in documents]}}))
+        eq_(sorted(replayed, key=lambda document: document['n']), documents)
+        eq_(spool.get_segments(), [])
+        eq_(spool.replayed, 4)
+        ok_(not spool.has_pending_documents())
+
+    @requires_mongo_storage
+    def test_replay_unavailable(self):
+        """Check that segments are kept until MongoDB is available"""
+
+        spool = AuditSpool(self.directory)
+        self._spool_documents(spool, 2)
+
+        def get_collection(collection_name):
+            raise MongoConnectionError("down")
+
+        original_get_collection = MONGO_CONNECTION.get_collection
+        MONGO_CONNECTION.get_collection = get_collection
+        try:
+            eq_(spool.replay(), 0)
+        finally:
+            MONGO_CONNECTION.get_collection = original_get_collection
+
+        eq_(len(spool.get_segments()), 1)
+        eq_(spool.replay(), 1)
+
+
+class TestSpoolDocuments(MockCollectionTestCase):
+    """Tests for the spooling of documents which cannot be written"""
+
+    def setup(self):
+        super(TestSpoolDocuments, self).setup()
+        self.directory = mkdtemp()
+        spool_module._AUDIT_SPOOL = None
+
+    def teardown(self):
+        spool_module._AUDIT_SPOOL = None
+        rmtree(self.directory)
+        super(TestSpoolDocuments, self).teardown()
+
+    def test_insert_documents(self):
+        """Check that documents are spooled when MongoDB is unavailable"""
+
+        broken = MockCollectionHandler("audit_data", MongoConnectionError("down"))
+
+        with override_settings(AUDIT_SPOOL_DIR=self.directory):
+            written = insert_documents([(broken, {'n': 1})])
+            spool = spool_module.get_audit_spool()
+            spool.close()
+
+        eq_(written, 1)
+        eq_(spool.spooled, 1)
+        eq_(read_segment(spool.get_segments()[0]),
+            [(u'audit_data', {'n': 1})])
+
+    def test_not_enabled(self):
+        """Check that documents are discarded if spooling isn't enabled"""
+
+        broken = MockCollectionHandler("audit_data", MongoConnectionError("down"))
+
+        eq_(insert_documents([(broken, {'n': 1})]), 0)
+        ok_(spool_module.get_audit_spool() is None)
+        eq_(os.listdir(self.directory), [])
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the storage backends"""
+from datetime import datetime
+from decimal import Decimal
+import os
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from bson import ObjectId
+from django.test.utils import override_settings
+from fixture.django_testcase import FixtureTestCase
+from nose.tools import assert_raises, eq_, ok_, raises
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from djangoaudit.connection import MONGO_CONNECTION
+from djangoaudit.memory import MemoryStorage
+from djangoaudit.models import AUDITING_COLLECTION, _get_collection_handler
+from djangoaudit.partitions import drop_partitions
+from djangoaudit.schema import SCHEMA_COMPACT, get_field_dictionary
+from djangoaudit.storage import (MEMORY_STORAGE, MONGO_STORAGE, AuditStorage,
+                                 MongoStorage, get_storage_backend)
+from djangoaudit.stream import AuditStream
+from tests.fixtures.sampledjango.bsg.models import *
+from tests.fixtures.sampledjango.bsg.fixtures import *
+from tests.utils import skip_unless_mongo_storage
+
+
+_COLLECTION_NAME = "audit_storage_test"
+
+_NEWEST_FIRST = [('audit_date_stamp', DESCENDING), ('_id', DESCENDING)]
+
+
+def _make_document(pk, day, model="Pilot", **values):
+    document = dict(_id=ObjectId(), object_app="bsg", object_model=model,
+                    object_pk=pk, audit_date_stamp=datetime(2025, 1, day))
+    document.update(values)
+    return document
+
+
+class _StorageTests(object):
+    """Tests of the interface common to all the storage backends"""
+
+    def setup(self):
+        self.storage = self.make_storage()
+        self.collection = _get_collection_handler(_COLLECTION_NAME)
+
+        self.documents = [
+            _make_document(1, 1, age=20),
+            _make_document(2, 2, age=30),
+            _make_document(1, 3, age=21),
+            _make_document(2, 4, age=31, audit_is_delete=True),
+            _make_document(1, 5, model="Vessel", name="Raptor"),
+            ]
+        self.storage.insert(self.collection, self.documents[0])
+        self.storage.insert_many(self.collection, self.documents[1:])
+
+    def _find(self, query, **kwargs):
+        return [(document['object_pk'], document['audit_date_stamp'].day)
+                for document in self.storage.find_by_object(
+                    self.collection, dict(query, object_app="bsg",
+                                          object_model="Pilot"), **kwargs)]
+
+    def test_find_by_object(self):
+        """Check that the documents of objects are found in order"""
+
+        eq_(self._find({'object_pk': 1}), [(1, 1), (1, 3)])
+        eq_(self._find({'object_pk': {'$in': [1, 2]}}, sort=_NEWEST_FIRST),
+            [(2, 4), (1, 3), (2, 2), (1, 1)])
+        eq_(self._find({}, sort=_NEWEST_FIRST, limit=2), [(2, 4), (1, 3)])
+        query = {'audit_date_stamp': {'$gte': datetime(2025, 1, 2)},
+                 '$or': [{'age': {'$exists': True}},
+                         {'name': {'$exists': True}}],
+                 '$nor': [{'audit_is_delete': True}]}
+        eq_(self._find(query), [(2, 2), (1, 3)])
+
+    def test_query_without_model(self):
+        """Check that the documents can be found without their model"""
+
+        documents = self.storage.find_by_object(self.collection,
+                                                {'object_pk': 1},
+                                                sort=_NEWEST_FIRST)
+        eq_([document['audit_date_stamp'].day for document in documents],
+            [5, 3, 1])
+
+    def test_projection(self):
+        """Check that only the keys in the projection are returned"""
+
+        documents = list(self.storage.find_by_object(
+            self.collection, dict(object_app="bsg", object_model="Pilot",
+                                  object_pk=1), ['age']))
+        eq_([sorted(document) for document in documents],
+            [['_id', 'age'], ['_id', 'age']])
+
+    def test_find_deletions(self):
+        """Check that only the documents recording deletions are found"""
+
+        query = dict(audit_is_delete=True, object_app="bsg",
+                     object_model="Pilot")
+        eq_([document['age'] for document in
+             self.storage.find_deletions(self.collection, query)], [31])
+
+        query['object_pk'] = 1
+        eq_(list(self.storage.find_deletions(self.collection, query)), [])
+
+        eq_([document['age'] for document in self.storage.find_deletions(
+            self.collection, {'audit_is_delete': True})], [31])
+
+    def test_find_first(self):
+        """Check that the first document of each object is found"""
+
+        query = dict(object_app="bsg", object_model="Pilot",
+                     object_pk={'$in': [1, 2, 3]})
+        documents = self.storage.find_first(
+            self.collection, query, [('audit_date_stamp', ASCENDING)])
+        eq_(sorted(document['age'] for document in documents), [20, 30])
+
+    @raises(PyMongoError)
+    def test_duplicate_id(self):
+        """Check that documents can't be inserted twice"""
+
+        self.storage.insert(self.collection, self.documents[0])
+
+    def test_unordered_insert(self):
+        """Check that an unordered insert writes all the documents it can"""
+
+        documents = [_make_document(3, 6, age=40), self.documents[0],
+                     _make_document(3, 7, age=41)]
+        with assert_raises(PyMongoError):
+            self.storage.insert_many(self.collection, documents,
+                                     ordered=False)
+        eq_(self._find({'object_pk': 3}), [(3, 6), (3, 7)])
+
+    def test_ordered_insert(self):
+        """Check that an ordered insert stops at the first failure"""
+
+        documents = [_make_document(3, 6, age=40), self.documents[0],
+                     _make_document(3, 7, age=41)]
+        with assert_raises(PyMongoError):
+            self.storage.insert_many(self.collection, documents)
+        eq_(self._find({'object_pk': 3}), [(3, 6)])
+
+
+class TestMongoStorage(_StorageTests):
+    """Tests for :class:`MongoStorage`"""
+
+    def setup(self):
+        skip_unless_mongo_storage()
+        super(TestMongoStorage, self).setup()
+
+    def make_storage(self):
+        return MongoStorage()
+
+    def teardown(self):
+        MONGO_CONNECTION.database.drop_collection(_COLLECTION_NAME)
+
+
+class TestMemoryStorage(_StorageTests):
+    """Tests for :class:`MemoryStorage`"""
+
+    def make_storage(self):
+        return MemoryStorage()
+
+    def test_bson_round_trip(self):
+        """Check that documents are read back as MongoDB would give them"""
+
+        document = _make_document(3, 6, audit_changes={'age': (25, 26)})
+        document['audit_date_stamp'] = datetime(2025, 1, 6, 12, 0, 0, 123456)
+        self.storage.insert(self.collection, document)
+
+        query = dict(object_app="bsg", object_model="Pilot", object_pk=3)
+        stored = next(self.storage.find_by_object(self.collection, query))
+        eq_(stored['audit_changes'], {'age': [25, 26]})
+        eq_(stored['audit_date_stamp'], datetime(2025, 1, 6, 12, 0, 0, 123000))
+
+        # Changing the documents read doesn't change the ones stored:
+        stored['audit_changes']['age'].append(27)
+        stored = next(self.storage.find_by_object(self.collection, query))
+        eq_(stored['audit_changes'], {'age': [25, 26]})
+
+    @raises(ValueError)
+    def test_unsupported_operator(self):
+        """Check that the operators which aren't supported are reported"""
+
+        list(self.storage.find_by_object(self.collection,
+                                         {'name': {'$regex': "^R"}}))
+
+    def test_clear(self):
+        """Check that all the documents can be discarded"""
+
+        self.storage.clear()
+        eq_(self._find({}), [])
+
+
+@raises(TypeError)
+def test_incomplete_backend():
+    """Check that the backends must implement all the methods"""
+
+    class WriteOnlyStorage(AuditStorage):
+        def insert(self, collection, document):
+            pass
+
+        def insert_many(self, collection, documents, ordered=True):
+            pass
+
+    WriteOnlyStorage()
+
+
+class TestStorageBackends(FixtureTestCase):
+    """Tests for the selection of the storage backend"""
+
+    datasets = [PilotData, VesselData]
+
+    def tearDown(self):
+        with override_settings(AUDIT_STORAGE_BACKEND=MEMORY_STORAGE):
+            get_storage_backend().clear()
+
+    @override_settings(AUDIT_STORAGE_BACKEND=MONGO_STORAGE)
+    def test_mongo(self):
+        """Check that the MongoDB backend is selected by its path"""
+
+        ok_(isinstance(get_storage_backend(), MongoStorage))
+
+    @override_settings(AUDIT_STORAGE_BACKEND=MEMORY_STORAGE)
+    def test_memory(self):
+        """Check that the audited models use the in-memory backend"""
+
+        storage = get_storage_backend()
+        ok_(isinstance(storage, MemoryStorage))
+        ok_(get_storage_backend() is storage)
+
+        hot_dog = Pilot(first_name="Brendan", last_name="Costanza",
+                        call_sign="Hot Dog", age=25, craft=1,
+                        fastest_landing=Decimal("101.67"))
+        hot_dog.save()
+        hot_dog.age = 26
+        hot_dog.save()
+
+        eq_([entry['audit_changes'].get('age') for entry in
+             hot_dog.get_audit_log()], [(None, 25), (25, 26)])
+        eq_(hot_dog.get_state_at()['age'], 26)
+
+        hot_dog = Pilot.objects.prefetch_creation_logs().get(pk=hot_dog.pk)
+        eq_(hot_dog.get_creation_log()['age'], 25)
+
+        pk = hot_dog.pk
+        hot_dog.delete()
+        eq_([log['age'] for log in Pilot.get_deleted_log(pk)], [26])
+
+        query = dict(object_app="bsg", object_model="Pilot", object_pk=pk)
+        eq_(len(list(storage.find_by_object(AUDITING_COLLECTION, query))), 3)
+
+    @override_settings(AUDIT_STORAGE_BACKEND=MEMORY_STORAGE)
+    def test_memory_compact_schema(self):
+        """Check that the in-memory backend records the standard schema"""
+
+        Pilot.audit_schema = SCHEMA_COMPACT
+        try:
+            Pilot(first_name="Brendan", last_name="Costanza",
+                  call_sign="Hot Dog", age=25, craft=1,
+                  fastest_landing=Decimal("101.67")).save()
+        finally:
+            del Pilot.audit_schema
+
+        hot_dog = Pilot.objects.get(call_sign="Hot Dog")
+        query = dict(object_app="bsg", object_model="Pilot",
+                     object_pk=hot_dog.pk)
+        document = next(get_storage_backend().find_by_object(
+            AUDITING_COLLECTION, query))
+        eq_(document['age'], 25)
+        ok_('s' not in document)
+
+    @override_settings(AUDIT_STORAGE_BACKEND=MEMORY_STORAGE)
+    def test_mongo_only_features(self):
+        """Check that the features which need MongoDB are reported"""
+
+        with assert_raises(NotImplementedError) as context:
+            AuditStream(follow=False)
+        ok_("The audit stream" in str(context.exception))
+
+        with assert_raises(NotImplementedError) as context:
+            drop_partitions("audit_data", datetime(2025, 1, 1))
+        ok_("Partitioning" in str(context.exception))
+
+        with assert_raises(NotImplementedError) as context:
+            get_field_dictionary("bsg.Unknown")
+        ok_("The compact schema" in str(context.exception))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the streaming of the audit documents"""
+import os
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from StringIO import StringIO
+
+from bson import json_util
+from django.core.management import call_command
+from django.test.utils import override_settings
+from nose.tools import eq_, raises
+
+from djangoaudit.connection import MONGO_CONNECTION
+from djangoaudit.models import (AUDITING_COLLECTION, _get_collection_handler,
+                                _write_audit_document, _write_audit_documents)
+from djangoaudit.storage import get_storage_backend
+from djangoaudit.stream import AuditStream, STREAM_MIRROR
+from tests.utils import drop_audit_collection, requires_mongo_storage
+
+
+class TestMirrorStream(object):
+    """Tests for :class:`AuditStream` reading the mirror collection"""
+
+    def setup(self):
+        self.settings = override_settings(
+            AUDIT_STREAM_MIRROR_COLLECTION="audit_stream")
+        self.settings.enable()
+        drop_audit_collection("audit_stream")
+
+        _write_audit_document({'n': 0})
+        _write_audit_documents([{'n': 1}, {'n': 2}])
+
+    def teardown(self):
+        drop_audit_collection("audit_stream")
+        self.settings.disable()
+
+    def _find(self, collection):
+        return list(get_storage_backend().find_by_object(
+            collection, {}, sort=[('n', 1)]))
+
+    def test_mirrored(self):
+        """Check that the audit documents are written to the mirror too"""
+
+        eq_(self._find(_get_collection_handler("audit_stream")),
+            self._find(AUDITING_COLLECTION))
+
+    @requires_mongo_storage
+    def test_read(self):
+        """Check that the documents are read in order with their tokens"""
+
+        events = list(AuditStream(follow=False))
+
+        eq_([document['n'] for token, document in events], [0, 1, 2])
+        eq_([token for token, document in events],
+            [{'_id': document['_id']} for token, document in events])
+
+    @requires_mongo_storage
+    def test_resume(self):
+        """Check that a stream carries on after the token it's given"""
+
+        stream = AuditStream(follow=False)
+        events = list(stream)
+
+        eq_(stream.resume_token, events[-1][0])
+
+        resumed = AuditStream(resume_after=events[0][0], follow=False)
+        eq_([document['n'] for token, document in resumed], [1, 2])
+
+    @requires_mongo_storage
+    def test_resume_overwritten(self):
+        """Check that the stream restarts if the token is no longer there"""
+
+        token = list(AuditStream(follow=False))[0][0]
+        MONGO_CONNECTION.get_collection("audit_stream").delete_one(token)
+
+        resumed = AuditStream(resume_after=token, follow=False)
+        eq_([document['n'] for token, document in resumed], [1, 2])
+
+    @requires_mongo_storage
+    def test_command(self):
+        """Check that the management command writes one line per document"""
+
+        stdout = StringIO()
+        call_command('audit_stream', limit=2, stdout=stdout)
+
+        lines = [json_util.loads(line) for line in
+                 stdout.getvalue().splitlines()]
+        eq_([line['document']['n'] for line in lines], [0, 1])
+
+        stdout = StringIO()
+        call_command('audit_stream',
+                     resume_after=json_util.dumps(lines[-1]['token']),
+                     stdout=stdout)
+
+        eq_([json_util.loads(line)['document']['n'] for line in
+             stdout.getvalue().splitlines()], [2])
+
+
+@raises(ValueError)
+def test_mirror_not_enabled():
+    """Check that the mirror can only be read if it's enabled"""
+
+    AuditStream(source=STREAM_MIRROR)
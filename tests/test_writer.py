@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Tests for the writing of audit documents"""
+import os
+from Queue import Queue
+from shutil import rmtree
+from tempfile import mkdtemp
+
+# Have to set this here to ensure this is Django-like
+os.environ['DJANGO_SETTINGS_MODULE'] =  "tests.fixtures.sampledjango.settings"
+
+from django.test.utils import override_settings
+from nose.tools import eq_, ok_, raises
+from pymongo.errors import AutoReconnect, OperationFailure
+
+from djangoaudit.batching import (audit_batch, begin_audit_batch,
+                                  end_audit_batch, get_current_batch,
+                                  reset_audit_batch)
+from djangoaudit.connection import MongoConnectionError
+from djangoaudit.middleware import AuditBatchMiddleware
+from djangoaudit.spool import AuditSpool, read_segment
+from djangoaudit.storage import MONGO_STORAGE
+from djangoaudit.writer import (AuditWriter, insert_documents, OVERFLOW_SPILL,
+                                OVERFLOW_DROP_OLDEST)
+
+
+class MockCollection(object):
+    """ Mock of :class:`pymongo.collection.Collection` """
+
+    def __init__(self, error=None):
+        self.error = error
+        self.inserts = []
+
+    def insert_many(self, documents, ordered=True):
+        if self.error:
+            raise self.error
+        self.inserts.append(list(documents))
+
+
+class MockCollectionHandler(object):
+    """ Mock of :class:`djangoaudit.models._collection_handler` """
+
+    def __init__(self, collection_name, error=None):
+        self.collection_name = collection_name
+        self.collection = MockCollection(error)
+
+    def __call__(self):
+        return self.collection
+
+
+class MockCollectionTestCase(object):
+    """
+    Write the audit documents through the MongoDB storage backend for the
+    duration of each test, whichever backend is selected, so that they reach
+    the mock collections
+
+    """
+
+    def setup(self):
+        self.storage_settings = override_settings(
+            AUDIT_STORAGE_BACKEND=MONGO_STORAGE)
+        self.storage_settings.enable()
+
+    def teardown(self):
+        self.storage_settings.disable()
+
+
+class TestInsertDocuments(MockCollectionTestCase):
+    """Tests for :func:`insert_documents`"""
+
+    def test_one_insert_per_collection(self):
+        """Check that documents are grouped per collection in their original order"""
+
+        first = MockCollectionHandler("first")
+        second = MockCollectionHandler("second")
+
+        written = insert_documents([(first, {'n': 1}), (second, {'n': 2}),
+                                    (first, {'n': 3})])
+
+        eq_(written, 3)
+        eq_(first.collection.inserts, [[{'n': 1}, {'n': 3}]])
+        eq_(second.collection.inserts, [[{'n': 2}]])
+
+    def test_failures_are_not_raised(self):
+        """Check that connection failures are logged rather than raised"""
+
+        broken = MockCollectionHandler("broken", MongoConnectionError("down"))
+        flaky = MockCollectionHandler("flaky", AutoReconnect("flaky"))
+        working = MockCollectionHandler("working")
+
+        written = insert_documents([(broken, {'n': 1}), (flaky, {'n': 2}),
+                                    (working, {'n': 3})])
+
+        eq_(written, 1)
+        eq_(working.collection.inserts, [[{'n': 3}]])
+
+    @raises(OperationFailure)
+    def test_raise_errors(self):
+        """Check that failures can be raised instead"""
+
+        broken = MockCollectionHandler("broken", OperationFailure("full"))
+
+        insert_documents([(broken, {'n': 1})], raise_errors=True)
+
+
+class TestAuditWriter(MockCollectionTestCase):
+    """Tests for :class:`AuditWriter`"""
+
+    def setup(self):
+        super(TestAuditWriter, self).setup()
+        self.handler = MockCollectionHandler("audit_data")
+
+    @raises(ValueError)
+    def test_unknown_policy(self):
+        """Check that unknown overflow policies are rejected"""
+
+        AuditWriter(overflow_policy='explode')
+
+    @raises(ValueError)
+    def test_spill_without_spool(self):
+        """Check that spilling requires a spool to spill to"""
+
+        AuditWriter(overflow_policy=OVERFLOW_SPILL)
+
+    def test_batching(self):
+        """Check that queued documents are written in batches on flush"""
+
+        writer = AuditWriter(batch_size=2, flush_interval=0.01)
+
+        for n in range(5):
+            writer.put(self.handler, {'n': n})
+        writer.flush()
+
+        written = [document['n'] for batch in self.handler.collection.inserts
+                   for document in batch]
+        eq_(written, range(5))
+        ok_(max(len(batch) for batch in self.handler.collection.inserts) <= 2)
+
+        stats = writer.stats()
+        eq_(stats['written'], 5)
+        eq_(stats['queue_depth'], 0)
+        writer.shutdown()
+
+    def test_shutdown_writes_queued_documents(self):
+        """Check that shutting down writes out anything still queued"""
+
+        writer = AuditWriter(batch_size=100, flush_interval=60)
+        writer.put(self.handler, {'n': 1})
+        writer.shutdown(timeout=5)
+
+        eq_(self.handler.collection.inserts, [[{'n': 1}]])
+
+    def test_unexpected_errors(self):
+        """Check that the worker survives errors other than MongoDB's"""
+
+        broken = MockCollectionHandler("broken", ValueError("unencodable"))
+        writer = AuditWriter(batch_size=1, flush_interval=0.01)
+
+        writer.put(broken, {'n': 1})
+        writer.flush()
+        writer.put(self.handler, {'n': 2})
+        writer.flush()
+
+        eq_(self.handler.collection.inserts, [[{'n': 2}]])
+        eq_(writer.stats()['failed'], 1)
+        eq_(writer.stats()['written'], 1)
+        writer.shutdown()
+
+    def test_shutdown_timeout(self):
+        """Check that the worker is kept if it outlives the shutdown"""
+
+        writer = AuditWriter()
+        writer._ensure_worker()
+        writer._thread.join = lambda timeout: None
+        writer._thread.is_alive = lambda: True
+
+        writer.shutdown(timeout=0)
+        ok_(writer._thread is not None)
+
+        del writer._thread.join, writer._thread.is_alive
+        writer.shutdown()
+        eq_(writer._thread, None)
+
+    def test_drop_oldest(self):
+        """Check that the oldest documents are dropped when the queue is full"""
+
+        writer = AuditWriter(queue_size=1, overflow_policy=OVERFLOW_DROP_OLDEST)
+
+        # Fill the queue without a worker so that nothing is drained:
+        writer._ensure_worker = lambda: None
+        writer._queue = Queue(1)
+
+        writer.put(self.handler, {'n': 1})
+        writer.put(self.handler, {'n': 2})
+
+        eq_(writer.dropped, 1)
+        eq_(writer._queue.get_nowait(), (self.handler, {'n': 2}))
+
+    def test_spill(self):
+        """Check that documents are spilled to file when the queue is full"""
+
+        spool_directory = mkdtemp()
+
+        try:
+            spool = AuditSpool(spool_directory)
+            writer = AuditWriter(queue_size=1, overflow_policy=OVERFLOW_SPILL,
+                                 spool=spool)
+            writer._ensure_worker = lambda: None
+            writer._queue = Queue(1)
+
+            writer.put(self.handler, {'n': 1})
+            writer.put(self.handler, {'n': 2})
+
+            eq_(writer.spilled, 1)
+            spool.close()
+            spilled = read_segment(spool.get_segments()[0])
+            eq_(spilled, [(u'audit_data', {'n': 2})])
+        finally:
+            rmtree(spool_directory)
+
+
+class TestAuditBatch(MockCollectionTestCase):
+    """Tests for :func:`audit_batch` and :class:`AuditBatchMiddleware`"""
+
+    def setup(self):
+        super(TestAuditBatch, self).setup()
+        self.handler = MockCollectionHandler("audit_data")
+
+    def test_no_batch_by_default(self):
+        """Check that documents are not batched outside of a batch"""
+
+        eq_(get_current_batch(), None)
+
+    def test_single_write_in_order(self):
+        """Check that a batch is written with a single insert in save order"""
+
+        with audit_batch() as batch:
+            for n in range(3):
+                batch.add(self.handler, {'n': n})
+
+            eq_(self.handler.collection.inserts, [])
+
+        eq_(self.handler.collection.inserts, [[{'n': 0}, {'n': 1}, {'n': 2}]])
+        eq_(get_current_batch(), None)
+
+    def test_nested_batches(self):
+        """Check that nested batches are only written by the outermost one"""
+
+        with audit_batch() as outer:
+            outer.add(self.handler, {'n': 0})
+
+            with audit_batch() as inner:
+                ok_(inner is outer)
+                inner.add(self.handler, {'n': 1})
+
+            eq_(self.handler.collection.inserts, [])
+
+        eq_(self.handler.collection.inserts, [[{'n': 0}, {'n': 1}]])
+
+    def test_written_on_exception(self):
+        """Check that a batch is still written if its block raises"""
+
+        try:
+            with audit_batch() as batch:
+                batch.add(self.handler, {'n': 0})
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+
+        eq_(self.handler.collection.inserts, [[{'n': 0}]])
+
+    def test_unbalanced_end(self):
+        """Check that ending a batch which was never started is a no-op"""
+
+        end_audit_batch()
+        eq_(get_current_batch(), None)
+
+    def test_middleware(self):
+        """Check the middleware batches the documents of a request"""
+
+        middleware = AuditBatchMiddleware()
+        middleware.process_request(None)
+        get_current_batch().add(self.handler, {'n': 0})
+        eq_(self.handler.collection.inserts, [])
+
+        response = object()
+        ok_(middleware.process_response(None, response) is response)
+        eq_(self.handler.collection.inserts, [[{'n': 0}]])
+
+    def test_reset(self):
+        """Check that a nested batch can be written out and ended at once"""
+
+        begin_audit_batch()
+        begin_audit_batch()
+        get_current_batch().add(self.handler, {'n': 0})
+
+        reset_audit_batch()
+        eq_(self.handler.collection.inserts, [[{'n': 0}]])
+        eq_(get_current_batch(), None)
+
+    def test_middleware_exception(self):
+        """Check the middleware writes the batch when the view raises"""
+
+        middleware = AuditBatchMiddleware()
+        middleware.process_request(None)
+        get_current_batch().add(self.handler, {'n': 0})
+
+        eq_(middleware.process_exception(None, RuntimeError()), None)
+        eq_(self.handler.collection.inserts, [[{'n': 0}]])
+        eq_(get_current_batch(), None)
+
+        # The response made from the exception doesn't end any other batch:
+        with audit_batch() as batch:
+            middleware.process_response(None, object())
+            ok_(get_current_batch() is batch)
+
+    def test_middleware_response_skipped(self):
+        """Check that a batch left open by a request is ended by the next"""
+
+        middleware = AuditBatchMiddleware()
+        middleware.process_request(None)
+        get_current_batch().add(self.handler, {'n': 0})
+
+        # The response to that request never reaches the middleware:
+        middleware.process_request(None)
+        eq_(self.handler.collection.inserts, [[{'n': 0}]])
+
+        get_current_batch().add(self.handler, {'n': 1})
+        middleware.process_response(None, object())
+        eq_(self.handler.collection.inserts, [[{'n': 0}], [{'n': 1}]])
+        eq_(get_current_batch(), None)
+
+    def test_middleware_callable(self):
+        """Check the middleware batches the documents of a request when called"""
+
+        def get_response(request):
+            get_current_batch().add(self.handler, {'n': 0})
+            eq_(self.handler.collection.inserts, [])
+            return request
+
+        middleware = AuditBatchMiddleware(get_response)
+        eq_(middleware('request'), 'request')
+        eq_(self.handler.collection.inserts, [[{'n': 0}]])
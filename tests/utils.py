@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+# Copyright (c) 2010, 2degrees Limited <egoddard@tech.2degreesnetwork.com>.
+# All Rights Reserved.
+#
+# This file is part of djangoaudit <https://launchpad.net/django-audit/>,
+# which is subject to the provisions of the BSD at
+# <http://dev.2degreesnetwork.com/p/2degrees-license.html>. A copy of the
+# license should accompany this distribution. THIS SOFTWARE IS PROVIDED "AS IS"
+# AND ANY AND ALL EXPRESS OR IMPLIED WARRANTIES ARE DISCLAIMED, INCLUDING, BUT
+# NOT LIMITED TO, THE IMPLIED WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST
+# INFRINGEMENT, AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+
+"""Utilities for the tests"""
+from functools import wraps
+
+from nose.plugins.skip import SkipTest
+
+from djangoaudit.connection import MONGO_CONNECTION
+from djangoaudit.storage import MongoStorage, get_storage_backend
+
+__all__ = ["drop_audit_collection", "find_audit_documents",
+           "requires_mongo_storage", "skip_unless_mongo_storage"]
+
+
+def skip_unless_mongo_storage():
+    """
+    Skip the current test unless the audit documents are kept in MongoDB, for
+    the tests of the features which use MongoDB directly
+
+    :raises SkipTest: If another storage backend is selected (e.g. by
+        ``--django-mongo-in-memory``)
+
+    """
+    if not isinstance(get_storage_backend(), MongoStorage):
+        raise SkipTest("The MongoDB storage backend is not selected")
+
+
+def requires_mongo_storage(test):
+    """Skip ``test`` unless the audit documents are kept in MongoDB"""
+
+    @wraps(test)
+    def wrapper(*args, **kwargs):
+        skip_unless_mongo_storage()
+        return test(*args, **kwargs)
+    return wrapper
+
+
+def find_audit_documents(collection, **query):
+    """
+    Return the audit documents in ``collection`` (a collection handler)
+    matching ``query``, in the order they were recorded, whichever storage
+    backend is selected
+
+    """
+    sort = [('audit_date_stamp', 1), ('_id', 1)]
+    return list(get_storage_backend().find_by_object(collection, query,
+                                                     sort=sort))
+
+
+def drop_audit_collection(collection_name):
+    """
+    Discard the audit documents in the collection named ``collection_name``,
+    whichever storage backend is selected
+
+    """
+    storage = get_storage_backend()
+    if isinstance(storage, MongoStorage):
+        MONGO_CONNECTION.get_collection(collection_name).drop()
+    else:
+        storage.clear(collection_name)